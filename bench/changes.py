@@ -0,0 +1,128 @@
+"""
+Benchmark of the change feed against polling the feed: --consumers threads follow the new posts for --duration seconds
+while one writer creates --rate posts per second, with one of the modes
+    poll       GET /posts/feed/?limit=50 every --interval seconds, a post is seen when it is on the first page
+    changes    GET /posts/changes/?since=<cursor>&wait=25 (long-poll)
+    sse        GET /posts/changes/?stream=sse, one connection per consumer
+For every mode the requests and MB the consumers read, and the delay between the create and the moment a consumer
+saw the post (p50/p95, over all consumers and posts) are printed.
+Needs a running service (see README.md), the posts are created without media.
+
+Usage:
+    python -m bench.changes --url http://127.0.0.1:8000 --consumers 50 --rate 5 --duration 20
+"""
+
+import argparse
+import json
+import threading
+import time
+
+import requests
+
+from bench.stats import percentile
+
+MODES = ['poll', 'changes', 'sse']
+
+
+class Consumer(threading.Thread):
+    def __init__(self, mode, url, created, deadline, interval):
+        super().__init__(daemon=True)
+        self.mode, self.url, self.created, self.deadline, self.interval = mode, url, created, deadline, interval
+        self.session = requests.Session()
+        self.seen = {}
+        self.requests = 0
+        self.bytes = 0
+
+    def see(self, post_id):
+        if post_id in self.created and post_id not in self.seen:
+            self.seen[post_id] = time.monotonic()
+
+    def run(self):
+        if self.mode == 'poll':
+            while time.monotonic() < self.deadline:
+                response = self.session.get(f'{self.url}/posts/feed/', params={'limit': 50}, timeout=30)
+                self.requests += 1
+                self.bytes += len(response.content)
+                for post in response.json()['posts']:
+                    self.see(post['post_id'])
+                time.sleep(self.interval)
+
+        elif self.mode == 'changes':
+            cursor = self.session.get(f'{self.url}/posts/changes/', params={'since': 'now'}, timeout=30).json()['next_cursor']
+            while time.monotonic() < self.deadline:
+                response = self.session.get(f'{self.url}/posts/changes/', params={'since': cursor, 'wait': 25}, timeout=60)
+                self.requests += 1
+                self.bytes += len(response.content)
+                page = response.json()
+                for change in page['changes']:
+                    self.see(change['post_id'])
+                cursor = page['next_cursor']
+
+        else:
+            cursor = self.session.get(f'{self.url}/posts/changes/', params={'since': 'now'}, timeout=30).json()['next_cursor']
+            response = self.session.get(f'{self.url}/posts/changes/', params={'stream': 'sse', 'since': cursor},
+                                        stream=True, timeout=60)
+            self.requests += 1
+            for line in response.iter_lines():
+                self.bytes += len(line) + 1
+                if line.startswith(b'data: '):
+                    self.see(json.loads(line[len(b'data: '):])['post_id'])
+                if time.monotonic() >= self.deadline:
+                    break
+            response.close()
+
+
+"""
+This function runs one mode and returns its results.
+"""
+
+def run_mode(mode, url, consumers, rate, duration, interval):
+    created = {}
+    deadline = time.monotonic() + duration
+    threads = [Consumer(mode, url, created, deadline, interval) for _ in range(consumers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(1)
+
+    session = requests.Session()
+    #no posts are created in the last seconds, so the consumers can see the last ones
+    while time.monotonic() < deadline - 3:
+        started = time.monotonic()
+        response = session.post(f'{url}/posts/', data={'user_id': 'bench-changes', 'username': 'bench',
+                                                       'caption': 'change feed', 'content': 'bench'}, timeout=30)
+        created[response.json()['post_id']] = time.monotonic()
+        time.sleep(max(1 / rate - (time.monotonic() - started), 0))
+
+    for thread in threads:
+        thread.join(timeout=duration + 30)
+
+    delays = sorted(thread.seen[post_id] - created[post_id] for thread in threads for post_id in thread.seen)
+    return {
+        "posts": len(created),
+        "seen": len(delays) / max(len(created) * consumers, 1),
+        "requests": sum(thread.requests for thread in threads),
+        "mb": sum(thread.bytes for thread in threads) / 1e6,
+        "p50_ms": round(percentile(delays, 50) * 1000, 1),
+        "p95_ms": round(percentile(delays, 95) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the change feed against polling the feed.")
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--mode', action='append', choices=MODES, help="Mode to run (repeatable), default: all.")
+    parser.add_argument('--consumers', type=int, default=50)
+    parser.add_argument('--rate', type=float, default=5, help="Posts created per second.")
+    parser.add_argument('--duration', type=float, default=20, help="Seconds per mode.")
+    parser.add_argument('--interval', type=float, default=1, help="Seconds between two polls of the feed.")
+    args = parser.parse_args()
+
+    print(f"{'mode':<10}{'posts':>7}{'seen':>8}{'requests':>10}{'MB read':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for mode in args.mode or MODES:
+        result = run_mode(mode, args.url.rstrip('/'), args.consumers, args.rate, args.duration, args.interval)
+        print(f"{mode:<10}{result['posts']:>7}{result['seen']:>8.1%}{result['requests']:>10}{result['mb']:>10.2f}"
+              f"{result['p50_ms']:>10}{result['p95_ms']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark of the db connection handling: the latency of a request that runs one small query, with
+    connect     a new connection for every request (POSTGRES_POOL=false, POSTGRES_CONN_MAX_AGE=0, the old setting)
+    persistent  persistent connections (POSTGRES_POOL=false, POSTGRES_CONN_MAX_AGE=600)
+    pool        the psycopg connection pool (POSTGRES_POOL=true, the default)
+
+Every mode runs in its own process with these env vars. --concurrency threads send requests for --duration seconds,
+every request goes through request_started/request_finished like a real Django request (that is where Django closes
+or returns its connections). Like under ASGI every request runs in a new thread, unless --reuse-threads is given
+(like sync workers), which is the only case where persistent connections are reused.
+Needs seeded posts (python manage.py seed_posts).
+
+Usage:
+    python -m bench.db_connections --concurrency 8 --duration 10
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'postsMS.settings')
+django.setup()
+
+from django.core.signals import request_finished, request_started  # noqa: E402
+
+from bench.stats import print_report, summarize  # noqa: E402
+from posts.models import Post  # noqa: E402
+from posts.serialization import POST_FIELDS  # noqa: E402
+
+MODES = {
+    'connect': {'POSTGRES_POOL': 'false', 'POSTGRES_CONN_MAX_AGE': '0'},
+    'persistent': {'POSTGRES_POOL': 'false', 'POSTGRES_CONN_MAX_AGE': '600'},
+    'pool': {'POSTGRES_POOL': 'true'},
+}
+
+
+def request(post_ids):
+    request_started.send(sender=None)
+    try:
+        return Post.objects.filter(post_id=random.choice(post_ids)).values(*POST_FIELDS).first()
+    finally:
+        request_finished.send(sender=None)
+
+
+"""
+This function runs the requests of one mode in this process and returns the summary of their latencies.
+"""
+
+def run_mode(concurrency, duration, reuse_threads):
+    post_ids = list(Post.objects.values_list('post_id', flat=True)[:1000])
+    request(post_ids)
+
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def send():
+        started = time.perf_counter()
+        try:
+            request(post_ids)
+            failed = False
+        except Exception:
+            failed = True
+        elapsed = time.perf_counter() - started
+
+        with lock:
+            latencies.append(elapsed)
+            errors[0] += failed
+
+    def worker():
+        while time.monotonic() < deadline:
+            if reuse_threads:
+                send()
+            else:
+                thread = threading.Thread(target=send)
+                thread.start()
+                thread.join()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return summarize(latencies, errors[0], duration)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the db connection handling.")
+    parser.add_argument('--mode', action='append', choices=list(MODES), help="Mode to run (repeatable), default: all.")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--reuse-threads', action='store_true', help="Send every request of a worker in the same thread.")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(args.concurrency, args.duration, args.reuse_threads)))
+        return
+
+    results = {}
+    for mode in args.mode or list(MODES):
+        command = [sys.executable, '-m', 'bench.db_connections', '--child',
+                   '--concurrency', str(args.concurrency), '--duration', str(args.duration)]
+        if args.reuse_threads:
+            command.append('--reuse-threads')
+
+        output = subprocess.run(command, env={**os.environ, **MODES[mode]}, check=True, capture_output=True, text=True)
+        results[mode] = json.loads(output.stdout.strip().splitlines()[-1])
+
+    print_report(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark of the ranking stage of the ranked feed (/posts/feed/?ranked=true), directly against the db.
+
+For every candidate count (FEED_CANDIDATES) it measures the stages of one ranked feed:
+    candidates  the bounded candidate query (newest posts, or newest posts with one of the tags)
+    score       scoring all candidates with the scorers of FEED_SCORERS
+    heap        selecting the top --limit with a heap (what the feed does)
+    sort        selecting them by sorting all scored candidates (for comparison)
+    total       ranked_feed end to end, including loading the selected posts
+and checks with EXPLAIN that the candidate query does not scan the whole table.
+Run it on a table of 1M+ posts:
+    python manage.py seed_posts --users 10000 --posts 100 --seed 1
+
+Usage:
+    python -m bench.ranking --candidates 1000 --candidates 10000 --tags food --tags travel --save bench/results/ranking.json
+"""
+
+import argparse
+import heapq
+import os
+import statistics
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'postsMS.settings')
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+
+from bench.stats import save_results  # noqa: E402
+from posts.models import Post  # noqa: E402
+from posts.ranking import CANDIDATE_FIELDS, candidates, rank_key, ranked_feed, score_candidates  # noqa: E402
+
+
+def median_ms(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+
+    return round(statistics.median(timings) * 1000, 2)
+
+
+def sort_top(scored, limit):
+    return sorted(scored, key=rank_key, reverse=True)[:limit]
+
+
+def heap_top(scored, limit):
+    return heapq.nlargest(limit, scored, key=rank_key)
+
+
+def plan(tags):
+    posts = Post.objects.filter(tags__overlap=tags) if tags else Post.objects.all()
+    sql, params = posts.order_by('-created_at', '-post_id').values(*CANDIDATE_FIELDS)[:settings.FEED_CANDIDATES] \
+        .query.sql_with_params()
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN {sql}', params)
+        return '\n'.join(row[0] for row in cursor.fetchall())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the ranking stage of the ranked feed.")
+    parser.add_argument('--candidates', type=int, action='append', help="FEED_CANDIDATES (repeatable).")
+    parser.add_argument('--limit', type=int, default=50)
+    parser.add_argument('--tags', action='append', default=[], help="Tags of the feed (repeatable).")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--save', help="Save the results to this json file.")
+    args = parser.parse_args()
+
+    print(f"{Post.objects.count()} posts, tags {args.tags or '-'}, limit {args.limit}")
+    print(f"{'candidates':>10}{'query ms':>10}{'score ms':>10}{'heap ms':>10}{'sort ms':>10}{'total ms':>10}  plan")
+
+    results = {}
+    for count in args.candidates or [1000, 5000, 20000]:
+        with override_settings(FEED_CANDIDATES=count):
+            posts = candidates(args.tags)
+            scored = score_candidates(posts, args.tags)
+            explain = plan(args.tags)
+
+            result = {
+                "candidates": len(posts),
+                "query_ms": median_ms(lambda: candidates(args.tags), args.repeat),
+                "score_ms": median_ms(lambda: score_candidates(posts, args.tags), args.repeat),
+                "heap_ms": median_ms(lambda: heap_top(scored, args.limit), args.repeat),
+                "sort_ms": median_ms(lambda: sort_top(scored, args.limit), args.repeat),
+                "total_ms": median_ms(lambda: ranked_feed(args.tags, args.limit), args.repeat),
+                "seq_scan": 'Seq Scan' in explain,
+            }
+            assert heap_top(scored, args.limit) == sort_top(scored, args.limit)
+
+        results[count] = result
+        print(f"{result['candidates']:>10}{result['query_ms']:>10}{result['score_ms']:>10}{result['heap_ms']:>10}"
+              f"{result['sort_ms']:>10}{result['total_ms']:>10}  "
+              f"{'seq scan' if result['seq_scan'] else 'index'}")
+
+    if args.save:
+        save_results(args.save, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""
+Load test of a running posts microservice.
+
+Every scenario sends requests from --concurrency threads for --duration seconds and reports the throughput
+and the p50/p95/p99 latency. Results can be saved with --save and compared with a saved baseline with --baseline,
+so every performance change can be measured against the state before it.
+
+Scenarios:
+    feed          GET /posts/feed/?limit=50
+    feed_tags     GET /posts/feed/?tags=<1-2 random tags>&limit=50
+    user_posts    GET /posts/users/<random user>/?limit=50
+    get           GET /posts/get/<random post>/
+    search        GET /posts/search/?q=<random word or tag>&limit=50
+    create        POST /posts/ with a small media file
+    delete        DELETE /posts/delete/<post>/ of posts created before the scenario
+    hot_get       GET /posts/get/<post>/ of the same post from all threads
+    hot_feed      GET /posts/feed/?tags=<tag>&limit=50 of the same tag from all threads
+
+With --stub-url (the stub services of bench.stub_services) the requests the service sent to the media and interactions
+services during every scenario are counted too, e.g. to see how many of the hot reads were coalesced.
+
+Usage (see bench/README.md for the full setup with seed data and the stub services):
+    python -m bench.run --url http://127.0.0.1:8000 --concurrency 16 --duration 20 --save bench/results/baseline.json
+    python -m bench.run --url http://127.0.0.1:8000 --scenario feed --scenario get --baseline bench/results/baseline.json
+"""
+
+import argparse
+import random
+import threading
+import time
+
+import requests
+
+from bench.stats import load_results, print_report, save_results, summarize
+
+SCENARIOS = ['feed', 'feed_tags', 'user_posts', 'get', 'search', 'create', 'delete', 'hot_get', 'hot_feed']
+TAGS = ["travel", "food", "sports", "music", "art", "fashion", "nature", "photography", "fitness", "tech"]
+SEARCH_WORDS = ["photo", "view", "trip", "weekend", "morning", "night", '"best day"']
+
+
+"""
+This function collects post_ids and user_ids from the feed, which the scenarios pick their requests from.
+"""
+
+def discover(url, pages=10):
+    post_ids, user_ids = [], set()
+    cursor = None
+
+    for _ in range(pages):
+        params = {'limit': 200}
+        if cursor:
+            params['cursor'] = cursor
+
+        page = requests.get(f'{url}/posts/feed/', params=params, timeout=30).json()
+        for post in page['posts']:
+            post_ids.append(post['post_id'])
+            user_ids.add(post['user_id'])
+
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    return post_ids, sorted(user_ids)
+
+
+def create_post(session, url):
+    return session.post(f'{url}/posts/', data={
+        'user_id': str(random.randint(10000, 10099)),
+        'username': 'benchuser',
+        'caption': 'bench caption',
+        'content': 'bench content',
+    }, files={'file': ('bench.jpg', b'x' * 20000, 'image/jpeg')}, timeout=30)
+
+
+"""
+This function returns a function that sends one request of the scenario with a session.
+"""
+
+def make_request(scenario, url, post_ids, user_ids, deletable):
+    if scenario == 'feed':
+        return lambda session: session.get(f'{url}/posts/feed/', params={'limit': 50}, timeout=30)
+
+    if scenario == 'feed_tags':
+        return lambda session: session.get(f'{url}/posts/feed/', timeout=30, params={
+            'limit': 50, 'tags': random.sample(TAGS, random.randint(1, 2))
+        })
+
+    if scenario == 'user_posts':
+        return lambda session: session.get(f'{url}/posts/users/{random.choice(user_ids)}/',
+                                           params={'limit': 50}, timeout=30)
+
+    if scenario == 'get':
+        return lambda session: session.get(f'{url}/posts/get/{random.choice(post_ids)}/', timeout=30)
+
+    if scenario == 'search':
+        return lambda session: session.get(f'{url}/posts/search/', timeout=30, params={
+            'limit': 50, 'q': random.choice(TAGS + SEARCH_WORDS)
+        })
+
+    if scenario == 'create':
+        return lambda session: create_post(session, url)
+
+    if scenario == 'hot_get':
+        return lambda session: session.get(f'{url}/posts/get/{post_ids[0]}/', timeout=30)
+
+    if scenario == 'hot_feed':
+        return lambda session: session.get(f'{url}/posts/feed/', params={'limit': 50, 'tags': TAGS[0]}, timeout=30)
+
+    if scenario == 'delete':
+        def delete(session):
+            try:
+                post_id = deletable.pop()
+            except IndexError:
+                return None
+            return session.delete(f'{url}/posts/delete/{post_id}/', timeout=30)
+
+        return delete
+
+    raise ValueError(f"unknown scenario {scenario}")
+
+
+"""
+This function runs one scenario and returns its summary (see bench.stats.summarize).
+"""
+
+def run_scenario(request, concurrency, duration):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        session = requests.Session()
+
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                response = request(session)
+                if response is None:
+                    return
+                failed = response.status_code >= 500
+            except requests.RequestException:
+                failed = True
+            elapsed = time.monotonic() - started
+
+            with lock:
+                latencies.append(elapsed)
+                errors[0] += failed
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return summarize(latencies, errors[0], time.monotonic() - started)
+
+
+"""
+This function returns the number of requests the stub services got so far (all endpoints but the uploads and deletes).
+"""
+
+def downstream_requests(stub_url):
+    stats = requests.get(f'{stub_url}/stats', timeout=30).json()
+    return stats.get('get_media', 0) + stats.get('get_counts', 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the posts microservice.")
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help="Scenario to run, can be given more than once. Default: all.")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20, help="Seconds per scenario.")
+    parser.add_argument('--save', help="Save the results as json to this file.")
+    parser.add_argument('--baseline', help="Compare the results with a file saved by --save.")
+    parser.add_argument('--stub-url', help="URL of the stub services, to count the requests sent to them.")
+    args = parser.parse_args()
+
+    url = args.url.rstrip('/')
+    post_ids, user_ids = discover(url)
+    if not post_ids:
+        parser.error("the service has no posts, seed it first with: python manage.py seed_posts")
+
+    results = {}
+    for scenario in args.scenario or SCENARIOS:
+        deletable = []
+        if scenario == 'delete':
+            #create the posts to delete first, the delete scenario stops when they are used up
+            session = requests.Session()
+            deletable = [create_post(session, url).json()['post_id'] for _ in range(args.concurrency * 50)]
+
+        before = downstream_requests(args.stub_url) if args.stub_url else None
+        request = make_request(scenario, url, post_ids, user_ids, deletable)
+        results[scenario] = run_scenario(request, args.concurrency, args.duration)
+        if args.stub_url:
+            results[scenario]['downstream'] = downstream_requests(args.stub_url) - before
+
+    print_report(results, load_results(args.baseline) if args.baseline else None)
+
+    if args.stub_url:
+        print(f"\n{'benchmark':<24}{'requests':>10}{'downstream':>12}{'per request':>13}")
+        for name, result in results.items():
+            print(f"{name:<24}{result['requests']:>10}{result['downstream']:>12}"
+                  f"{result['downstream'] / max(result['requests'], 1):>13.3f}")
+
+    if args.save:
+        save_results(args.save, results)
+
+
+if __name__ == '__main__':
+    main()
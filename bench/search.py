@@ -0,0 +1,95 @@
+"""
+Benchmark of the full-text search query (/posts/search/) directly against the db, without http and media.
+
+Every query is run --repeat times for the first page and for a page deep in the results (following cursors),
+and the number of matching posts, p50/p95 latency and whether the GIN index on search_vector is used are printed.
+The latency grows with the number of matching posts (all of them are ranked), so the queries go from rare words
+to the most popular tag. Run it on a table of millions of posts:
+    python manage.py seed_posts --users 20000 --posts 100 --seed 1
+
+Usage:
+    python -m bench.search --repeat 20 --limit 50 --save bench/results/search.json
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'postsMS.settings')
+django.setup()
+
+from django.contrib.postgres.search import SearchQuery  # noqa: E402
+from django.db import connection  # noqa: E402
+
+from bench.stats import percentile, save_results  # noqa: E402
+from posts.models import Post  # noqa: E402
+from posts.search import SEARCH_CONFIG, asearch, search_queryset  # noqa: E402
+
+#phrases, words, exclusions and tags of the seed data (see seed_posts), from few to many matches per page
+QUERIES = ['"best view"', 'photo -night', 'music OR art', 'travel', 'weekend trip']
+
+
+def count_matches(q):
+    return Post.objects.filter(search_vector=SearchQuery(q, search_type='websearch', config=SEARCH_CONFIG)).count()
+
+
+def uses_index(q, limit):
+    sql, params = search_queryset(q, None, limit).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN {sql}', params)
+        plan = '\n'.join(row[0] for row in cursor.fetchall())
+
+    return 'posts_post_search_gin' in plan
+
+
+async def measure(q, limit, repeat, pages):
+    #follow the cursors to the last measured page, so deep pages are measured too
+    cursor = None
+    for _ in range(pages - 1):
+        _, cursor = await asearch(q, cursor, limit)
+        if cursor is None:
+            break
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await asearch(q, cursor, limit)
+        timings.append(time.perf_counter() - started)
+
+    timings.sort()
+    return {"p50_ms": round(percentile(timings, 50) * 1000, 2), "p95_ms": round(percentile(timings, 95) * 1000, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the full-text search query.")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=50, help="Posts per page.")
+    parser.add_argument('--deep-page', type=int, default=20, help="The deep page that is measured.")
+    parser.add_argument('--query', action='append', help="Search query (repeatable), default: a fixed set.")
+    parser.add_argument('--save', help="Save the results to this json file.")
+    args = parser.parse_args()
+
+    print(f"{Post.objects.count()} posts")
+    print(f"{'query':<18}{'matches':>10}{'index':>7}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p50 deep':>10}{'p95 deep':>10}")
+
+    results = {}
+    for q in args.query or QUERIES:
+        first = asyncio.run(measure(q, args.limit, args.repeat, 1))
+        deep = asyncio.run(measure(q, args.limit, args.repeat, args.deep_page))
+        matches = count_matches(q)
+        index = uses_index(q, args.limit)
+
+        results[q] = {"matches": matches, "index": index, "first_page": first, "deep_page": deep}
+        print(f"{q:<18}{matches:>10}{'yes' if index else 'no':>7}{first['p50_ms']:>10}{first['p95_ms']:>10}"
+              f"{deep['p50_ms']:>10}{deep['p95_ms']:>10}")
+
+    if args.save:
+        save_results(args.save, results)
+
+
+if __name__ == '__main__':
+    main()
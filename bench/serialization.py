@@ -0,0 +1,88 @@
+"""
+Micro-benchmark of the serialization of post lists: the cost per post of loading a page of posts from the db,
+building the post data and encoding it as json.
+
+    model   Post instances, dicts built field by field, JsonResponse with DjangoJSONEncoder (the old path)
+    values  .values(*ROW_FIELDS) rows, post_data and FastJsonResponse with orjson (the path of the read endpoints)
+
+Media hydration is left out (every post gets an empty media list), only the cpu work of this service is measured.
+Needs seeded posts (python manage.py seed_posts).
+
+Usage:
+    python -m bench.serialization --posts 200 --repeat 50
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'postsMS.settings')
+django.setup()
+
+from django.http import JsonResponse  # noqa: E402
+
+from posts.models import Post  # noqa: E402
+from posts.serialization import ROW_FIELDS, FastJsonResponse, post_data  # noqa: E402
+
+
+def model_path(limit):
+    posts = list(Post.objects.order_by('-created_at', '-post_id')[:limit])
+    post_list = [{
+        "post_id": post.post_id,
+        "caption": post.caption,
+        "content": post.content,
+        "username": post.username,
+        "user_id": post.user_id,
+        "created_at": post.created_at,
+        "updated_at": post.updated_at,
+        "media": [],
+    } for post in posts]
+
+    return JsonResponse({"posts": post_list, "next_cursor": None})
+
+
+def values_path(limit):
+    posts = list(Post.objects.order_by('-created_at', '-post_id').values(*ROW_FIELDS)[:limit])
+    post_list = [post_data(post, {}) for post in posts]
+
+    return FastJsonResponse({"posts": post_list, "next_cursor": None})
+
+
+def measure(path, limit, repeat):
+    #warm up the db cache and the connection
+    path(limit)
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        path(limit)
+        timings.append(time.perf_counter() - started)
+
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark of the serialization of post lists.")
+    parser.add_argument('--posts', type=int, default=200, help="Posts per page.")
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    count = Post.objects.count()
+    if count < args.posts:
+        parser.error(f"only {count} posts in the db, seed more with: python manage.py seed_posts")
+
+    print(f"{'path':<10}{'ms/page':>10}{'us/post':>10}")
+    results = {}
+    for name, path in (('model', model_path), ('values', values_path)):
+        seconds = measure(path, args.posts, args.repeat)
+        results[name] = seconds
+        print(f"{name:<10}{seconds * 1000:>10.2f}{seconds / args.posts * 1e6:>10.2f}")
+
+    print(f"values is {results['model'] / results['values']:.1f}x faster per post")
+
+
+if __name__ == '__main__':
+    main()
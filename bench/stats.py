@@ -0,0 +1,65 @@
+"""
+Helpers to summarize and compare benchmark results, shared by all benchmarks in this directory.
+"""
+
+import json
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+
+    #nearest rank percentile
+    index = max(int(round(p / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+"""
+This function summarizes the latencies (in seconds) of a benchmark that ran for the given seconds.
+A dict with the number of requests, errors, throughput and latency percentiles in ms is returned.
+"""
+
+def summarize(latencies, errors, seconds):
+    latencies = sorted(latencies)
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput": round(len(latencies) / seconds, 1) if seconds else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+"""
+This function prints one line per benchmark, and the change against the baseline if there is one.
+"""
+
+def print_report(results, baseline=None):
+    baseline = baseline or {}
+    print(f"{'benchmark':<24}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+
+    for name, result in results.items():
+        print(f"{name:<24}{result['requests']:>10}{result['errors']:>8}{result['throughput']:>10}"
+              f"{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}")
+
+        if name in baseline:
+            change = []
+            for key in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms'):
+                before = baseline[name][key]
+                if before:
+                    change.append(f"{key} {(result[key] - before) / before * 100:+.1f}%")
+
+            print(f"{'  vs baseline':<24}{', '.join(change)}")
+
+
+def load_results(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_results(path, results):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
@@ -0,0 +1,107 @@
+"""
+Benchmark of streamed lists of posts: the peak memory (RSS) and time to first byte of one feed request with --posts posts,
+    page    one page with all posts (like ?limit=N with POSTS_MAX_PAGE_SIZE raised): built in memory, then encoded
+    json    ?stream=json, read, hydrated and encoded in chunks of POSTS_STREAM_CHUNK_SIZE posts
+    ndjson  ?stream=ndjson
+Every mode runs in its own process, so the peak RSS of one mode does not hide the others. The view is called directly
+(without the server), the response is read completely. Add --gzip to stream with gzip.
+Needs seeded posts (python manage.py seed_posts) and their media snapshots (python manage.py backfill_media_snapshots),
+otherwise the media of every post is requested from MEDIA_SERVICE_URL.
+
+Usage:
+    python -m bench.streaming --posts 10000 --posts 100000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'postsMS.settings')
+django.setup()
+
+from django.test import AsyncRequestFactory  # noqa: E402
+
+from posts.views import getFeedPosts  # noqa: E402
+
+MODES = {
+    'page': {},
+    'json': {'stream': 'json'},
+    'ndjson': {'stream': 'ndjson'},
+}
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+"""
+This function sends one feed request of a mode in this process and measures it.
+"""
+
+async def run_mode(mode, posts, gzipped):
+    headers = {'Accept-Encoding': 'gzip'} if gzipped else {}
+    factory = AsyncRequestFactory()
+
+    #a small request first, so imports and connections are not measured
+    await getFeedPosts(factory.get('/posts/feed/', {**MODES[mode], 'limit': 10}))
+    rss_before = max_rss_mb()
+
+    started = time.perf_counter()
+    response = await getFeedPosts(factory.get('/posts/feed/', {**MODES[mode], 'limit': posts}, headers=headers))
+
+    size = 0
+    first_byte = None
+    if response.streaming:
+        async for chunk in response.streaming_content:
+            first_byte = first_byte or time.perf_counter()
+            size += len(chunk)
+    else:
+        first_byte = time.perf_counter()
+        size = len(response.content)
+    finished = time.perf_counter()
+
+    return {
+        "status": response.status_code,
+        "bytes": size,
+        "ttfb_ms": round((first_byte - started) * 1000, 1),
+        "total_ms": round((finished - started) * 1000, 1),
+        "peak_rss_mb": round(max_rss_mb() - rss_before, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of streamed lists of posts.")
+    parser.add_argument('--posts', type=int, action='append', help="Posts per request (repeatable).")
+    parser.add_argument('--mode', action='append', choices=list(MODES), help="Mode to run (repeatable), default: all.")
+    parser.add_argument('--gzip', action='store_true', help="Stream with gzip.")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_mode(args.child, args.posts[0], args.gzip))))
+        return
+
+    print(f"{'posts':>8}  {'mode':<8}{'MB sent':>9}{'ttfb ms':>10}{'total ms':>10}{'peak rss MB':>13}")
+    for posts in args.posts or [10000, 100000]:
+        for mode in args.mode or list(MODES):
+            command = [sys.executable, '-m', 'bench.streaming', '--child', mode, '--posts', str(posts)]
+            if args.gzip:
+                command.append('--gzip')
+
+            env = {**os.environ, 'POSTS_MAX_PAGE_SIZE': str(max(posts, 200))}
+            output = subprocess.run(command, env=env, check=True, capture_output=True, text=True)
+            result = json.loads(output.stdout.strip().splitlines()[-1])
+
+            print(f"{posts:>8}  {mode:<8}{result['bytes'] / 1e6:>9.1f}{result['ttfb_ms']:>10}{result['total_ms']:>10}"
+                  f"{result['peak_rss_mb']:>13}")
+
+
+if __name__ == '__main__':
+    main()
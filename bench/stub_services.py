@@ -0,0 +1,182 @@
+"""
+A local stub of the media and interactions microservices for benchmarks.
+
+It answers the requests the posts microservice sends to them:
+    GET    /media                 json list of media_ids in the body -> list of media data
+    POST   /media                 multipart upload -> {"IDs": [...]}
+    GET    /internal/posts/counts json list of post_ids in the body -> {post_id: {"likes": n, "comments": n}}
+    DELETE /media/<id>
+    DELETE /internal/post/<id>
+
+Every request waits --latency ms (+- --jitter ms) and fails with status 500 with probability --error-rate.
+The number of requests per endpoint is printed on GET /stats and when the stub is stopped.
+Tests can start the stub in a thread with make_server and change server.config while it runs.
+
+Usage:
+    python -m bench.stub_services --port 8006 --latency 20 --jitter 10 --error-rate 0.01
+Then start the posts microservice with MEDIA_SERVICE_URL and INTERACTIONS_SERVICE_URL set to http://127.0.0.1:8006.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None
+    stats = Counter()
+    stats_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def count(self, name, amount=1):
+        with self.stats_lock:
+            self.stats[name] += amount
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        remaining = length
+
+        #read the body in chunks, uploads can be large
+        chunks = []
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 1024 * 1024))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+
+        return b''.join(chunks)
+
+    def respond(self, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b''
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def simulate(self):
+        latency = self.config.latency + random.uniform(-self.config.jitter, self.config.jitter)
+        time.sleep(max(latency, 0) / 1000)
+
+        return random.random() >= self.config.error_rate
+
+    def do_GET(self):
+        body = self.read_body()
+
+        if self.path == '/stats':
+            with self.stats_lock:
+                return self.respond(200, dict(self.stats))
+
+        if self.path == '/internal/posts/counts':
+            self.count('get_counts')
+            if not self.simulate():
+                return self.respond(500, {"error": "stub error"})
+
+            #the same post always gets the same counts
+            post_ids = json.loads(body or b'[]')
+            return self.respond(200, {
+                post_id: {"likes": int(post_id[:4], 16) % 500, "comments": int(post_id[4:8], 16) % 50}
+                for post_id in post_ids
+            })
+
+        if self.path != '/media':
+            return self.respond(404, {"error": "not found"})
+
+        self.count('get_media')
+        if not self.simulate():
+            return self.respond(500, {"error": "stub error"})
+
+        media_ids = json.loads(body or b'[]')
+        self.count('media_ids', len(media_ids))
+        self.respond(200, [
+            {
+                "MediaId": str(media_id),
+                "FileUrl": f"https://media.example.com/{media_id}.jpg",
+                "Width": 1080,
+                "Height": 1350,
+                "FileType": "jpg",
+                "OriginalFileName": f"{media_id}.jpg",
+            }
+            for media_id in media_ids
+        ])
+
+    def do_POST(self):
+        body = self.read_body()
+
+        if self.path != '/media':
+            return self.respond(404, {"error": "not found"})
+
+        self.count('upload_media')
+        if not self.simulate():
+            return self.respond(500, {"error": "stub error"})
+
+        files = max(body.count(b'filename="'), 1)
+        self.respond(200, {"IDs": [uuid.uuid4().hex for _ in range(files)]})
+
+    def do_DELETE(self):
+        self.read_body()
+
+        if self.path.startswith('/media/'):
+            self.count('delete_media')
+        elif self.path.startswith('/internal/post/'):
+            self.count('delete_interactions')
+        else:
+            return self.respond(404, {"error": "not found"})
+
+        if not self.simulate():
+            return self.respond(500, {"error": "stub error"})
+
+        self.respond(200, {"message": "deleted"})
+
+
+"""
+This function creates a stub server (not started yet), port 0 picks a free port.
+The latency, jitter and error rate can be changed at runtime through server.config,
+and the request counters are in server.stats.
+"""
+
+def make_server(host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0):
+    config = argparse.Namespace(latency=latency, jitter=jitter, error_rate=error_rate)
+    handler = type('StubHandler', (StubHandler,), {
+        'config': config, 'stats': Counter(), 'stats_lock': threading.Lock()
+    })
+
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.config = config
+    server.stats = handler.stats
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub of the media and interactions microservices.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8006)
+    parser.add_argument('--latency', type=float, default=20, help="Latency of every request in ms.")
+    parser.add_argument('--jitter', type=float, default=5, help="Random +- jitter of the latency in ms.")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Probability that a request fails with 500.")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.jitter, args.error_rate)
+    print(f"stub media/interactions service on http://{args.host}:{server.server_port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(dict(server.stats)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""
+Gunicorn configuration for serving the posts microservice under ASGI (postsMS.asgi:application).
+
+Every worker is a separate process with its own event loop (uvicorn), which serves many requests at the same time
+while they wait for postgres, the cache or the media microservice. All settings can be changed with env vars:
+
+WEB_CONCURRENCY     number of worker processes, default 2 per cpu core
+WEB_BIND            address to listen on, default 0.0.0.0:8000
+WEB_TIMEOUT         seconds a worker may be silent before it is restarted, default 30
+WEB_KEEPALIVE       seconds to keep idle client connections open, default 5
+WEB_MAX_REQUESTS    restart a worker after this many requests (plus jitter) to bound memory growth, default 10000
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv('WEB_BIND', '0.0.0.0:8000')
+worker_class = 'uvicorn_worker.UvicornWorker'
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2))
+timeout = int(os.getenv('WEB_TIMEOUT', '30'))
+graceful_timeout = timeout
+keepalive = int(os.getenv('WEB_KEEPALIVE', '5'))
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '10000'))
+max_requests_jitter = max_requests // 10
+accesslog = '-'
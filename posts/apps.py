@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class PostsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'posts'
+
+    def ready(self):
+        from posts.timing import install_db_wrapper
+
+        #record the duration of every db query for the request timings
+        connection_created.connect(install_db_wrapper)
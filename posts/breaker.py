@@ -0,0 +1,84 @@
+import threading
+import time
+
+from posts.metrics import Counter, Gauge
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+#the values of the state gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = Gauge('posts_circuit_breaker_state', "State of the circuit breaker (0 closed, 1 half open, 2 open).",
+                      ('breaker',))
+BREAKER_TRANSITIONS = Counter('posts_circuit_breaker_transitions_total', "State changes of the circuit breaker.",
+                              ('breaker', 'state'))
+BREAKER_REJECTED = Counter('posts_circuit_breaker_rejected_total', "Calls rejected by the open circuit breaker.",
+                           ('breaker',))
+
+
+"""
+This class is a circuit breaker for the calls to another microservice.
+After "failures" failed calls in a row (errors, or calls slower than "slow_call" seconds) the breaker opens,
+and calls are rejected right away instead of waiting for the failing service.
+After "reset_timeout" seconds one probe call is let through (half open): if it succeeds the breaker closes again,
+otherwise it stays open for another reset_timeout.
+"""
+
+class CircuitBreaker:
+    def __init__(self, name, failures, slow_call, reset_timeout):
+        self.name = name
+        self.failures = failures
+        self.slow_call = slow_call
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.state = CLOSED
+            self.failed_calls = 0
+            self.opened_at = 0.0
+            self.probing = False
+            BREAKER_STATE.set(STATE_VALUES[CLOSED], breaker=self.name)
+
+    def change_state(self, state):
+        self.state = state
+        BREAKER_STATE.set(STATE_VALUES[state], breaker=self.name)
+        BREAKER_TRANSITIONS.inc(breaker=self.name, state=state)
+
+    """
+    This method returns if a call may be sent now. In the half open state only one probe call is allowed at a time.
+    """
+
+    def allow(self):
+        with self.lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.change_state(HALF_OPEN)
+
+            if self.state == CLOSED or (self.state == HALF_OPEN and not self.probing):
+                self.probing = self.state == HALF_OPEN
+                return True
+
+        BREAKER_REJECTED.inc(breaker=self.name)
+        return False
+
+    """
+    This method records the result of a call that was allowed, a slow successful call counts as a failure.
+    """
+
+    def record(self, success, seconds):
+        with self.lock:
+            self.probing = False
+
+            if success and seconds <= self.slow_call:
+                self.failed_calls = 0
+                if self.state != CLOSED:
+                    self.change_state(CLOSED)
+                return
+
+            self.failed_calls += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failed_calls >= self.failures):
+                self.opened_at = time.monotonic()
+                self.change_state(OPEN)
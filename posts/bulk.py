@@ -0,0 +1,70 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from posts.changes import record_changes
+from posts.models import Post, PostChange
+from posts.snapshots import take_snapshots
+from posts.timelines import add_many_to_timelines
+
+
+"""
+This function builds an unsaved post from one item of a bulk create request and validates it.
+A ValueError with the reason is raised if the item is not a valid post.
+"""
+
+def build_post(item):
+    if not isinstance(item, dict):
+        raise ValueError("a post must be an object")
+
+    if item.get('user_id') is None or item.get('username') is None:
+        raise ValueError("missing data!")
+
+    post = Post(caption=item.get('caption', ''), content=item.get('content', ''), username=item['username'],
+                user_id=item['user_id'], media=item.get('media', []), tags=item.get('tags', []))
+
+    if not isinstance(post.media, list) or not isinstance(post.tags, list):
+        raise ValueError("media and tags must be lists")
+
+    #tags are text like the tags of newPost, the tag timelines and the tags__overlap lookups rely on that
+    if not all(isinstance(tag, str) for tag in post.tags):
+        raise ValueError("tags must be strings")
+
+    #empty captions and contents are allowed like in newPost, the other fields are checked like in a form
+    try:
+        post.clean_fields(exclude=[field for field in ('caption', 'content') if getattr(post, field) == ''])
+    except ValidationError as e:
+        raise ValueError("; ".join(f"{field}: {' '.join(errors)}" for field, errors in e.message_dict.items()))
+
+    return post
+
+
+"""
+This function creates many posts with one bulk insert in one transaction, the posts are also added to the timelines.
+Their media snapshots are taken with one media request before.
+Invalid items are skipped and reported, they do not fail the other posts.
+A list with the post_id or the error of every item is returned, in the order of the items.
+"""
+
+def create_posts(items):
+    results = []
+    posts = []
+
+    for item in items:
+        try:
+            post = build_post(item)
+        except ValueError as e:
+            results.append({"error": str(e)})
+            continue
+
+        posts.append(post)
+        results.append({"post_id": post.post_id})
+
+    #the media data of all posts is requested at once and stored with the posts
+    take_snapshots(posts)
+
+    with transaction.atomic():
+        Post.objects.bulk_create(posts)
+        add_many_to_timelines([(post, post.tags) for post in posts])
+        record_changes(PostChange.CREATED, posts)
+
+    return results
@@ -0,0 +1,196 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.http import Http404
+
+from posts.media import hydrate_media
+from posts.models import Post
+from posts.serialization import ROW_FIELDS
+from posts.singleflight import result_cache_key
+
+
+def post_key(post_id):
+    return f'post-row:{post_id}'
+
+
+def media_key(post_id):
+    return f'post-media:{post_id}'
+
+
+def stale_media_key(post_id):
+    return f'post-media-stale:{post_id}'
+
+
+"""
+This function gets a post row (a dict of ROW_FIELDS) from the cache, or from the db if it is not cached yet (read-through).
+The row is then cached for POST_CACHE_TTL seconds. Http404 is raised if the post does not exist.
+Rows are always read from the primary, so a lagging replica can not put an old version of a post into the cache.
+"""
+
+def get_post(post_id):
+    post = cache.get(post_key(post_id))
+
+    if post is None:
+        post = Post.objects.using(DEFAULT_DB_ALIAS).filter(post_id=post_id).values(*ROW_FIELDS).first()
+        if post is None:
+            raise Http404("Post not found")
+
+        cache.set(post_key(post_id), post, settings.POST_CACHE_TTL)
+
+    return post
+
+
+"""
+This function is the async version of get_post, for the async views.
+"""
+
+async def aget_post(post_id):
+    post = await cache.aget(post_key(post_id))
+
+    if post is None:
+        post = await Post.objects.using(DEFAULT_DB_ALIAS).filter(post_id=post_id).values(*ROW_FIELDS).afirst()
+        if post is None:
+            raise Http404("Post not found")
+
+        await cache.aset(post_key(post_id), post, settings.POST_CACHE_TTL)
+
+    return post
+
+
+"""
+This function gets the post rows of many posts at once: cached rows are read with one get_many and the other rows
+with one post_id IN (...) query on the primary (see get_post), which are then cached too.
+A dict that maps the post_id of every existing post to its row is returned, missing posts are left out.
+"""
+
+async def aget_posts(post_ids):
+    cached = await cache.aget_many([post_key(post_id) for post_id in post_ids])
+    rows = {post['post_id']: post for post in cached.values()}
+    missing = [post_id for post_id in post_ids if post_id not in rows]
+
+    if missing:
+        fetched = {post['post_id']: post async for post in
+                   Post.objects.using(DEFAULT_DB_ALIAS).filter(post_id__in=missing).values(*ROW_FIELDS)}
+        rows.update(fetched)
+        await cache.aset_many({post_key(post_id): post for post_id, post in fetched.items()}, settings.POST_CACHE_TTL)
+
+    return rows
+
+
+"""
+This function returns the media snapshot of a post row (see snapshots.py), or None if the post has no snapshot
+or its snapshot is of an older MEDIA_SNAPSHOT_VERSION. Rows cached before the snapshots existed have none.
+"""
+
+def current_snapshot(post):
+    if post.get('media_snapshot_version') != settings.MEDIA_SNAPSHOT_VERSION:
+        return None
+    return post.get('media_snapshot')
+
+
+def needs_media(post):
+    return bool(post['media']) and current_snapshot(post) is None
+
+
+"""
+The media of posts (post_id -> media list) from get_media_map. degraded has the post_ids whose media could not be
+fetched, they have their stale media or none; a response with such posts must not be cached by the clients.
+"""
+
+class MediaMap(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.degraded = set()
+
+
+"""
+This function works like hydrate_media, but the media snapshots of the posts are used and the media of each post
+without a snapshot is cached for MEDIA_CACHE_TTL seconds.
+Only the media of posts without a snapshot or cached media is requested from the media microservice.
+Failed lookups (see hydrate_media) are not cached, so a media outage does not stay in the cache; media that the media
+microservice does not know anymore is cached as an empty list.
+Instead the stale copy of the media is returned for them if there is one (kept for MEDIA_STALE_TTL seconds),
+so while the media microservice is down or its circuit breaker is open the posts keep their last known media.
+A MediaMap is returned, these posts are in its "degraded" set.
+"""
+
+def get_media_map(posts):
+    cached = cache.get_many([media_key(post['post_id']) for post in posts if needs_media(post)])
+    media_map, missing = split_cached(posts, cached)
+
+    if missing:
+        fetched, failed = hydrate_media(missing)
+        cache.set_many(cacheable(fetched, failed), settings.MEDIA_CACHE_TTL)
+        cache.set_many(cacheable(fetched, failed, stale_media_key), settings.MEDIA_STALE_TTL)
+
+        if failed:
+            stale = cache.get_many([stale_media_key(post_id) for post_id in failed])
+            fetched.update(use_stale(failed, stale))
+            media_map.degraded.update(failed)
+
+        media_map.update(fetched)
+
+    return media_map
+
+
+"""
+This function is the async version of get_media_map, for the async views.
+The media microservice is called in a worker thread, so the event loop is not blocked while waiting.
+"""
+
+async def aget_media_map(posts):
+    cached = await cache.aget_many([media_key(post['post_id']) for post in posts if needs_media(post)])
+    media_map, missing = split_cached(posts, cached)
+
+    if missing:
+        fetched, failed = await sync_to_async(hydrate_media, thread_sensitive=False)(missing)
+        await cache.aset_many(cacheable(fetched, failed), settings.MEDIA_CACHE_TTL)
+        await cache.aset_many(cacheable(fetched, failed, stale_media_key), settings.MEDIA_STALE_TTL)
+
+        if failed:
+            stale = await cache.aget_many([stale_media_key(post_id) for post_id in failed])
+            fetched.update(use_stale(failed, stale))
+            media_map.degraded.update(failed)
+
+        media_map.update(fetched)
+
+    return media_map
+
+
+def split_cached(posts, cached):
+    media_map = MediaMap()
+    missing = []
+
+    for post in posts:
+        if not post['media']:
+            media_map[post['post_id']] = []
+        elif not needs_media(post):
+            media_map[post['post_id']] = current_snapshot(post)
+        elif media_key(post['post_id']) in cached:
+            media_map[post['post_id']] = cached[media_key(post['post_id'])]
+        else:
+            missing.append(post)
+
+    return media_map, missing
+
+
+def cacheable(fetched, failed, key=media_key):
+    return {key(post_id): media for post_id, media in fetched.items() if post_id not in failed}
+
+
+def use_stale(failed, stale):
+    return {post_id: stale[stale_media_key(post_id)] for post_id in failed if stale_media_key(post_id) in stale}
+
+
+"""
+This function removes a post and its media from the cache, it is called after a post was updated or deleted.
+"""
+
+def invalidate_post(post_id):
+    invalidate_posts([post_id])
+
+
+def invalidate_posts(post_ids):
+    cache.delete_many([key(post_id) for post_id in post_ids for key in (post_key, media_key, stale_media_key)] +
+                      [result_cache_key('post', post_id) for post_id in post_ids])
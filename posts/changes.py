@@ -0,0 +1,317 @@
+import asyncio
+import base64
+import json
+import time
+from datetime import datetime, timedelta
+
+import orjson
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, connections
+from django.utils import timezone
+
+from posts.models import PostChange
+from posts.singleflight import SingleFlight
+
+#the newest readable position of the log of every db, checked at most every POSTS_CHANGES_POLL_INTERVAL seconds
+#per worker process, so waiting consumers do not query the log on their own
+heads = {}
+head_flight = SingleFlight('changes')
+
+
+class CursorExpired(Exception):
+    pass
+
+
+"""
+This function appends the changes of the given posts to the change log, kind is PostChange.CREATED, UPDATED
+or DELETED and fields the changed fields of an update. It has to be called in the transaction that writes the posts.
+"""
+
+def record_changes(kind, posts, fields=None):
+    PostChange.objects.bulk_create([
+        PostChange(kind=kind, post_id=post.post_id, user_id=post.user_id, fields=fields) for post in posts
+    ])
+
+
+"""
+These functions build and read the opaque cursor of the change log, which points to a position (xid, id) of the log
+and has the time it was issued. A ValueError is raised if the cursor is not valid, CursorExpired if it is older than
+POSTS_CHANGES_RETENTION_DAYS: the changes after it may have been expired, the consumer has to read the posts again.
+A newer cursor can still point before expired changes (of a consumer that is far behind), read_changes checks that.
+"""
+
+def encode_change_cursor(position):
+    xid, id = position
+    return base64.urlsafe_b64encode(json.dumps([xid, id, timezone.now().isoformat()]).encode()).decode()
+
+
+def decode_change_cursor(cursor):
+    try:
+        xid, id, issued_at = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        position, issued_at = (int(xid), int(id)), datetime.fromisoformat(issued_at)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("invalid cursor")
+
+    if issued_at < timezone.now() - timedelta(days=settings.POSTS_CHANGES_RETENTION_DAYS):
+        raise CursorExpired("the cursor has expired")
+
+    return position
+
+
+def change_data(row):
+    id, xid, kind, post_id, user_id, fields, created_at = row
+    return {
+        "type": kind,
+        "post_id": str(post_id),
+        "user_id": user_id,
+        #Django reads jsonb columns as text
+        "fields": json.loads(fields) if fields is not None else None,
+        "changed_at": created_at.isoformat(),
+    }
+
+
+"""
+This function reads at most limit changes after the position (xid, id) from the log of the db, only of the posts of
+user_id if it is given. A list of (position, change data) and the position to read from next are returned.
+Only the entries of finished transactions are read (xid below the oldest running transaction): ids are taken when an
+entry is written but become visible when its transaction commits, a slow transaction could otherwise commit an entry
+behind a position that was already read. A long write transaction holds the following changes back until it ends.
+The newest readable position is read in the same statement, so if fewer than limit changes are found the next read
+starts there, even if the changes in between were of other users.
+CursorExpired is raised if changes after the position were expired (see expired_position).
+"""
+
+def read_changes(db, position, limit, user_id=None):
+    user_filter = 'AND change.user_id = %s' if user_id is not None else ''
+
+    with connections[db].cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT change.id, change.xid, change.kind, change.post_id, change.user_id, change.fields, change.created_at,
+                   head.xid, head.id, expiry.xid, expiry.change_id
+            FROM (SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint AS xmin) snapshot
+            LEFT JOIN posts_postchangeexpiry expiry ON expiry.id = 1
+            LEFT JOIN LATERAL (
+                SELECT xid, id FROM posts_postchange WHERE xid < snapshot.xmin ORDER BY xid DESC, id DESC LIMIT 1
+            ) head ON true
+            LEFT JOIN LATERAL (
+                SELECT * FROM posts_postchange change
+                WHERE (change.xid, change.id) > (%s, %s) AND change.xid < snapshot.xmin {user_filter}
+                ORDER BY change.xid, change.id LIMIT %s
+            ) change ON true
+            ORDER BY change.xid, change.id
+            """,
+            [*position, *([user_id] if user_id is not None else []), limit]
+        )
+        rows = cursor.fetchall()
+
+    if rows[0][9] is not None and position < (rows[0][9], rows[0][10]):
+        raise CursorExpired("the changes after the cursor have expired")
+
+    changes = [((row[1], row[0]), change_data(row[:7])) for row in rows if row[0] is not None]
+    head = (rows[0][7], rows[0][8]) if rows[0][7] is not None else position
+
+    if len(changes) == limit:
+        return changes, changes[-1][0]
+
+    return changes, max(head, position)
+
+
+"""
+This function returns the position of the newest expired change of the log of the db, or (0, 0) if none was expired.
+A consumer that starts without a cursor starts there.
+"""
+
+def expired_position(db):
+    with connections[db].cursor() as cursor:
+        cursor.execute("SELECT xid, change_id FROM posts_postchangeexpiry WHERE id = 1")
+        row = cursor.fetchone()
+
+    return tuple(row) if row else (0, 0)
+
+
+def latest_position(db):
+    with connections[db].cursor() as cursor:
+        cursor.execute("SELECT xid, id FROM posts_postchange WHERE xid < pg_snapshot_xmin(pg_current_snapshot())::text::bigint "
+                       "ORDER BY xid DESC, id DESC LIMIT 1")
+        row = cursor.fetchone()
+
+    return tuple(row) if row else (0, 0)
+
+
+"""
+This function calls function(db, *args) and then returns the connection to the db (to the pool): a request keeps its
+connection until it ends otherwise, and waiting consumers would hold all connections of the pool while they wait.
+"""
+
+def released(function, db, *args):
+    try:
+        return function(db, *args)
+    finally:
+        if not connections[db].in_atomic_block:
+            connections[db].close()
+
+
+"""
+This function returns the newest readable position of the log of the db. Concurrent calls of a worker share one query,
+and the position is reused for POSTS_CHANGES_POLL_INTERVAL seconds.
+"""
+
+async def current_head(db):
+    checked_at, head = heads.get(db, (0, None))
+    if time.monotonic() - checked_at < settings.POSTS_CHANGES_POLL_INTERVAL:
+        return head
+
+    head = await head_flight.do(db, lambda: sync_to_async(released)(latest_position, db))
+    heads[db] = (time.monotonic(), head)
+    return head
+
+
+"""
+This function waits until the log of the db has changes after the position, or at most timeout seconds.
+True is returned if there are new changes.
+"""
+
+async def wait_for_changes(db, position, timeout):
+    deadline = time.monotonic() + timeout
+
+    while True:
+        if await current_head(db) > position:
+            return True
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(settings.POSTS_CHANGES_POLL_INTERVAL, remaining))
+
+
+"""
+This function reads the next changes after the position (see read_changes). If there are none it waits up to "wait"
+seconds for new ones (long-poll). The changes and the next position are returned.
+"""
+
+async def next_changes(db, position, limit, user_id=None, wait=0):
+    deadline = time.monotonic() + wait
+
+    while True:
+        changes, position = await sync_to_async(released)(read_changes, db, position, limit, user_id)
+        if changes:
+            return changes, position
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not await wait_for_changes(db, position, remaining):
+            return changes, position
+
+
+"""
+This function streams the changes after the position as server-sent events, each with the cursor after it as its id,
+so a client that reconnects continues with the Last-Event-ID header. A comment is sent every POSTS_CHANGES_HEARTBEAT
+seconds without changes to keep the connection open. The stream ends after POSTS_CHANGES_STREAM_SECONDS seconds,
+the client then reconnects (EventSource does that on its own). It also ends if the changes after its position expire.
+"""
+
+async def change_events(db, position, limit, user_id=None):
+    deadline = time.monotonic() + settings.POSTS_CHANGES_STREAM_SECONDS
+    yield b'retry: 1000\n\n'
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+
+        try:
+            changes, position = await next_changes(db, position, limit, user_id,
+                                                   min(settings.POSTS_CHANGES_HEARTBEAT, remaining))
+        except CursorExpired:
+            #the stream fell behind the expiry, the client gets status 410 when it reconnects
+            return
+        if not changes:
+            yield b': keep-alive\n\n'
+            continue
+
+        yield b''.join(
+            f'id: {encode_change_cursor(change_position)}\nevent: {change["type"]}\n'.encode() +
+            b'data: ' + orjson.dumps(change) + b'\n\n'
+            for change_position, change in changes
+        )
+
+
+"""
+This function compacts the change log: of the entries older than "before", every entry of a post that has a newer
+entry is deleted, so only the newest change of every post remains (a consumer that reads the log from before gets the
+same posts, with fewer changes). An update that absorbed older changes has no fields anymore.
+The log is compacted in batches of batch_size entries, the number of deleted entries is returned.
+"""
+
+def compact_changes(before, batch_size=1000):
+    deleted = 0
+    last = 0
+
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT max(id) FROM (SELECT id FROM posts_postchange WHERE id > %s AND created_at < %s "
+                "ORDER BY id LIMIT %s) batch",
+                [last, before, batch_size]
+            )
+            end = cursor.fetchone()[0]
+            if end is None:
+                return deleted
+
+            cursor.execute(
+                """
+                WITH removed AS (
+                    DELETE FROM posts_postchange old USING posts_postchange newer
+                    WHERE old.id > %s AND old.id <= %s AND old.created_at < %s AND newer.post_id = old.post_id
+                          AND (newer.xid, newer.id) > (old.xid, old.id)
+                    RETURNING old.post_id
+                ), absorbed AS (
+                    UPDATE posts_postchange latest SET fields = NULL
+                    WHERE latest.kind = %s AND latest.post_id IN (SELECT post_id FROM removed) AND NOT EXISTS (
+                        SELECT 1 FROM posts_postchange newer
+                        WHERE newer.post_id = latest.post_id AND (newer.xid, newer.id) > (latest.xid, latest.id)
+                    )
+                )
+                SELECT count(*) FROM removed
+                """,
+                [last, end, before, PostChange.UPDATED]
+            )
+            deleted += cursor.fetchone()[0]
+
+        last = end
+
+
+"""
+This function deletes the entries of the change log older than "before" in batches of batch_size entries,
+the number of deleted entries is returned. Cursors older than POSTS_CHANGES_RETENTION_DAYS are not accepted anymore,
+so "before" must not be newer than that. The newest deleted position is kept in PostChangeExpiry,
+cursors before it are not accepted either.
+"""
+
+def expire_changes(before, batch_size=1000):
+    deleted = 0
+
+    while True:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH expired AS (
+                    DELETE FROM posts_postchange WHERE id IN
+                    (SELECT id FROM posts_postchange WHERE created_at < %s ORDER BY id LIMIT %s)
+                    RETURNING xid, id
+                ), watermark AS (
+                    INSERT INTO posts_postchangeexpiry (id, xid, change_id)
+                    SELECT 1, xid, id FROM expired ORDER BY xid DESC, id DESC LIMIT 1
+                    ON CONFLICT (id) DO UPDATE SET xid = EXCLUDED.xid, change_id = EXCLUDED.change_id
+                    WHERE (EXCLUDED.xid, EXCLUDED.change_id) > (posts_postchangeexpiry.xid, posts_postchangeexpiry.change_id)
+                )
+                SELECT count(*) FROM expired
+                """,
+                [before, batch_size]
+            )
+            count = cursor.fetchone()[0]
+            deleted += count
+
+        if count < batch_size:
+            return deleted
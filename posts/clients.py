@@ -0,0 +1,119 @@
+import os
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from posts.metrics import register_collector
+from posts.timing import record
+
+MEDIA_SERVICE_URL = os.getenv("MEDIA_SERVICE_URL")
+INTERACTIONS_SERVICE_URL = os.getenv("INTERACTIONS_SERVICE_URL")
+
+
+"""
+This class is a client for another microservice.
+It owns a requests session with a pool of keep-alive connections, so calls reuse open TCP connections
+instead of connecting (and resolving the host) again for every request.
+Idempotent requests (GET, DELETE, ...) are retried with exponential backoff on connection errors and 502/503/504,
+and every request gets the connect and read timeouts from the settings unless it sets its own timeout.
+Requests with retry=False are sent once (through a second pool), for callers with their own deadline like the
+media hydration, where the retries would outlast the deadline.
+"""
+
+class ServiceClient:
+    def __init__(self, name, base_url, pool_size):
+        self.name = name
+        self.base_url = base_url
+
+        retry = Retry(
+            total=settings.HTTP_RETRIES,
+            backoff_factor=settings.HTTP_RETRY_BACKOFF,
+            status_forcelist=(502, 503, 504),
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session = requests.Session()
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+        self.single_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.single_session = requests.Session()
+        self.single_session.mount('http://', self.single_adapter)
+        self.single_session.mount('https://', self.single_adapter)
+
+    def request(self, method, path, retry=True, **kwargs):
+        kwargs.setdefault('timeout', (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT))
+        session = self.session if retry else self.single_session
+
+        #the call is recorded as a span of the current request, named after the service
+        started = time.perf_counter()
+        try:
+            return session.request(method, f'{self.base_url}{path}', **kwargs)
+        finally:
+            record(self.name, time.perf_counter() - started)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+    """
+    This method returns the state of the connection pools of this client, one entry per host and pool (with and
+    without retries): the pool size, how many connections were opened, how many requests were sent and how many
+    connections are idle.
+    """
+
+    def pool_stats(self):
+        stats = []
+
+        for retry, adapter in ((True, self.adapter), (False, self.single_adapter)):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+
+                stats.append({
+                    "host": f'{pool.scheme}://{pool.host}:{pool.port}',
+                    "retry": retry,
+                    "maxsize": pool.pool.maxsize if pool.pool else 0,
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "idle": sum(1 for connection in list(pool.pool.queue) if connection) if pool.pool else 0,
+                })
+
+        return stats
+
+
+media_service = ServiceClient('media', MEDIA_SERVICE_URL, settings.MEDIA_POOL_SIZE)
+interactions_service = ServiceClient('interactions', INTERACTIONS_SERVICE_URL, settings.INTERACTIONS_POOL_SIZE)
+
+
+"""
+This function adds the state of the connection pools to the metrics.
+"""
+
+def collect_pool_metrics():
+    metrics = {
+        'posts_http_pool_maxsize': ("Size of the connection pool.", 'maxsize'),
+        'posts_http_pool_connections_opened': ("Connections opened by the pool.", 'connections_opened'),
+        'posts_http_pool_requests': ("Requests sent through the pool.", 'requests'),
+        'posts_http_pool_idle': ("Idle connections in the pool.", 'idle'),
+    }
+    pools = [(client.name, pool) for client in (media_service, interactions_service) for pool in client.pool_stats()]
+
+    return [
+        (name, 'gauge', help, [({"service": service, "host": pool["host"], "retry": str(pool["retry"]).lower()}, pool[key]) for service, pool in pools])
+        for name, (help, key) in metrics.items()
+    ]
+
+
+register_collector(collect_pool_metrics)
@@ -0,0 +1,58 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+"""
+This function builds the validators (strong ETag and Last-Modified timestamp) of a list of post rows.
+The ETag is a hash of the post_id and updated_at of every post (and of the next cursor for pages),
+so it changes whenever a post of the list is updated, added or removed. Last-Modified is the newest updated_at
+(in whole seconds, like the http date it is sent as).
+The media ids of a post can not be changed, and a refreshed media snapshot gives the post a new updated_at
+(see snapshots.py), so the media is not part of the validators and is not needed to compute them. The media data can
+still differ when the media microservice fails (the posts get their stale media or none), such responses get no
+validators, see set_validators.
+"""
+
+def validators(posts, next_cursor=None):
+    digest = hashlib.blake2b(digest_size=16)
+    for post in posts:
+        digest.update(f"{post['post_id']}:{post['updated_at'].isoformat()};".encode())
+    digest.update(str(next_cursor).encode())
+
+    last_modified = max((post['updated_at'] for post in posts), default=None)
+    return quote_etag(digest.hexdigest()), int(last_modified.timestamp()) if last_modified else None
+
+
+"""
+This function checks the If-None-Match and If-Modified-Since headers of the request against the validators.
+If the client already has the current version, a 304 response is returned (412 if an If-Match precondition fails),
+otherwise None.
+It is called before the media is hydrated, so a 304 costs no media requests and no serialization.
+"""
+
+def not_modified(request, etag, last_modified):
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_validators(response, etag, last_modified)
+
+    return response
+
+
+"""
+This function sets the validators on a response. If the media of some posts of the response could not be fetched
+(media_map.degraded, see get_media_map), the response gets Cache-Control: no-store and no validators instead, so a
+client does not keep (and revalidate with 304s) the incomplete body until the post is updated.
+"""
+
+def set_validators(response, etag, last_modified, media_map=None):
+    if media_map is not None and media_map.degraded:
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
+    response.headers['ETag'] = etag
+    if last_modified is not None:
+        response.headers['Last-Modified'] = http_date(last_modified)
+
+    return response
@@ -0,0 +1,57 @@
+from django.db import connections
+
+from posts.metrics import register_collector
+
+#the psycopg pool stats that are exported as metrics: (stats key, metric name, type, help, scale)
+POOL_METRICS = [
+    ('pool_max', 'posts_db_pool_max_size', 'gauge', "Maximum number of connections of the pool.", 1),
+    ('pool_size', 'posts_db_pool_size', 'gauge', "Connections of the pool (in use and idle).", 1),
+    ('pool_available', 'posts_db_pool_available', 'gauge', "Idle connections in the pool.", 1),
+    ('requests_waiting', 'posts_db_pool_requests_waiting', 'gauge', "Requests waiting for a connection.", 1),
+    ('requests_num', 'posts_db_pool_requests_total', 'counter', "Connections requested from the pool.", 1),
+    ('requests_wait_ms', 'posts_db_pool_wait_seconds_total', 'counter',
+     "Time spent waiting for a connection from the pool.", 0.001),
+    ('requests_errors', 'posts_db_pool_timeouts_total', 'counter', "Requests that got no connection in time.", 1),
+    ('connections_num', 'posts_db_pool_connections_opened_total', 'counter', "Connections opened by the pool.", 1),
+    ('connections_errors', 'posts_db_pool_connection_errors_total', 'counter', "Failed connection attempts.", 1),
+    ('returns_bad', 'posts_db_pool_returns_bad_total', 'counter', "Broken connections returned to the pool.", 1),
+]
+
+
+"""
+This function returns the state of the db connection pool of every database of this worker process:
+the psycopg pool stats if the pool is used, otherwise the CONN_MAX_AGE of the persistent connections.
+A database with a pool is only reported once this process has created its pool (the pool property would create it),
+so an unused database (like a replica that no request has read from) gets no pool.
+"""
+
+def db_pool_stats():
+    stats = {}
+
+    for alias in connections:
+        connection = connections[alias]
+        if not connection.settings_dict['OPTIONS'].get('pool'):
+            stats[alias] = {"pool": False, "conn_max_age": connection.settings_dict['CONN_MAX_AGE']}
+            continue
+
+        pool = getattr(connection, '_connection_pools', {}).get(alias)
+        if pool is not None:
+            stats[alias] = {"pool": True, **pool.get_stats()}
+
+    return stats
+
+
+"""
+This function adds the state of the db connection pools to the metrics.
+"""
+
+def collect_db_pool_metrics():
+    pools = [(alias, stats) for alias, stats in db_pool_stats().items() if stats["pool"]]
+
+    return [
+        (name, type, help, [({"database": alias}, stats.get(key, 0) * scale) for alias, stats in pools])
+        for key, name, type, help, scale in POOL_METRICS
+    ]
+
+
+register_collector(collect_db_pool_metrics)
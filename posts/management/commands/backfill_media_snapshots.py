@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts.snapshots import backfill_snapshots
+
+
+class Command(BaseCommand):
+    help = ("Stores the media data of the posts without a media snapshot or with an older MEDIA_SNAPSHOT_VERSION, "
+            "or refreshes the snapshots of the posts with the given media ids.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--media-id', action='append', dest='media_ids',
+                            help="Refresh the posts with this media id (repeatable), e.g. after the media changed.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Posts per media request and update.")
+
+    def handle(self, *args, **options):
+        refreshed, failed = backfill_snapshots(options['media_ids'], options['batch_size'])
+        self.stdout.write(f"refreshed {refreshed} posts, the media of {failed} posts could not be fetched")
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts.changes import compact_changes, expire_changes
+
+
+class Command(BaseCommand):
+    help = ("Compacts the change log of the posts to the newest change of every post for the changes older than "
+            "POSTS_CHANGES_COMPACT_AFTER_HOURS and deletes the changes older than POSTS_CHANGES_RETENTION_DAYS. "
+            "Run it hourly.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compact-after-hours', type=int, default=settings.POSTS_CHANGES_COMPACT_AFTER_HOURS)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+
+        #cursors are valid for POSTS_CHANGES_RETENTION_DAYS, so the retention is not an option
+        expired = expire_changes(now - timedelta(days=settings.POSTS_CHANGES_RETENTION_DAYS), options['batch_size'])
+        self.stdout.write(f"expired changes: {expired}")
+
+        compacted = compact_changes(now - timedelta(hours=options['compact_after_hours']), options['batch_size'])
+        self.stdout.write(f"compacted changes: {compacted}")
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.outbox import drain_batch
+
+
+class Command(BaseCommand):
+    help = "Sends the delete requests in the outbox to the media and interactions microservices."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the due entries once and exit.")
+        parser.add_argument('--batch-size', type=int, default=None, help="Number of entries locked per batch.")
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help="Seconds to wait when the outbox is empty.")
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = drain_batch(options['batch_size'])
+
+            if sent or failed:
+                self.stdout.write(f"sent {sent} outbox entries, {failed} failed")
+                continue
+
+            if options['once']:
+                return
+
+            time.sleep(options['interval'])
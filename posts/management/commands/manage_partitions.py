@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts.partitions import add_months, create_partitions, detach_partitions, month_start
+
+
+class Command(BaseCommand):
+    help = ("Creates the monthly partitions of the posts table for the next POSTS_PARTITION_MONTHS_AHEAD months and "
+            "detaches the partitions older than POSTS_PARTITION_RETENTION_MONTHS (0 keeps all posts) "
+            "into the schema POSTS_ARCHIVE_SCHEMA. Run it daily.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months-ahead', type=int, default=settings.POSTS_PARTITION_MONTHS_AHEAD)
+        parser.add_argument('--retention-months', type=int, default=settings.POSTS_PARTITION_RETENTION_MONTHS)
+        parser.add_argument('--drop', action='store_true', help="Drop the old partitions instead of archiving them.")
+
+    def handle(self, *args, **options):
+        this_month = month_start(timezone.now())
+
+        created = create_partitions(add_months(this_month, options['months_ahead']))
+        self.stdout.write(f"created partitions: {', '.join(created) or '-'}")
+
+        if options['retention_months'] > 0:
+            before = add_months(this_month, -options['retention_months'])
+            detached = detach_partitions(before, None if options['drop'] else settings.POSTS_ARCHIVE_SCHEMA)
+            self.stdout.write(f"{'dropped' if options['drop'] else 'archived'} partitions: {', '.join(detached) or '-'}")
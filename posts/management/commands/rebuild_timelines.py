@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.timelines import rebuild_timelines
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the tag timelines from the posts table (the newest TAG_TIMELINE_LENGTH posts of every tag)."
+
+    def handle(self, *args, **options):
+        entries = rebuild_timelines()
+        self.stdout.write(f"wrote {entries} timeline entries")
@@ -0,0 +1,74 @@
+import random
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from posts.models import Post
+
+TAGS = [
+    "travel", "food", "sports", "music", "art", "fashion", "nature", "photography", "fitness", "tech",
+    "gaming", "movies", "books", "pets", "cars", "design", "coffee", "beach", "mountains", "city",
+    "friends", "family", "party", "summer", "winter", "diy", "science", "study", "uni", "memes",
+]
+WORDS = "the a my new best day time life love photo view trip look weekend morning night good with at in".split()
+
+
+class Command(BaseCommand):
+    help = "Creates random posts for benchmarks: --users users with --posts posts each."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--posts', type=int, default=50, help="Posts per user.")
+        parser.add_argument('--days', type=int, default=90, help="The posts are spread over the last DAYS days.")
+        parser.add_argument('--seed', type=int, default=1, help="Seed of the random generator, for repeatable data.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+        #a few tags are much more popular than the others, like on a real platform
+        tag_weights = [1 / (rank + 1) for rank in range(len(TAGS))]
+
+        batch = []
+        created = 0
+
+        for user in range(options['users']):
+            user_id = str(10000 + user)
+
+            for _ in range(options['posts']):
+                tags = set(rng.choices(TAGS, weights=tag_weights, k=rng.randint(0, 4)))
+                created_at = now - timedelta(seconds=rng.randint(0, options['days'] * 86400))
+
+                batch.append(Post(
+                    post_id=uuid.UUID(int=rng.getrandbits(128), version=4),
+                    caption=" ".join(rng.choices(WORDS, k=rng.randint(2, 8))),
+                    content=" ".join(rng.choices(WORDS, k=rng.randint(5, 40))),
+                    username=f"user{user_id}",
+                    user_id=user_id,
+                    media=[str(rng.randint(1, 10 ** 9)) for _ in range(rng.choice([0, 1, 1, 1, 2, 3, 4]))],
+                    tags=sorted(tags),
+                    created_at=created_at,
+                    updated_at=created_at,
+                ))
+
+                if len(batch) >= options['batch_size']:
+                    created += self.save(batch)
+
+        created += self.save(batch)
+        self.stdout.write(f"created {created} posts for {options['users']} users")
+
+    def save(self, batch):
+        created_at = [post.created_at for post in batch]
+        Post.objects.bulk_create(batch)
+
+        #auto_now and auto_now_add overwrite the timestamps on insert, so they are set again afterwards
+        for post, timestamp in zip(batch, created_at):
+            post.created_at = timestamp
+            post.updated_at = timestamp
+        Post.objects.bulk_update(batch, ['created_at', 'updated_at'], batch_size=1000)
+
+        count = len(batch)
+        batch.clear()
+        return count
@@ -0,0 +1,132 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import json, requests
+from django.conf import settings
+
+from posts.breaker import CircuitBreaker
+from posts.clients import media_service
+
+media_breaker = CircuitBreaker('media', settings.MEDIA_BREAKER_FAILURES, settings.MEDIA_BREAKER_SLOW_CALL,
+                               settings.MEDIA_BREAKER_RESET_TIMEOUT)
+
+
+"""
+This function sends one chunk of media_ids to the media microservice.
+The media data is returned, or None if the request failed or timed out (it is not retried).
+While the media breaker is open the chunk is not requested at all and None is returned right away.
+"""
+
+def _fetch_chunk(chunk, timeout):
+    if not media_breaker.allow():
+        return None
+
+    started = time.perf_counter()
+    media = None
+    try:
+        response = media_service.get(
+            '/media',
+            data=json.dumps(chunk),
+            headers={'Content-Type': 'application/json'},
+            timeout=timeout,
+            #a retry would outlast MEDIA_DEADLINE, a failed chunk is left out instead
+            retry=False
+        )
+
+        if response.status_code == 200:
+            media = response.json()
+    except (requests.RequestException, ValueError):
+        pass
+    finally:
+        media_breaker.record(media is not None, time.perf_counter() - started)
+
+    return media
+
+
+"""
+This function requests the media data for a list of media_ids from the media microservice.
+The ids are sent in chunks of MEDIA_BATCH_SIZE, and the chunks are requested concurrently by at most
+MEDIA_MAX_CONCURRENCY threads. Each request times out after MEDIA_REQUEST_TIMEOUT seconds,
+and chunks that are not finished after MEDIA_DEADLINE seconds are left out (partial result).
+The media data of all chunks (in the order of the chunks and of the responses) and the set of media_ids (as strings)
+of the chunks that failed are returned. Ids that the media microservice does not know are missing from the media data
+but are not failed.
+"""
+
+def fetch_media(media_ids):
+    batch_size = settings.MEDIA_BATCH_SIZE
+    chunks = [media_ids[start:start + batch_size] for start in range(0, len(media_ids), batch_size)]
+    results = [None] * len(chunks)
+
+    if len(chunks) == 1:
+        #a single chunk is requested directly, the deadline also bounds its timeout
+        timeout = min(settings.MEDIA_REQUEST_TIMEOUT, settings.MEDIA_DEADLINE)
+        results[0] = _fetch_chunk(chunks[0], timeout)
+
+    elif chunks:
+        executor = ThreadPoolExecutor(max_workers=min(settings.MEDIA_MAX_CONCURRENCY, len(chunks)),
+                                      thread_name_prefix='media')
+        #every thread runs in a copy of the current context, so its calls are recorded for the current request
+        futures = [executor.submit(contextvars.copy_context().run, _fetch_chunk, chunk, settings.MEDIA_REQUEST_TIMEOUT)
+                   for chunk in chunks]
+
+        #wait until all chunks are done or the deadline has passed, unfinished chunks are dropped
+        done, _ = wait(futures, timeout=settings.MEDIA_DEADLINE)
+        executor.shutdown(wait=False, cancel_futures=True)
+        results = [future.result() if future in done else None for future in futures]
+
+    media = [item for result in results if result for item in result]
+    failed = {str(media_id) for chunk, result in zip(chunks, results) if result is None for media_id in chunk}
+
+    return media, failed
+
+
+"""
+This function picks the media data of a post (its media_ids) from the result of fetch_media, in the order the
+media microservice returned it; ids it does not know are skipped. If the media data is only of this post (whole),
+it is returned unchanged, like the media microservice returned it for the ids of the post.
+None is returned if the chunk of one of the ids failed.
+"""
+
+def post_media(media_ids, media, failed, whole=False):
+    if any(str(media_id) in failed for media_id in media_ids):
+        return None
+
+    if whole:
+        return media
+
+    ids = {str(media_id) for media_id in media_ids}
+    return [item for item in media if isinstance(item, dict) and str(item.get('MediaId')) in ids]
+
+
+"""
+This function gets the media data for all given posts at once.
+The media_ids of every post are collected, fetched with fetch_media and then mapped back to their posts (see post_media).
+If the media of a post could not be fetched, the media of that post is left as an empty list.
+A dict that maps each post_id to its media list and the set of the post_ids whose media could not be fetched are
+returned; a post whose media the media microservice does not know (anymore) has an empty list but is not failed.
+"""
+
+def hydrate_media(posts):
+    media_ids = []
+    seen = set()
+
+    #collect the media_ids of all posts, without duplicates
+    for post in posts:
+        for media_id in post['media']:
+            if str(media_id) not in seen:
+                seen.add(str(media_id))
+                media_ids.append(media_id)
+
+    media, failed = fetch_media(media_ids) if media_ids else ([], set())
+    media_map = {}
+    failed_posts = set()
+
+    for post in posts:
+        post_media_data = post_media(post['media'], media, failed, whole=len(posts) == 1)
+        if post_media_data is None:
+            failed_posts.add(post['post_id'])
+        media_map[post['post_id']] = post_media_data if post_media_data is not None else []
+
+    return media_map, failed_posts
@@ -0,0 +1,121 @@
+import threading
+
+
+"""
+Metrics of this process in the Prometheus text format, served by the metrics view on /metrics.
+Every gunicorn worker has its own metrics, so the values are per worker process.
+"""
+
+REGISTRY = []
+COLLECTORS = []
+
+
+def format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(labelnames, escaped))
+    return '{' + pairs + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0}
+
+            observations = self.values[key]
+            observations["count"] += 1
+            observations["sum"] += value
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    observations["buckets"][index] += 1
+
+    def samples(self):
+        samples = []
+
+        with self.lock:
+            for key, observations in self.values.items():
+                for bound, count in zip(self.buckets, observations["buckets"]):
+                    samples.append((f'{self.name}_bucket', key + (bound,), count))
+
+                samples.append((f'{self.name}_bucket', key + ('+Inf',), observations["count"]))
+                samples.append((f'{self.name}_sum', key, observations["sum"]))
+                samples.append((f'{self.name}_count', key, observations["count"]))
+
+        return samples
+
+
+"""
+This function registers a function that returns extra samples (name, type, help, [(labels dict, value)])
+when the metrics are rendered, for values that are read from other objects like the connection pools.
+"""
+
+def register_collector(collector):
+    COLLECTORS.append(collector)
+
+
+def render():
+    lines = []
+
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.help}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+
+        labelnames = metric.labelnames
+        for name, key, value in metric.samples():
+            names = labelnames + ('le',) if len(key) > len(labelnames) else labelnames
+            lines.append(f'{name}{format_labels(names, key)} {value}')
+
+    for collector in COLLECTORS:
+        for name, type, help, samples in collector():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {type}')
+            for labels, value in samples:
+                lines.append(f'{name}{format_labels(tuple(labels), tuple(labels.values()))} {value}')
+
+    return '\n'.join(lines) + '\n'
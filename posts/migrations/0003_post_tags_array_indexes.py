@@ -0,0 +1,83 @@
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models, transaction
+
+BACKFILL_BATCH_SIZE = 5000
+
+
+"""
+This function copies the json tags of the existing posts into the new tag_array column.
+The rows are updated in small batches, each in its own transaction, so the table is never locked as a whole.
+"""
+
+def backfill_tag_array(apps, schema_editor):
+    connection = schema_editor.connection
+
+    while True:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE posts_post SET tag_array = ARRAY(SELECT jsonb_array_elements_text(tags))
+                WHERE post_id IN (
+                    SELECT post_id FROM posts_post
+                    WHERE tag_array = '{}' AND jsonb_typeof(tags) = 'array' AND tags <> '[]'::jsonb
+                    LIMIT %s FOR UPDATE SKIP LOCKED
+                )
+                """,
+                [BACKFILL_BATCH_SIZE]
+            )
+
+            if cursor.rowcount == 0:
+                break
+
+
+"""
+This migration moves Post.tags from a json column to a GIN indexed text[] column and adds the
+indexes for keyset pagination. It is safe to run on a live table:
+the new column is added with a constant default (no table rewrite), the tags are backfilled in batches,
+the column swap only changes the catalog and the indexes are built concurrently.
+"""
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('posts', '0002_post_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='tag_array',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.TextField(), blank=True, default=list, db_default=[], size=None),
+        ),
+        migrations.RunPython(backfill_tag_array, migrations.RunPython.noop, elidable=True),
+        migrations.RemoveField(
+            model_name='post',
+            name='tags',
+        ),
+        migrations.RenameField(
+            model_name='post',
+            old_name='tag_array',
+            new_name='tags',
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='tags',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.TextField(), blank=True, default=list, size=None),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['tags'], name='posts_post_tags_gin'),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(fields=['user_id', 'created_at', 'post_id'], name='posts_post_user_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=models.Index(fields=['created_at', 'post_id'], name='posts_post_created_idx'),
+        ),
+    ]
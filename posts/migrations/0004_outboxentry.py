@@ -0,0 +1,30 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:23
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_post_tags_array_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('media', 'media'), ('interactions', 'interactions')], max_length=20)),
+                ('target', models.CharField(max_length=100)),
+                ('authorization', models.TextField(blank=True, default='')),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['next_attempt_at', 'id'], name='posts_outbox_due_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0004_outboxentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagTimelineEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.TextField()),
+                ('created_at', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='posts.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tag', 'created_at', 'post'], name='posts_timeline_tag_idx')],
+                'constraints': [models.UniqueConstraint(fields=('tag', 'post'), name='posts_timeline_tag_post_unique')],
+            },
+        ),
+    ]
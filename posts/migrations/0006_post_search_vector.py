@@ -0,0 +1,84 @@
+# Generated by Django 5.1.3 on 2026-10-18 08:38
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, transaction
+
+BACKFILL_BATCH_SIZE = 5000
+
+#the search document of a post: caption (weight A), tags (B) and content (C), see search.py
+CREATE_TRIGGER = """
+CREATE FUNCTION posts_post_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.caption, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(array_to_string(NEW.tags, ' '), '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(NEW.content, '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER posts_post_search_vector_update
+    BEFORE INSERT OR UPDATE OF caption, content, tags ON posts_post
+    FOR EACH ROW EXECUTE FUNCTION posts_post_search_vector();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER posts_post_search_vector_update ON posts_post;
+DROP FUNCTION posts_post_search_vector();
+"""
+
+
+"""
+This function fills the search_vector of the existing posts in small batches, each in its own transaction.
+Setting the caption to itself fires the trigger, which computes the search_vector.
+"""
+
+def backfill_search_vector(apps, schema_editor):
+    connection = schema_editor.connection
+
+    while True:
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE posts_post SET caption = caption
+                WHERE post_id IN (
+                    SELECT post_id FROM posts_post WHERE search_vector IS NULL
+                    LIMIT %s FOR UPDATE SKIP LOCKED
+                )
+                """,
+                [BACKFILL_BATCH_SIZE]
+            )
+
+            if cursor.rowcount == 0:
+                break
+
+
+"""
+This migration adds the full-text search vector of the posts. Like 0003 it is safe to run on a live table:
+the nullable column is added without a table rewrite, the trigger keeps new writes up to date while the existing
+posts are backfilled in batches, and the GIN index is built concurrently.
+"""
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('posts', '0005_tagtimelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.RunPython(backfill_search_vector, migrations.RunPython.noop, elidable=True),
+        AddIndexConcurrently(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='posts_post_search_gin'),
+        ),
+    ]
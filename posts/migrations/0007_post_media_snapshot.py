@@ -0,0 +1,36 @@
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+"""
+This migration adds the media snapshot of the posts. The columns are added without a table rewrite and the GIN index
+is built concurrently, so it is safe to run on a live table. The snapshots of the existing posts are filled afterwards
+with "manage.py backfill_media_snapshots", until then the posts are hydrated from the media microservice like before.
+"""
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('posts', '0006_post_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='media_snapshot',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='media_snapshot_version',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        AddIndexConcurrently(
+            model_name='post',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['media'], name='posts_post_media_gin',
+                                                           opclasses=['jsonb_path_ops']),
+        ),
+    ]
@@ -0,0 +1,94 @@
+from datetime import datetime, timezone
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+
+#monthly partitions that are created for the posts after the migration, "manage.py manage_partitions" adds more
+MONTHS_AHEAD = 3
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+"""
+This function converts posts_post into a table that is range partitioned on created_at, without copying the posts:
+the existing table becomes the first partition (all posts before the start of next month, "cutoff"), and new posts
+go into monthly partitions from the cutoff on. The slow steps run before the table is locked:
+    1. the unique index (post_id, created_at) for the new primary key is built concurrently
+    2. a CHECK (created_at < cutoff) is added NOT VALID and validated, which does not block writes
+Then one short transaction renames the table, creates the partitioned posts_post with the same columns, indexes and
+search trigger, and attaches the old table as its partition; the validated CHECK spares postgres the scan of the old
+table, and its indexes are reused for the partitioned indexes. Posts written until the cutoff still go to the old table.
+
+A primary key of a partitioned table has to contain the partition key, so it is (post_id, created_at), and no foreign
+key can point to post_id alone: the tag timelines keep their post_id without a db constraint (Django still deletes
+the entries of a deleted post). The migration can not be reversed.
+"""
+
+def partition_posts(apps, schema_editor):
+    connection = schema_editor.connection
+    now = datetime.now(timezone.utc)
+    cutoff = add_months(datetime(now.year, now.month, 1, tzinfo=timezone.utc), 1)
+
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS posts_post_partition_key "
+                       "ON posts_post (post_id, created_at)")
+        cursor.execute("ALTER TABLE posts_post ADD CONSTRAINT posts_post_before_cutoff CHECK (created_at < %s) NOT VALID",
+                       [cutoff])
+        cursor.execute("ALTER TABLE posts_post VALIDATE CONSTRAINT posts_post_before_cutoff")
+
+        cursor.execute("SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'posts_post' "
+                       "AND indexname NOT IN ('posts_post_pkey', 'posts_post_partition_key')")
+        indexes = cursor.fetchall()
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute("LOCK TABLE posts_post IN ACCESS EXCLUSIVE MODE")
+        cursor.execute("ALTER TABLE posts_post RENAME TO posts_post_legacy")
+        #the unique index becomes the primary key of the old table, so attaching it does not build another index
+        cursor.execute("ALTER TABLE posts_post_legacy DROP CONSTRAINT posts_post_pkey, "
+                       "ADD CONSTRAINT posts_post_legacy_pkey PRIMARY KEY USING INDEX posts_post_partition_key")
+        for name, _ in indexes:
+            cursor.execute(f"ALTER INDEX {name} RENAME TO {name}_legacy")
+
+        cursor.execute("CREATE TABLE posts_post (LIKE posts_post_legacy INCLUDING DEFAULTS INCLUDING STORAGE) "
+                       "PARTITION BY RANGE (created_at)")
+        cursor.execute("ALTER TABLE posts_post ADD CONSTRAINT posts_post_pkey PRIMARY KEY (post_id, created_at)")
+        for name, definition in indexes:
+            cursor.execute(definition.replace(" ON public.posts_post ", " ON posts_post "))
+
+        cursor.execute("DROP TRIGGER posts_post_search_vector_update ON posts_post_legacy")
+        cursor.execute("CREATE TRIGGER posts_post_search_vector_update "
+                       "BEFORE INSERT OR UPDATE OF caption, content, tags ON posts_post "
+                       "FOR EACH ROW EXECUTE FUNCTION posts_post_search_vector()")
+
+        cursor.execute("ALTER TABLE posts_post ATTACH PARTITION posts_post_legacy FOR VALUES FROM (MINVALUE) TO (%s)",
+                       [cutoff])
+        cursor.execute("ALTER TABLE posts_post_legacy DROP CONSTRAINT posts_post_before_cutoff")
+
+        start = cutoff
+        for _ in range(MONTHS_AHEAD):
+            end = add_months(start, 1)
+            cursor.execute(f"CREATE TABLE posts_post_p{start:%Y_%m} PARTITION OF posts_post FOR VALUES FROM (%s) TO (%s)",
+                           [start, end])
+            start = end
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('posts', '0007_post_media_snapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tagtimelineentry',
+            name='post',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE,
+                                    related_name='+', to='posts.post'),
+        ),
+        migrations.RunPython(partition_posts),
+    ]
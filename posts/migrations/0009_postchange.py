@@ -0,0 +1,28 @@
+# Generated by Django 5.1.3 on 2026-10-18 09:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_partition_posts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('xid', models.BigIntegerField(db_default=models.Func(output_field=models.BigIntegerField(), template='pg_current_xact_id()::text::bigint'), editable=False)),
+                ('kind', models.CharField(choices=[('created', 'created'), ('updated', 'updated'), ('deleted', 'deleted')], max_length=10)),
+                ('post_id', models.UUIDField()),
+                ('user_id', models.CharField(max_length=100)),
+                ('fields', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['xid', 'id'], name='posts_change_position_idx'), models.Index(fields=['user_id', 'xid', 'id'], name='posts_change_user_idx'), models.Index(fields=['post_id', 'xid', 'id'], name='posts_change_post_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations
+
+
+"""
+The default partition of posts_post takes the posts of months without a partition, so inserts do not fail if
+"manage.py manage_partitions" did not run in time. The partitions that it creates later take over their posts
+(see create_partitions). It is not dropped when the migration is reversed, it can still hold posts.
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_postchange'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            "CREATE TABLE IF NOT EXISTS posts_post_default PARTITION OF posts_post DEFAULT",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
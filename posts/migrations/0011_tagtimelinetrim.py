@@ -0,0 +1,41 @@
+# Generated by Django 5.1.3 on 2026-10-18 10:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+"""
+This function gives the timelines that are already full a watermark at their oldest entry: they may have been trimmed
+before the watermarks were recorded, so pages that reach their oldest entry are read from the posts table.
+"""
+
+def mark_full_timelines(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            """
+            INSERT INTO posts_tagtimelinetrim (tag, created_at, post_id)
+            SELECT DISTINCT ON (tag) tag, created_at, post_id FROM posts_tagtimelineentry
+            WHERE tag IN (SELECT tag FROM posts_tagtimelineentry GROUP BY tag HAVING count(*) >= %s)
+            ORDER BY tag, created_at, post_id
+            """,
+            [settings.TAG_TIMELINE_LENGTH]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_post_default_partition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagTimelineTrim',
+            fields=[
+                ('tag', models.TextField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField()),
+                ('post_id', models.UUIDField()),
+            ],
+        ),
+        migrations.RunPython(mark_full_timelines, migrations.RunPython.noop),
+    ]
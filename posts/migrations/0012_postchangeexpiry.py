@@ -0,0 +1,21 @@
+# Generated by Django 5.1.3 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_tagtimelinetrim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostChangeExpiry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('xid', models.BigIntegerField()),
+                ('change_id', models.BigIntegerField()),
+            ],
+        ),
+    ]
@@ -1,17 +1,161 @@
 import uuid
 
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
+
+"""
+The posts table is range partitioned on created_at, one partition per month (see migration 0008 and partitions.py).
+Its primary key in the db is (post_id, created_at), post_id is still unique (uuid4) and is the pk for Django.
+Queries that filter on created_at only read the partitions of that time, so the reads of recent posts stay fast
+no matter how many old posts there are.
+"""
 
 class Post(models.Model):
     post_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     media = models.JSONField(blank=True)
+    #the media data of the media ids (in the same order) and its MEDIA_SNAPSHOT_VERSION, see snapshots.py.
+    #null until the media data was fetched, then the read endpoints return it without requesting the media microservice
+    media_snapshot = models.JSONField(null=True, blank=True, editable=False)
+    media_snapshot_version = models.IntegerField(default=0, editable=False)
     caption = models.CharField(max_length=1000)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
     username = models.CharField(max_length=100)
     user_id = models.CharField(max_length=100)
-    tags = models.JSONField(blank=True, default=list)
+    tags = ArrayField(models.TextField(), blank=True, default=list)
+    #caption, tags and content for full-text search, set by a db trigger on every insert and update (see search.py)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            #tags__overlap lookups of the feed
+            GinIndex(fields=['tags'], name='posts_post_tags_gin'),
+            #full-text search
+            GinIndex(fields=['search_vector'], name='posts_post_search_gin'),
+            #posts that contain a media id (media__contains), for the refresh of changed media
+            GinIndex(fields=['media'], name='posts_post_media_gin', opclasses=['jsonb_path_ops']),
+            #keyset pagination of the feed and user posts, see pagination.py
+            models.Index(fields=['user_id', 'created_at', 'post_id'], name='posts_post_user_created_idx'),
+            models.Index(fields=['created_at', 'post_id'], name='posts_post_created_idx'),
+        ]
+
+    def __str__(self):
+        return str(self.post_id)
+
+"""
+An entry in the outbox is a delete request for another microservice, which is written in the same transaction
+that deletes a post. The entries are sent later by the drain_outbox command, with retries.
+"""
+
+class OutboxEntry(models.Model):
+    MEDIA = 'media'
+    INTERACTIONS = 'interactions'
+    KIND_CHOICES = [(MEDIA, 'media'), (INTERACTIONS, 'interactions')]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    target = models.CharField(max_length=100)
+    authorization = models.TextField(blank=True, default='')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_attempt_at', 'id'], name='posts_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind}:{self.target}'
+
+
+"""
+An entry of the materialized timeline of a tag: the newest posts of every tag are written here when they are created
+or tagged (fan-out on write), so a tag feed is a merge of a few short, sorted lists instead of a query over all posts.
+Each timeline is capped to TAG_TIMELINE_LENGTH entries, see timelines.py.
+"""
+
+class TagTimelineEntry(models.Model):
+    tag = models.TextField()
+    #no db constraint: posts_post is partitioned, a foreign key can not point to post_id alone (see migration 0008)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+', db_constraint=False)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['tag', 'post'], name='posts_timeline_tag_post_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'created_at', 'post'], name='posts_timeline_tag_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.tag}:{self.post_id}'
+
+
+"""
+The trim watermark of a tag timeline: the newest position (created_at, post_id) that trim_timeline has removed from it.
+Posts at or below it may be missing from the timeline, so pages that reach it are read from the posts table.
+"""
+
+class TagTimelineTrim(models.Model):
+    tag = models.TextField(primary_key=True)
+    created_at = models.DateTimeField()
+    post_id = models.UUIDField()
+
+    def __str__(self):
+        return f'{self.tag}:{self.created_at}'
+
+
+"""
+An entry of the change log of the posts: every create, update and delete of a post appends one entry in the same
+transaction, and /posts/changes/ returns the entries after a cursor, so consumers read only what changed instead
+of the whole feed. xid is the id of the writing transaction, the log is read in (xid, id) order up to the oldest
+running transaction (see changes.py). Old entries are compacted and expired by the compact_changes command.
+"""
+
+class PostChange(models.Model):
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    KIND_CHOICES = [(CREATED, 'created'), (UPDATED, 'updated'), (DELETED, 'deleted')]
+
+    id = models.BigAutoField(primary_key=True)
+    xid = models.BigIntegerField(editable=False, db_default=models.Func(
+        template='pg_current_xact_id()::text::bigint', output_field=models.BigIntegerField()))
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    #no foreign key, the entries of a post are kept after it is deleted
+    post_id = models.UUIDField()
+    user_id = models.CharField(max_length=100)
+    #the changed fields of an update, None if older changes were compacted into this entry (any field may have changed)
+    fields = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+
+    class Meta:
+        indexes = [
+            #the log in the order it is read, of all posts and of one user
+            models.Index(fields=['xid', 'id'], name='posts_change_position_idx'),
+            models.Index(fields=['user_id', 'xid', 'id'], name='posts_change_user_idx'),
+            #the entries of a post, for the compaction
+            models.Index(fields=['post_id', 'xid', 'id'], name='posts_change_post_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind}:{self.post_id}'
+
+
+"""
+The position (xid, change_id) of the newest change that expire_changes deleted from the change log, in the row with id 1.
+Changes at or before it may be gone, so a cursor before it gets status 410 (see changes.py).
+"""
+
+class PostChangeExpiry(models.Model):
+    xid = models.BigIntegerField()
+    change_id = models.BigIntegerField()
 
     def __str__(self):
-        return str(self.post_id)
\ No newline at end of file
+        return f'{self.xid}:{self.change_id}'
@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from posts.clients import interactions_service, media_service
+from posts.models import OutboxEntry
+
+#a delete request is done if the other microservice deleted the data or does not know it (anymore)
+DONE_STATUS_CODES = (200, 202, 204, 404)
+
+
+"""
+This function writes the delete requests for the media and the interactions of a post to the outbox.
+It has to be called in the transaction that deletes the post.
+"""
+
+def enqueue_post_delete(post, token):
+    entries = [OutboxEntry(kind=OutboxEntry.MEDIA, target=str(media_id)) for media_id in post.media]
+    entries.append(OutboxEntry(kind=OutboxEntry.INTERACTIONS, target=str(post.post_id), authorization=token or ''))
+
+    OutboxEntry.objects.bulk_create(entries)
+
+
+"""
+This function sends the delete request of one outbox entry to its microservice.
+None is returned if the request was successful, otherwise the error.
+"""
+
+def send_entry(entry):
+    try:
+        if entry.kind == OutboxEntry.MEDIA:
+            response = media_service.delete(f'/media/{entry.target}')
+        else:
+            response = interactions_service.delete(f'/internal/post/{entry.target}',
+                                                   headers={'Authorization': entry.authorization})
+    except requests.RequestException as e:
+        return str(e)
+
+    if response.status_code not in DONE_STATUS_CODES:
+        return f'status code {response.status_code}'
+
+    return None
+
+
+"""
+This function claims a batch of due outbox entries: they are locked with SKIP LOCKED, so several workers can drain
+the outbox in parallel, and their next_attempt_at is moved OUTBOX_LEASE_SECONDS ahead (the lease) before the short
+transaction commits. Other workers skip them until then; the entries of a worker that died are sent again after it.
+"""
+
+def claim_entries(batch_size):
+    with transaction.atomic():
+        entries = list(
+            OutboxEntry.objects.select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=timezone.now(), attempts__lt=settings.OUTBOX_MAX_ATTEMPTS)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        OutboxEntry.objects.filter(id__in=[entry.id for entry in entries]).update(
+            next_attempt_at=timezone.now() + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS)
+        )
+
+    return entries
+
+
+"""
+This function sends one batch of due outbox entries (see claim_entries), at most OUTBOX_CONCURRENCY at the same time.
+The requests are sent outside of a transaction: a transaction that stays open while they wait would hold back the
+change log (it is read up to the oldest running transaction, see changes.py).
+Sent entries are removed, failed entries are retried later with exponential backoff
+until they have been tried OUTBOX_MAX_ATTEMPTS times.
+The number of sent and failed entries is returned.
+"""
+
+def drain_batch(batch_size=None):
+    entries = claim_entries(batch_size or settings.OUTBOX_BATCH_SIZE)
+    if not entries:
+        return 0, 0
+
+    with ThreadPoolExecutor(max_workers=min(settings.OUTBOX_CONCURRENCY, len(entries))) as executor:
+        errors = list(executor.map(send_entry, entries))
+
+    sent = [entry.id for entry, error in zip(entries, errors) if error is None]
+    failed = [entry for entry, error in zip(entries, errors) if error is not None]
+    for entry, error in zip(entries, errors):
+        if error is None:
+            continue
+
+        entry.attempts += 1
+        entry.last_error = error
+        delay = min(settings.OUTBOX_RETRY_BACKOFF * 2 ** (entry.attempts - 1), settings.OUTBOX_MAX_BACKOFF)
+        entry.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+
+    with transaction.atomic():
+        OutboxEntry.objects.filter(id__in=sent).delete()
+        OutboxEntry.objects.bulk_update(failed, ['attempts', 'last_error', 'next_attempt_at'])
+
+    return len(sent), len(failed)
@@ -0,0 +1,104 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+
+
+"""
+This function builds the opaque cursor for a post row, which points to the position (created_at, post_id) of the post.
+"""
+
+def encode_cursor(post):
+    position = [post['created_at'].isoformat(), str(post['post_id'])]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+"""
+This function reads the position (created_at, post_id) from a cursor made by encode_cursor.
+A ValueError is raised if the cursor is not valid.
+"""
+
+def decode_cursor(cursor):
+    try:
+        created_at, post_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), uuid.UUID(post_id)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("invalid cursor")
+
+
+"""
+This function reads the limit query parameter.
+If no limit is given POSTS_PAGE_SIZE is used, a ValueError is raised if the limit is not between 1 and POSTS_MAX_PAGE_SIZE.
+"""
+
+def parse_limit(limit):
+    if limit is None:
+        return settings.POSTS_PAGE_SIZE
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError("invalid limit")
+
+    if limit < 1 or limit > settings.POSTS_MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {settings.POSTS_MAX_PAGE_SIZE}")
+
+    return limit
+
+
+"""
+This function orders the queryset newest posts first and starts it after the position of the cursor
+(keyset pagination on created_at and post_id), so every page costs the same as the first one, no matter how deep it is.
+A ValueError is raised if the cursor is not valid.
+"""
+
+def position_queryset(queryset, cursor):
+    queryset = queryset.order_by('-created_at', '-post_id')
+
+    if cursor:
+        created_at, post_id = decode_cursor(cursor)
+        queryset = queryset.filter(created_at__lte=created_at).exclude(created_at=created_at, post_id__gte=post_id)
+
+    return queryset
+
+
+"""
+This function builds the query for one page of posts from the queryset, see position_queryset.
+One post more than the limit is selected to find out if there is a next page.
+"""
+
+def page_queryset(queryset, cursor, limit):
+    return position_queryset(queryset, cursor)[:limit + 1]
+
+
+"""
+This function cuts the selected posts to the limit and builds the cursor of the next page (None on the last page).
+"""
+
+def finish_page(posts, limit):
+    if len(posts) > limit:
+        posts = posts[:limit]
+        return posts, encode_cursor(posts[-1])
+
+    return posts, None
+
+
+"""
+This function returns one page of posts from the queryset, see page_queryset.
+A list of posts and the cursor of the next page (None on the last page) is returned.
+"""
+
+def paginate(queryset, cursor=None, limit=None):
+    limit = parse_limit(limit)
+    return finish_page(list(page_queryset(queryset, cursor, limit)), limit)
+
+
+"""
+This function is the async version of paginate, for the async views.
+"""
+
+async def apaginate(queryset, cursor=None, limit=None):
+    limit = parse_limit(limit)
+    return finish_page([post async for post in page_queryset(queryset, cursor, limit)], limit)
@@ -0,0 +1,139 @@
+import re
+from datetime import datetime, timezone
+
+from django.db import connection, transaction
+
+from posts.models import TagTimelineEntry
+
+#posts_post is range partitioned on created_at with one partition per month (see migration 0008), posts without
+#a partition of their month go to the default partition (see migration 0010)
+PARENT_TABLE = 'posts_post'
+DEFAULT_PARTITION = f'{PARENT_TABLE}_default'
+PARTITION_BOUNDS = re.compile(r"FROM \((.+)\) TO \((.+)\)")
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return value.replace(year=value.year + month // 12, month=month % 12 + 1)
+
+
+def partition_name(start):
+    return f'{PARENT_TABLE}_p{start:%Y_%m}'
+
+
+def parse_bound(bound):
+    if bound == 'MINVALUE':
+        return None
+    return datetime.fromisoformat(bound.strip("'")).astimezone(timezone.utc)
+
+
+"""
+This function returns the partitions of the posts table as (name, start, end) sorted by start,
+start is None for the partition of the posts from before the table was partitioned (FROM MINVALUE).
+The default partition has no range, it is not returned.
+"""
+
+def partitions():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+                             JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+            """,
+            [PARENT_TABLE]
+        )
+        rows = cursor.fetchall()
+
+    result = []
+    for name, bound in rows:
+        if bound == 'DEFAULT':
+            continue
+        start, end = PARTITION_BOUNDS.search(bound).groups()
+        result.append((name, parse_bound(start), parse_bound(end)))
+
+    return sorted(result, key=lambda partition: partition[1] or datetime.min.replace(tzinfo=timezone.utc))
+
+
+def has_default_partition():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT partdefid <> 0 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [PARENT_TABLE])
+        row = cursor.fetchone()
+
+    return bool(row and row[0])
+
+
+"""
+This function creates the monthly partitions from the end of the newest partition until (and including) the month of
+"until". The names of the new partitions are returned.
+Posts of a month without a partition are written to the default partition (so inserts do not fail if this was not run
+in time). They are moved into the partition of their month when it is created: the default partition is locked for
+writes, its posts of that month are deleted, the partition is created and they are inserted again, in one transaction.
+Usually the default partition is empty, and creating a partition only takes a short lock.
+"""
+
+def create_partitions(until):
+    existing = partitions()
+    start = existing[-1][2] if existing else month_start(until)
+    created = []
+
+    while start <= until:
+        end = add_months(start, 1)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {DEFAULT_PARTITION} IN EXCLUSIVE MODE')
+            cursor.execute(f'CREATE TEMPORARY TABLE moved_posts (LIKE {PARENT_TABLE})')
+            cursor.execute(
+                f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE created_at >= %s AND created_at < %s RETURNING *) '
+                f'INSERT INTO moved_posts SELECT * FROM moved',
+                [start, end]
+            )
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF {PARENT_TABLE} '
+                f'FOR VALUES FROM (%s) TO (%s)',
+                [start, end]
+            )
+            cursor.execute(f'INSERT INTO {PARENT_TABLE} SELECT * FROM moved_posts')
+            cursor.execute('DROP TABLE moved_posts')
+        created.append(partition_name(start))
+        start = end
+
+    return created
+
+
+"""
+This function detaches the partitions whose posts are all older than "before" and moves them to the schema
+"archive_schema" (or drops them if it is None). The posts of a detached partition are not read anymore and their
+entries in the tag timelines are deleted. Outside of a transaction the partitions are detached CONCURRENTLY, so reads
+and writes of the other partitions are not blocked; postgres can not do that while the table has a default partition
+(see migration 0010), then a plain DETACH is used, which locks the posts table only for the catalog change.
+The names of the detached partitions are returned.
+"""
+
+def detach_partitions(before, archive_schema=None):
+    detached = []
+    concurrently = ' CONCURRENTLY' if connection.get_autocommit() and not has_default_partition() else ''
+
+    for name, start, end in partitions():
+        if end > before:
+            continue
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE {PARENT_TABLE} DETACH PARTITION {name}{concurrently}')
+
+            with transaction.atomic():
+                if archive_schema:
+                    cursor.execute(f'CREATE SCHEMA IF NOT EXISTS {archive_schema}')
+                    cursor.execute(f'ALTER TABLE {name} SET SCHEMA {archive_schema}')
+                else:
+                    cursor.execute(f'DROP TABLE {name}')
+
+                TagTimelineEntry.objects.filter(created_at__lt=end).delete()
+
+        detached.append(name)
+
+    return detached
@@ -0,0 +1,161 @@
+import heapq
+import json
+import math
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from posts.clients import interactions_service
+from posts.models import Post
+from posts.serialization import ROW_FIELDS
+
+#the columns of a candidate post that the scorers can use
+CANDIDATE_FIELDS = ('post_id', 'created_at', 'tags', 'user_id')
+
+
+"""
+A scorer gives every candidate post of a ranked feed a score between 0 and 1, the feed is ranked by the
+weighted sum of the scores of all scorers in FEED_SCORERS. prepare is called once per feed with all candidates,
+so a scorer can load what it needs in batch (like the interaction counts), score is then called for every candidate.
+"""
+
+class Scorer:
+    def __init__(self, tags):
+        self.tags = set(tags)
+
+    def prepare(self, candidates):
+        pass
+
+    def score(self, candidate):
+        raise NotImplementedError
+
+
+"""
+This scorer prefers new posts: the score halves every FEED_RECENCY_HALF_LIFE hours.
+"""
+
+class RecencyScorer(Scorer):
+    def prepare(self, candidates):
+        self.now = timezone.now()
+        self.half_life = settings.FEED_RECENCY_HALF_LIFE * 3600
+
+    def score(self, candidate):
+        age = max((self.now - candidate['created_at']).total_seconds(), 0)
+        return 0.5 ** (age / self.half_life)
+
+
+"""
+This scorer prefers posts that have more of the requested tags.
+"""
+
+class TagOverlapScorer(Scorer):
+    def score(self, candidate):
+        if not self.tags:
+            return 0.0
+        return len(self.tags.intersection(candidate['tags'])) / len(self.tags)
+
+
+"""
+This scorer prefers posts with many likes and comments. The counts of all candidates are requested from the
+interactions microservice at once, if that fails the scorer gives every post 0 and the feed is still returned.
+"""
+
+class InteractionScorer(Scorer):
+    def prepare(self, candidates):
+        self.counts = {}
+
+        try:
+            response = interactions_service.get(
+                '/internal/posts/counts',
+                data=json.dumps([str(candidate['post_id']) for candidate in candidates]),
+                headers={'Content-Type': 'application/json'},
+                timeout=settings.FEED_INTERACTIONS_TIMEOUT
+            )
+            if response.status_code == 200:
+                self.counts = {post_id: sum(counts.values()) for post_id, counts in response.json().items()}
+        except (requests.RequestException, ValueError, AttributeError):
+            pass
+
+        #the counts are scaled logarithmically to the most popular candidate
+        self.max_count = max(self.counts.values(), default=0)
+
+    def score(self, candidate):
+        if not self.max_count:
+            return 0.0
+        return math.log1p(self.counts.get(str(candidate['post_id']), 0)) / math.log1p(self.max_count)
+
+
+"""
+This function selects the candidates of a ranked feed with a bounded query: the newest FEED_CANDIDATES posts,
+or the newest FEED_CANDIDATES posts with one of the tags. Both use an index and never read the whole table.
+"""
+
+def candidates(tags):
+    posts = Post.objects.filter(tags__overlap=tags) if tags else Post.objects.all()
+    return list(posts.order_by('-created_at', '-post_id').values(*CANDIDATE_FIELDS)[:settings.FEED_CANDIDATES])
+
+
+"""
+This function scores the candidates with every scorer of FEED_SCORERS (a list of (dotted path, weight)),
+it returns (score, candidate) pairs.
+"""
+
+def score_candidates(posts, tags):
+    scorers = [(import_string(path)(tags), weight) for path, weight in settings.FEED_SCORERS if weight]
+    for scorer, _ in scorers:
+        scorer.prepare(posts)
+
+    return [(sum(weight * scorer.score(post) for scorer, weight in scorers), post) for post in posts]
+
+
+#the order of the ranked feed: best score first, ties go to the newer post
+def rank_key(item):
+    return item[0], item[1]['created_at'], item[1]['post_id']
+
+
+"""
+This function selects the best "limit" candidates with a heap, which costs O(n log limit) instead of
+sorting all candidates. The candidates are returned best first as (score, candidate) pairs.
+"""
+
+def top_candidates(posts, tags, limit):
+    return heapq.nlargest(limit, score_candidates(posts, tags), key=rank_key)
+
+
+"""
+This function loads the selected candidates (see top_candidates) completely, as post rows with their "score".
+"""
+
+def ranked_rows(best):
+    #only the selected posts are loaded completely, from the partitions of their created_at range
+    posts = Post.objects.filter(post_id__in=[post['post_id'] for _, post in best])
+    if best:
+        created_at = [post['created_at'] for _, post in best]
+        posts = posts.filter(created_at__range=(min(created_at), max(created_at)))
+    rows = {post['post_id']: post for post in posts.values(*ROW_FIELDS)}
+
+    return [{**rows[post['post_id']], "score": round(score, 6)} for score, post in best if post['post_id'] in rows]
+
+
+"""
+This function returns the ranked feed: the best "limit" posts of the candidates (see candidates and top_candidates),
+as post rows with their "score".
+"""
+
+def ranked_feed(tags, limit):
+    return ranked_rows(top_candidates(candidates(tags), tags, limit))
+
+
+"""
+This function is the async version of ranked_feed, for the async views. Only the queries run in the thread of the
+ORM; the candidates are scored in a worker thread, so a slow scorer (the request of InteractionScorer) does not
+block the queries of the other requests. Scorers must therefore not use the database in prepare or score.
+"""
+
+async def aranked_feed(tags, limit):
+    posts = await sync_to_async(candidates)(tags)
+    best = await sync_to_async(top_candidates, thread_sensitive=False)(posts, tags, limit)
+    return await sync_to_async(ranked_rows)(best)
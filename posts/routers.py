@@ -0,0 +1,190 @@
+import contextvars
+import hashlib
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+
+from posts.metrics import Gauge
+
+REPLICA_HEALTHY = Gauge('posts_db_replica_healthy', "1 if the read replica is used, 0 if it is down or lags behind.",
+                        ('database',))
+
+#the replica that the reads of the current request go to, None reads from the primary
+current_replica = contextvars.ContextVar('current_replica', default=None)
+
+STICKY_COOKIE = 'posts_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+#the state of every replica: alias -> (checked at, healthy)
+replica_health = {}
+health_lock = threading.Lock()
+
+
+"""
+This router sends the reads of GET requests to the replica chosen by ReplicaMiddleware.
+Writes, and all reads of other requests, management commands and the outbox worker go to the primary (default).
+"""
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return current_replica.get()
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        #the replicas get the schema from the primary
+        return db not in settings.DATABASE_REPLICAS
+
+
+"""
+This function checks if a replica can be reached and how far it lags behind the primary.
+A replica that is up to date with the WAL it received has no lag, even if the primary had no writes for a while.
+"""
+
+def check_replica(alias):
+    try:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                            ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END
+                """
+            )
+            lag = cursor.fetchone()[0]
+    except DatabaseError:
+        return False
+
+    #a db that is not a replica (local testing with two databases) has no lag
+    return lag is None or lag <= settings.REPLICA_MAX_LAG
+
+
+"""
+This function starts a check of the replicas that were not checked in the last REPLICA_CHECK_INTERVAL seconds.
+The check runs in a background thread, so no request waits for a replica that is down;
+until its first check is done a replica is not used.
+"""
+
+def start_replica_checks():
+    now = time.monotonic()
+
+    with health_lock:
+        due = [alias for alias in settings.DATABASE_REPLICAS
+               if now - replica_health.get(alias, (float('-inf'), False))[0] >= settings.REPLICA_CHECK_INTERVAL]
+
+        #the replicas are marked as checked right away, so they are only checked by one thread
+        for alias in due:
+            replica_health[alias] = (now, replica_health.get(alias, (0, False))[1])
+
+    if due:
+        threading.Thread(target=check_replicas, args=(due,), name='replica-check', daemon=True).start()
+
+
+def check_replicas(aliases):
+    for alias in aliases:
+        try:
+            healthy = check_replica(alias)
+        finally:
+            connections[alias].close()
+
+        with health_lock:
+            replica_health[alias] = (time.monotonic(), healthy)
+        REPLICA_HEALTHY.set(int(healthy), database=alias)
+
+
+def choose_replica():
+    healthy = [alias for alias in settings.DATABASE_REPLICAS if replica_health.get(alias, (0, False))[1]]
+    return random.choice(healthy) if healthy else None
+
+
+def sticky_key(request):
+    return 'primary-sticky:' + hashlib.sha256(request.headers['Authorization'].encode()).hexdigest()
+
+
+"""
+This middleware chooses the db of the reads of a request. GET requests read from a healthy replica, unless the client
+wrote something in the last REPLICA_STICKY_SECONDS (read-your-writes): after a successful write the client is marked
+in the cache (by its Authorization header) and with a cookie, and reads from the primary until the mark expires.
+Every replica is checked in the background every REPLICA_CHECK_INTERVAL seconds, if no replica is healthy the primary
+is used.
+"""
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        replica = None
+        if request.method in SAFE_METHODS and not self.cookie_sticky(request):
+            if not ('Authorization' in request.headers and cache.get(sticky_key(request))):
+                start_replica_checks()
+                replica = choose_replica()
+
+        token = current_replica.set(replica)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_replica.reset(token)
+
+        if self.wrote(request, response):
+            if 'Authorization' in request.headers:
+                cache.set(sticky_key(request), True, settings.REPLICA_STICKY_SECONDS)
+            self.set_sticky_cookie(response)
+
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+
+        replica = None
+        if request.method in SAFE_METHODS and not self.cookie_sticky(request):
+            if not ('Authorization' in request.headers and await cache.aget(sticky_key(request))):
+                start_replica_checks()
+                replica = choose_replica()
+
+        token = current_replica.set(replica)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_replica.reset(token)
+
+        if self.wrote(request, response):
+            if 'Authorization' in request.headers:
+                await cache.aset(sticky_key(request), True, settings.REPLICA_STICKY_SECONDS)
+            self.set_sticky_cookie(response)
+
+        return response
+
+    def wrote(self, request, response):
+        return request.method not in SAFE_METHODS and response.status_code < 400
+
+    def cookie_sticky(self, request):
+        try:
+            return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def set_sticky_cookie(self, response):
+        response.set_cookie(STICKY_COOKIE, str(time.time() + settings.REPLICA_STICKY_SECONDS),
+                            max_age=int(settings.REPLICA_STICKY_SECONDS) + 1, httponly=True, samesite='Lax')
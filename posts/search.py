@@ -0,0 +1,79 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, FloatField, Q
+from django.db.models.functions import Cast
+
+from posts.models import Post
+from posts.pagination import parse_limit
+from posts.serialization import ROW_FIELDS
+
+#the text search configuration of the search_vector trigger (migration 0006), queries have to use the same one
+SEARCH_CONFIG = 'english'
+
+
+"""
+This function builds the cursor of a search result, which points to its position (rank, created_at, post_id).
+"""
+
+def encode_search_cursor(post):
+    position = [post['rank'], post['created_at'].isoformat(), str(post['post_id'])]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+"""
+This function reads the position from a cursor made by encode_search_cursor.
+A ValueError is raised if the cursor is not valid.
+"""
+
+def decode_search_cursor(cursor):
+    try:
+        rank, created_at, post_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return float(rank), datetime.fromisoformat(created_at), uuid.UUID(post_id)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("invalid cursor")
+
+
+"""
+This function builds the query for one page of search results for the search text q (websearch syntax:
+words, "quoted phrases", OR and -excluded words). The posts are matched with the GIN index on search_vector
+and ranked with ts_rank, matches in the caption weigh more than in the tags and in the content.
+Posts with the same rank are sorted newest first, and pages follow each other by keyset on (rank, created_at, post_id).
+"""
+
+def search_queryset(q, cursor, limit):
+    query = SearchQuery(q, search_type='websearch', config=SEARCH_CONFIG)
+    posts = (Post.objects.filter(search_vector=query)
+             #ts_rank is a float4, as float8 the rank of the cursor compares equal to the rank of its post
+             .annotate(rank=Cast(SearchRank(F('search_vector'), query), FloatField()))
+             .values(*ROW_FIELDS, 'rank')
+             .order_by('-rank', '-created_at', '-post_id'))
+
+    if cursor:
+        rank, created_at, post_id = decode_search_cursor(cursor)
+        posts = posts.filter(
+            Q(rank__lt=rank) |
+            Q(rank=rank, created_at__lt=created_at) |
+            Q(rank=rank, created_at=created_at, post_id__lt=post_id)
+        )
+
+    return posts[:limit + 1]
+
+
+"""
+This function returns one page of search results, ranked best first.
+A list of post rows (with their rank) and the cursor of the next page (None on the last page) is returned.
+"""
+
+async def asearch(q, cursor=None, limit=None):
+    limit = parse_limit(limit)
+    posts = [post async for post in search_queryset(q, cursor, limit)]
+
+    if len(posts) > limit:
+        posts = posts[:limit]
+        return posts, encode_search_cursor(posts[-1])
+
+    return posts, None
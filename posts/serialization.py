@@ -0,0 +1,52 @@
+import orjson
+from django.http import HttpResponse
+
+#the columns of a post that are returned by the read endpoints, in the order of the response
+POST_FIELDS = ('post_id', 'caption', 'content', 'username', 'user_id', 'created_at', 'updated_at', 'media')
+
+#the columns of a post row that the read endpoints load: the response columns and the media snapshot (see snapshots.py)
+ROW_FIELDS = POST_FIELDS + ('media_snapshot', 'media_snapshot_version')
+
+
+"""
+This function formats a datetime exactly like DjangoJSONEncoder (the encoder of JsonResponse):
+ISO 8601 with milliseconds and "Z" for UTC.
+"""
+
+def format_datetime(value):
+    formatted = value.isoformat()
+
+    if value.microsecond:
+        formatted = formatted[:23] + formatted[26:]
+    if formatted.endswith('+00:00'):
+        formatted = formatted[:-6] + 'Z'
+
+    return formatted
+
+
+"""
+This function builds the post data to be returned as a get response from a post row (a dict of ROW_FIELDS,
+as returned by .values(*ROW_FIELDS)) and the media data from media_map (see get_media_map).
+"""
+
+def post_data(row, media_map):
+    data = dict(row)
+    data.pop('media_snapshot', None)
+    data.pop('media_snapshot_version', None)
+    data['created_at'] = format_datetime(row['created_at'])
+    data['updated_at'] = format_datetime(row['updated_at'])
+    data['media'] = media_map.get(row['post_id'], [])
+
+    return data
+
+
+"""
+This response encodes its data with orjson, which is much faster than JsonResponse with DjangoJSONEncoder
+for long lists of posts. UUIDs are encoded as strings like before; datetimes have to be formatted with
+format_datetime first (see post_data), so the values are the same as with JsonResponse.
+"""
+
+class FastJsonResponse(HttpResponse):
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=orjson.dumps(data), **kwargs)
@@ -0,0 +1,97 @@
+import asyncio
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from posts.metrics import Counter
+
+SINGLEFLIGHT_CALLS = Counter('posts_singleflight_calls_total',
+                             "Reads by how they got their result: leader (computed it), coalesced (waited for the "
+                             "leader in this process) or shared (waited for the leader in another process).",
+                             ('group', 'result'))
+
+#marks a missing result in the shared cache (None is a valid result)
+MISSING = object()
+
+
+"""
+Single-flight (request coalescing): concurrent identical reads of one worker process wait for the first of them
+(the leader) and share its result, so a hot post or feed is read and hydrated once instead of once per request.
+The computation runs in its own task, so it is finished for the other reads even if the request of the leader is
+cancelled (the client went away); an exception is raised to all of them. The results are shared, they must not be
+changed by the callers.
+
+With SINGLEFLIGHT_SHARED the leaders of all worker processes coordinate through a lock in the shared cache
+(this needs REDIS_URL): one computes the result and stores it in the cache for SINGLEFLIGHT_RESULT_TTL seconds,
+the others poll for it. If the result does not come in SINGLEFLIGHT_LOCK_TIMEOUT seconds they compute it themselves,
+without the lock.
+"""
+
+class SingleFlight:
+    def __init__(self, group):
+        self.group = group
+        self.calls = {}
+
+    async def do(self, key, function):
+        if not settings.SINGLEFLIGHT:
+            return await function()
+
+        task = self.calls.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            SINGLEFLIGHT_CALLS.inc(group=self.group, result='coalesced')
+            return await asyncio.shield(task)
+
+        task = asyncio.ensure_future(self.lead(key, function))
+        self.calls[key] = task
+
+        def done(task):
+            if self.calls.get(key) is task:
+                del self.calls[key]
+            #the exception is raised to the reads that still wait, this marks it as retrieved if none does
+            if not task.cancelled():
+                task.exception()
+
+        task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    async def lead(self, key, function):
+        if not settings.SINGLEFLIGHT_SHARED:
+            SINGLEFLIGHT_CALLS.inc(group=self.group, result='leader')
+            return await function()
+
+        lock_key, result_key = f'singleflight-lock:{self.group}:{key}', result_cache_key(self.group, key)
+
+        #the lock holds a token of this call, so only the call that took the lock releases it
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + settings.SINGLEFLIGHT_LOCK_TIMEOUT
+        while not await cache.aadd(lock_key, token, settings.SINGLEFLIGHT_LOCK_TIMEOUT):
+            result = await cache.aget(result_key, MISSING)
+            if result is not MISSING:
+                SINGLEFLIGHT_CALLS.inc(group=self.group, result='shared')
+                return result
+
+            if time.monotonic() >= deadline:
+                break
+            await asyncio.sleep(settings.SINGLEFLIGHT_POLL_INTERVAL)
+
+        SINGLEFLIGHT_CALLS.inc(group=self.group, result='leader')
+        try:
+            result = await function()
+            await cache.aset(result_key, result, settings.SINGLEFLIGHT_RESULT_TTL)
+            return result
+        finally:
+            #after a lock timeout the lock is another leader's (or expired and taken again), it is left alone
+            if await cache.aget(lock_key) == token:
+                await cache.adelete(lock_key)
+
+
+def result_cache_key(group, key):
+    return f'singleflight-result:{group}:{key}'
+
+
+#the hot reads of the read endpoints: post rows, feed pages and the media of a post or page
+post_flight = SingleFlight('post')
+feed_flight = SingleFlight('feed')
+media_flight = SingleFlight('media')
@@ -0,0 +1,111 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from posts.caching import invalidate_posts
+from posts.media import fetch_media, post_media
+from posts.changes import record_changes
+from posts.models import Post, PostChange
+
+
+"""
+This function stores the media data of the given posts with the posts (media snapshot), with one media request
+for all posts (see post_media). The posts are not saved. A post whose media could not be fetched keeps the snapshot
+it has (a new post has none, its media is then requested when it is read, until it is backfilled).
+The posts whose media could not be fetched are returned.
+"""
+
+def take_snapshots(posts):
+    media_ids = list({str(media_id): media_id for post in posts for media_id in post.media}.values())
+    media, failed = fetch_media(media_ids) if media_ids else ([], set())
+    not_fetched = []
+
+    for post in posts:
+        snapshot = post_media(post.media, media, failed)
+        if snapshot is None:
+            not_fetched.append(post)
+            continue
+
+        post.media_snapshot = snapshot
+        post.media_snapshot_version = settings.MEDIA_SNAPSHOT_VERSION
+
+    return not_fetched
+
+
+"""
+This function fetches the media snapshots of existing posts again and saves them. A post whose snapshot changed
+gets a new updated_at (so the ETags of the read endpoints change too) and an update in the change log;
+the posts are removed from the cache. Posts whose media could not be fetched keep their old snapshot and are not saved.
+The number of these posts is returned.
+"""
+
+def refresh_snapshots(posts):
+    old = {post.post_id: post.media_snapshot for post in posts}
+    not_fetched = {post.post_id for post in take_snapshots(posts)}
+    fetched = [post for post in posts if post.post_id not in not_fetched]
+
+    now = timezone.now()
+    changed = [post for post in fetched if old[post.post_id] is not None and post.media_snapshot != old[post.post_id]]
+    for post in changed:
+        post.updated_at = now
+
+    #updated_at is only written for the changed posts: the others keep the updated_at of a concurrent update
+    with transaction.atomic():
+        Post.objects.bulk_update(fetched, ['media_snapshot', 'media_snapshot_version'])
+        Post.objects.bulk_update(changed, ['updated_at'])
+        record_changes(PostChange.UPDATED, changed, ['media'])
+    invalidate_posts([post.post_id for post in fetched])
+
+    return len(not_fetched)
+
+
+"""
+This function returns the posts that need a (new) snapshot: posts without one or with an older MEDIA_SNAPSHOT_VERSION,
+or, if media_ids are given, all posts with one of these media. jsonb containment compares the types too, so a media_id
+is looked up as the number and as the string it can be stored as.
+"""
+
+def outdated_posts(media_ids=None):
+    if media_ids:
+        query = Q()
+        for media_id in media_ids:
+            for form in media_id_forms(media_id):
+                query |= Q(media__contains=[form])
+        return Post.objects.filter(query)
+
+    return Post.objects.filter(Q(media_snapshot__isnull=True) | ~Q(media_snapshot_version=settings.MEDIA_SNAPSHOT_VERSION))
+
+
+#the forms a media_id can be stored as in the media of a post: the string, and the number if it is one
+def media_id_forms(media_id):
+    forms = [str(media_id)]
+    if not isinstance(media_id, bool) and str(media_id).lstrip('-').isdigit():
+        forms.append(int(media_id))
+    return forms
+
+
+"""
+This function refreshes the snapshots of the posts of outdated_posts in batches of batch_size posts (in post_id order),
+each batch with at most one media request and one update, so it can run on a live table.
+It returns the number of refreshed posts and of posts whose media could not be fetched.
+"""
+
+def backfill_snapshots(media_ids=None, batch_size=500):
+    posts = outdated_posts(media_ids)
+    refreshed = failed = 0
+    last = None
+
+    while True:
+        batch = posts.order_by('post_id')
+        if last is not None:
+            batch = batch.filter(post_id__gt=last)
+        batch = list(batch.only('post_id', 'user_id', 'media', 'media_snapshot', 'media_snapshot_version', 'updated_at')[:batch_size])
+        if not batch:
+            break
+
+        failed += refresh_snapshots(batch)
+        refreshed += len(batch)
+        last = batch[-1].post_id
+
+    return refreshed, failed
@@ -0,0 +1,142 @@
+import zlib
+
+import orjson
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+from posts.caching import aget_media_map
+from posts.pagination import decode_cursor, encode_cursor, position_queryset
+from posts.serialization import ROW_FIELDS, post_data
+from posts.timing import timed
+
+#the formats of a streamed list of posts: a JSON {"posts": [...]} or one JSON post per line
+STREAM_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+"""
+This function reads the limit query parameter of a streamed list. Unlike a page (see parse_limit) a stream has no
+maximum, without a limit all posts are streamed. A ValueError is raised if the limit is not a positive number.
+"""
+
+def parse_stream_limit(limit):
+    if limit is None:
+        return None
+
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError("invalid limit")
+
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+
+    return limit
+
+
+"""
+This function reads the posts of the queryset (newest first, after the cursor, at most limit posts) in chunks of
+POSTS_STREAM_CHUNK_SIZE rows and hydrates the media of each chunk at once. The post data of every chunk is yielded
+as a list, so only one chunk is kept in memory at a time.
+Every chunk is a keyset query that starts after the last post of the previous chunk (like the pages, see pagination.py),
+a server-side cursor (.iterator()) is not used: outside of a transaction postgres materializes the whole result of
+such a cursor before the first row is returned, so the first byte would wait for the last post.
+"""
+
+async def post_chunks(queryset, cursor, limit):
+    remaining = limit
+
+    while remaining is None or remaining > 0:
+        size = settings.POSTS_STREAM_CHUNK_SIZE if remaining is None else min(remaining, settings.POSTS_STREAM_CHUNK_SIZE)
+        chunk = [row async for row in position_queryset(queryset, cursor)[:size]]
+        if not chunk:
+            break
+
+        yield await hydrate_chunk(chunk)
+
+        if len(chunk) < size:
+            break
+        cursor = encode_cursor(chunk[-1])
+        if remaining is not None:
+            remaining -= len(chunk)
+
+
+async def hydrate_chunk(chunk):
+    media_map = await aget_media_map(chunk)
+
+    with timed('serialize'):
+        return [post_data(row, media_map) for row in chunk]
+
+
+"""
+These functions encode the chunks of posts as they come. The JSON format is the same {"posts": [...]} as a page,
+without next_cursor; its opening bracket is sent with the first chunk, so the first bytes contain posts.
+"""
+
+async def encode_json(chunks):
+    started = False
+
+    async for posts in chunks:
+        yield (b',' if started else b'{"posts":[') + b','.join(orjson.dumps(post) for post in posts)
+        started = True
+
+    yield b']}' if started else b'{"posts":[]}'
+
+
+async def encode_ndjson(chunks):
+    async for posts in chunks:
+        yield b''.join(orjson.dumps(post) + b'\n' for post in posts)
+
+
+"""
+This function gzips a stream. Every part is flushed (Z_SYNC_FLUSH), so the client can decode each chunk of posts
+as soon as it arrives instead of waiting for the compressor to fill its buffer.
+"""
+
+async def gzip_stream(parts):
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+
+    async for part in parts:
+        yield compressor.compress(part) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    yield compressor.flush()
+
+
+"""
+This function streams all posts of the queryset (newest first, after the "cursor" and at most "limit" posts)
+in the format of the query parameter "stream" (json or ndjson), gzipped if the client accepts gzip.
+The memory of a request stays the same no matter how many posts are streamed, and the first posts are sent
+before the last ones are read. Conditional requests are not supported, the validators are only known at the end.
+A ValueError is raised if the format, the cursor or the limit is not valid.
+"""
+
+def stream_posts(request, queryset, status=200):
+    content_type = STREAM_FORMATS.get(request.GET.get('stream'))
+    if content_type is None:
+        raise ValueError(f"stream must be one of {', '.join(STREAM_FORMATS)}")
+
+    limit = parse_stream_limit(request.GET.get('limit'))
+    cursor = request.GET.get('cursor')
+    if cursor:
+        decode_cursor(cursor)
+
+    #the stream is read after the view returned, so the db of the request (primary or replica) is chosen now
+    queryset = queryset.values(*ROW_FIELDS)
+    queryset = queryset.using(queryset.db)
+
+    encode = encode_ndjson if request.GET['stream'] == 'ndjson' else encode_json
+    content = encode(post_chunks(queryset, cursor, limit))
+
+    gzipped = 'gzip' in request.headers.get('Accept-Encoding', '')
+    if gzipped:
+        content = gzip_stream(content)
+
+    response = StreamingHttpResponse(content, content_type=content_type, status=status)
+    if gzipped:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+
+    return response
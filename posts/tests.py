@@ -1,13 +1,42 @@
+import asyncio
+import gzip
 import json
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
 
-from django.test import TestCase, Client, RequestFactory
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
+from django.utils import timezone
 from unittest.mock import patch, Mock
-from posts.models import Post
+import requests
+from asgiref.sync import sync_to_async
+from bench.stub_services import make_server
+from posts.caching import media_key, stale_media_key
+from posts.changes import expire_changes, heads, latest_position, read_changes, record_changes
+from posts.clients import ServiceClient, media_service
+from posts.media import media_breaker
+from posts.models import OutboxEntry, Post, PostChange, TagTimelineEntry, TagTimelineTrim
+from posts.outbox import claim_entries, drain_batch
+from posts.partitions import add_months, detach_partitions, month_start, partition_name, partitions
+from posts.routers import ReplicaMiddleware, ReplicaRouter, replica_health
+from posts.singleflight import SINGLEFLIGHT_CALLS, SingleFlight, result_cache_key
+from posts.snapshots import refresh_snapshots
 
 
 class TestViews(TestCase):
     def setUp(self):
+        cache.clear()
+        media_breaker.reset()
         self.client = Client()
         self.post = Post.objects.create(
             caption="Test Caption",
@@ -90,14 +119,14 @@ class TestViews(TestCase):
         self.assertEqual(response.status_code, 404)
 
 
-    @patch('posts.views.requests.delete')
+    @patch('posts.clients.ServiceClient.delete')
     @patch('posts.views.get_object_or_404')
-    def test_delete_post_success(self, mock_get_object, mock_requests_delete):
+    def test_delete_post_success(self, mock_get_object, mock_service_delete):
         mock_get_object.return_value = self.post
 
         mock_media_response = Mock()
         mock_media_response.status_code = 200
-        mock_requests_delete.return_value = mock_media_response
+        mock_service_delete.return_value = mock_media_response
 
         response = self.client.delete(self.delete_url)
 
@@ -110,21 +139,1285 @@ class TestViews(TestCase):
         print(Post.objects.all())
 
 
-    @patch('posts.views.requests.get')
-    def test_get_post_success(self, mock_requests_get):
+    @patch('posts.clients.media_service.get')
+    def test_get_post_success(self, mock_media_get):
         mock_media_response = Mock()
         mock_media_response.status_code = 200
         mock_media_response.json.return_value = self.mock_media_data
-        mock_requests_get.return_value = mock_media_response
+        mock_media_get.return_value = mock_media_response
 
-        response = self.client.get(self.get_url)
+        response = self.client.get(reverse('getPost', args=[self.post2.post_id]))
 
         self.assertEqual(response.status_code, 200)
         response_data = response.json()
 
-        self.assertEqual(response_data['post_id'], str(self.post.post_id))
-        self.assertEqual(response_data['caption'], self.post.caption)
-        self.assertEqual(response_data['content'], self.post.content)
+        self.assertEqual(response_data['post_id'], str(self.post2.post_id))
+        self.assertEqual(response_data['caption'], self.post2.caption)
+        self.assertEqual(response_data['content'], self.post2.content)
         self.assertEqual(response_data['media'], self.mock_media_data)
 
-        print(response_data['media'], response_data['caption'], response_data['username'])
\ No newline at end of file
+        print(response_data['media'], response_data['caption'], response_data['username'])
+
+
+    @patch('posts.clients.media_service.get')
+    def test_user_posts_batched_media(self, mock_media_get):
+        Post.objects.create(caption="Test Caption3", content="This is a test post3", user_id="2",
+                            username="testuser", media=[5678])
+
+        mock_media_response = Mock()
+        mock_media_response.status_code = 200
+        mock_media_response.json.return_value = self.mock_media_data
+        mock_media_get.return_value = mock_media_response
+
+        response = self.client.get(self.user_url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_media_get.call_count, 1)
+        self.assertCountEqual(json.loads(mock_media_get.call_args.kwargs['data']), [12345, 5678])
+
+        media_by_caption = {post['caption']: post['media'] for post in response.json()['posts']}
+        self.assertEqual(media_by_caption["Test Caption"], [])
+        self.assertEqual(media_by_caption["Test Caption2"], self.mock_media_data)
+        self.assertEqual(media_by_caption["Test Caption3"], [self.mock_media_data[1]])
+
+
+    @patch('posts.clients.media_service.get')
+    def test_user_posts_media_error(self, mock_media_get):
+        mock_media_response = Mock()
+        mock_media_response.status_code = 500
+        mock_media_get.return_value = mock_media_response
+
+        response = self.client.get(self.user_url)
+
+        self.assertEqual(response.status_code, 200)
+        for post in response.json()['posts']:
+            self.assertEqual(post['media'], [])
+
+
+    @override_settings(MEDIA_BATCH_SIZE=1, MEDIA_DEADLINE=0.2)
+    @patch('posts.clients.media_service.get')
+    def test_user_posts_media_deadline(self, mock_media_get):
+        def slow_media_service(path, data, headers, timeout, retry):
+            media_id = json.loads(data)[0]
+            if media_id == 5678:
+                time.sleep(0.5)
+
+            mock_media_response = Mock()
+            mock_media_response.status_code = 200
+            mock_media_response.json.return_value = [
+                media for media in self.mock_media_data if media['MediaId'] == str(media_id)
+            ]
+            return mock_media_response
+
+        Post.objects.create(caption="Test Caption3", content="This is a test post3", user_id="2",
+                            username="testuser", media=[12345])
+        mock_media_get.side_effect = slow_media_service
+
+        started = time.monotonic()
+        response = self.client.get(self.user_url)
+
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_media_get.call_count, 2)
+
+        #the slow media is left out, so only the post with the fast media has media data
+        media_by_caption = {post['caption']: post['media'] for post in response.json()['posts']}
+        self.assertEqual(media_by_caption["Test Caption2"], [])
+        self.assertEqual(media_by_caption["Test Caption3"], [self.mock_media_data[0]])
+
+
+    @patch('posts.clients.media_service.get')
+    def test_user_posts_pagination(self, mock_media_get):
+        for i in range(3):
+            Post.objects.create(caption=f"Page Caption{i}", content="This is a paged post", user_id="2",
+                                username="testuser", media=[])
+
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+
+            response = self.client.get(self.user_url, params)
+            self.assertEqual(response.status_code, 200)
+
+            page = response.json()
+            self.assertLessEqual(len(page['posts']), 2)
+            seen += [post['post_id'] for post in page['posts']]
+
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+
+        expected = Post.objects.filter(user_id="2").order_by('-created_at', '-post_id')
+        self.assertEqual(seen, [str(post.post_id) for post in expected])
+
+
+    def test_user_posts_invalid_cursor(self):
+        response = self.client.get(self.user_url, {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(self.user_url, {'limit': 0})
+        self.assertEqual(response.status_code, 400)
+
+
+    @patch('posts.clients.media_service.get')
+    def test_feed_posts_tags(self, mock_media_get):
+        tagged = Post.objects.create(caption="Tagged Caption", content="This is a tagged post", user_id="3",
+                                     username="taguser", media=[], tags=["travel", "food"])
+        Post.objects.create(caption="Other Caption", content="This is another post", user_id="3",
+                            username="taguser", media=[], tags=["sports"])
+
+        response = self.client.get(reverse('getFeedPosts'), {'tags': ['food', 'music']})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([post['post_id'] for post in response.json()['posts']], [str(tagged.post_id)])
+
+        response = self.client.get(reverse('getFeedPosts'), {'tags': ['music']})
+        self.assertEqual(response.status_code, 405)
+
+
+    @patch('posts.clients.media_service.get')
+    def test_get_post_cached(self, mock_media_get):
+        mock_media_response = Mock()
+        mock_media_response.status_code = 200
+        mock_media_response.json.return_value = self.mock_media_data
+        mock_media_get.return_value = mock_media_response
+        get_url = reverse('getPost', args=[self.post2.post_id])
+
+        self.client.get(get_url)
+        with self.assertNumQueries(0):
+            response = self.client.get(get_url)
+
+        self.assertEqual(response.json()['media'], self.mock_media_data)
+        self.assertEqual(mock_media_get.call_count, 1)
+
+        #the update removes the post from the cache
+        self.client.patch(reverse('updatePost', args=[self.post2.post_id]),
+                          data=json.dumps({"caption": "Updated Caption"}), content_type="application/json")
+        response = self.client.get(get_url)
+
+        self.assertEqual(response.json()['caption'], "Updated Caption")
+        self.assertEqual(mock_media_get.call_count, 2)
+
+
+    @patch('posts.clients.media_service.get')
+    def test_get_post_media_error_not_cached(self, mock_media_get):
+        mock_error_response = Mock()
+        mock_error_response.status_code = 500
+        mock_media_response = Mock()
+        mock_media_response.status_code = 200
+        mock_media_response.json.return_value = self.mock_media_data
+        mock_media_get.side_effect = [mock_error_response, mock_media_response]
+        get_url = reverse('getPost', args=[self.post2.post_id])
+
+        self.assertEqual(self.client.get(get_url).json()['media'], [])
+        self.assertEqual(self.client.get(get_url).json()['media'], self.mock_media_data)
+
+
+
+    @patch('posts.clients.ServiceClient.delete')
+    def test_delete_post_outbox(self, mock_service_delete):
+        response = self.client.delete(reverse('deletePost', args=[self.post2.post_id]), HTTP_AUTHORIZATION="Bearer token")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Post.objects.filter(post_id=self.post2.post_id).exists())
+        mock_service_delete.assert_not_called()
+
+        entries = OutboxEntry.objects.order_by('id')
+        self.assertEqual([(entry.kind, entry.target) for entry in entries], [
+            (OutboxEntry.MEDIA, "12345"),
+            (OutboxEntry.MEDIA, "5678"),
+            (OutboxEntry.INTERACTIONS, str(self.post2.post_id)),
+        ])
+        self.assertEqual(entries[2].authorization, "Bearer token")
+
+        #the interactions microservice fails, so only the media deletes are done
+        test_connection = connections['default']
+        depth = len(test_connection.atomic_blocks)
+        outside = []
+
+        def service_delete(path, **kwargs):
+            #the requests are sent outside of the transaction that claimed the entries
+            outside.append(len(test_connection.atomic_blocks) == depth)
+            return Mock(status_code=500 if path.startswith('/internal/post/') else 200)
+
+        mock_service_delete.side_effect = service_delete
+
+        self.assertEqual(drain_batch(), (2, 1))
+        self.assertEqual(outside, [True] * 3)
+        entry = OutboxEntry.objects.get()
+        self.assertEqual(entry.attempts, 1)
+        self.assertEqual(entry.last_error, "status code 500")
+
+        #the failed entry is retried after the backoff
+        mock_service_delete.side_effect = None
+        mock_service_delete.return_value = Mock(status_code=200)
+
+        self.assertEqual(drain_batch(), (0, 0))
+        OutboxEntry.objects.update(next_attempt_at=entry.created_at)
+
+        #a claimed entry is leased, the other workers skip it until the lease runs out
+        self.assertEqual(len(claim_entries(10)), 1)
+        self.assertEqual(drain_batch(), (0, 0))
+        OutboxEntry.objects.update(next_attempt_at=entry.created_at)
+
+        self.assertEqual(drain_batch(), (1, 0))
+        self.assertFalse(OutboxEntry.objects.exists())
+
+
+    @patch('posts.clients.media_service.post')
+    def test_new_post_streams_media(self, mock_media_post):
+        sent = {}
+
+        def media_service_post(path, data, headers):
+            sent['length'] = len(data)
+            sent['body'] = b''.join(data)
+            sent['content_type'] = headers['Content-Type']
+            return Mock(status_code=200, content=json.dumps({"IDs": ["12345"]}).encode())
+
+        mock_media_post.side_effect = media_service_post
+        photo = SimpleUploadedFile("photo.jpg", b"x" * 5000, content_type="image/jpeg")
+
+        response = self.client.post(reverse('newPost'), {
+            "user_id": "2", "username": "testuser", "caption": "Media Caption", "content": "with media", "file": photo
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Post.objects.get(post_id=response.json()['post_id']).media, ["12345"])
+
+        self.assertEqual(sent['length'], len(sent['body']))
+        self.assertTrue(sent['content_type'].startswith("multipart/form-data; boundary="))
+        self.assertIn(b'name="file"; filename="photo.jpg"\r\nContent-Type: image/jpeg\r\n\r\n' + b"x" * 5000, sent['body'])
+
+
+    @override_settings(MEDIA_UPLOAD_MAX_SIZE=1000)
+    @patch('posts.clients.media_service.post')
+    def test_new_post_media_too_large(self, mock_media_post):
+        photo = SimpleUploadedFile("photo.jpg", b"x" * 5000, content_type="image/jpeg")
+
+        response = self.client.post(reverse('newPost'), {"user_id": "2", "username": "testuser", "file": photo})
+
+        self.assertEqual(response.status_code, 413)
+        mock_media_post.assert_not_called()
+
+
+    @patch('posts.clients.requests.Session.request')
+    def test_server_timing_and_metrics(self, mock_session_request):
+        mock_session_request.return_value = Mock(status_code=200, json=Mock(return_value=self.mock_media_data))
+
+        response = self.client.get(reverse('getPost', args=[self.post2.post_id]))
+
+        server_timing = response['Server-Timing']
+        self.assertIn('db;dur=', server_timing)
+        self.assertIn('media;dur=', server_timing)
+        self.assertIn('desc="1 calls"', server_timing)
+        self.assertIn('serialize;dur=', server_timing)
+        self.assertIn('total;dur=', server_timing)
+
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        metrics = response.content.decode()
+        self.assertIn('posts_requests_total{view="getPost",method="GET",status="200"}', metrics)
+        self.assertIn('posts_span_calls_total{view="getPost",span="media"}', metrics)
+        self.assertIn('posts_request_duration_seconds_bucket{view="getPost",method="GET",le="+Inf"}', metrics)
+
+
+    @patch('posts.clients.media_service.get')
+    def test_user_posts_same_format_as_json_response(self, mock_media_get):
+        mock_media_get.return_value = Mock(status_code=200, json=Mock(return_value=self.mock_media_data))
+
+        response = self.client.get(self.user_url)
+
+        expected = [{
+            "post_id": post.post_id,
+            "caption": post.caption,
+            "content": post.content,
+            "username": post.username,
+            "user_id": post.user_id,
+            "created_at": post.created_at,
+            "updated_at": post.updated_at,
+            "media": self.mock_media_data if post.media else [],
+        } for post in Post.objects.filter(user_id="2").order_by('-created_at', '-post_id')]
+
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json()['posts'], json.loads(json.dumps(expected, cls=DjangoJSONEncoder)))
+
+    @override_settings(FEED_TIMELINES=True)
+    @patch('posts.clients.media_service.get')
+    def test_feed_posts_timelines(self, mock_media_get):
+        post_ids = []
+        for tags in (["food"], ["travel", "food"], ["travel"], ["sports"]):
+            response = self.client.post(reverse('newPost'), {"user_id": "3", "username": "taguser", "caption": "Tagged Caption",
+                                                               "content": "This is a tagged post", "tags": tags})
+            post_ids.append(response.json()['post_id'])
+
+        self.assertEqual(TagTimelineEntry.objects.filter(tag="food").count(), 2)
+
+        #the post with both tags is only returned once and the pages follow each other
+        response = self.client.get(reverse('getFeedPosts'), {'tags': ['food', 'travel'], 'limit': 2})
+        self.assertEqual([post['post_id'] for post in response.json()['posts']], [post_ids[2], post_ids[1]])
+
+        response = self.client.get(reverse('getFeedPosts'), {'tags': ['food', 'travel'], 'limit': 2,
+                                                            'cursor': response.json()['next_cursor']})
+        self.assertEqual([post['post_id'] for post in response.json()['posts']], [post_ids[0]])
+        self.assertIsNone(response.json()['next_cursor'])
+
+        #retagging moves the post to the timelines of its new tags
+        response = self.client.patch(reverse('updatePost', args=[post_ids[3]]), json.dumps({"tags": ["food"]}),
+                                     content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(TagTimelineEntry.objects.filter(tag="sports").exists())
+
+        response = self.client.get(reverse('getFeedPosts'), {'tags': ['food']})
+        self.assertEqual([post['post_id'] for post in response.json()['posts']], [post_ids[3], post_ids[1], post_ids[0]])
+
+
+    @override_settings(FEED_TIMELINES=True, TAG_TIMELINE_LENGTH=2)
+    @patch('posts.clients.media_service.get')
+    def test_feed_posts_timelines_trimmed(self, mock_media_get):
+        posts = [Post.objects.create(caption="Tagged Caption", content="This is a tagged post", user_id="3",
+                                     username="taguser", media=[], tags=["food"]) for _ in range(3)]
+
+        out = StringIO()
+        call_command('rebuild_timelines', stdout=out)
+        self.assertEqual(out.getvalue(), "wrote 2 timeline entries\n")
+        self.assertEqual(set(TagTimelineEntry.objects.values_list('post_id', flat=True)),
+                         {posts[1].post_id, posts[2].post_id})
+        self.assertEqual(TagTimelineTrim.objects.get(tag="food").post_id, posts[0].post_id)
+
+        #the page goes deeper than the trimmed timeline, so it is read from the posts table
+        response = self.client.get(reverse('getFeedPosts'), {'tags': ['food'], 'limit': 2})
+        response = self.client.get(reverse('getFeedPosts'), {'tags': ['food'], 'limit': 2,
+                                                            'cursor': response.json()['next_cursor']})
+        self.assertEqual([post['post_id'] for post in response.json()['posts']], [str(posts[0].post_id)])
+
+
+    @override_settings(FEED_TIMELINES=True, TAG_TIMELINE_LENGTH=2)
+    @patch('posts.clients.media_service.get')
+    def test_feed_posts_timelines_trimmed_then_deleted(self, mock_media_get):
+        post_ids = []
+        for _ in range(3):
+            response = self.client.post(reverse('newPost'), {"user_id": "3", "username": "taguser", "caption": "Tagged Caption",
+                                                               "content": "This is a tagged post", "tags": ["food"]})
+            post_ids.append(response.json()['post_id'])
+
+        #the full timeline loses an entry, it is shorter than the cap but still trimmed
+        self.client.delete(reverse('deletePost', args=[post_ids[2]]))
+        self.assertEqual(TagTimelineEntry.objects.filter(tag="food").count(), 1)
+
+        seen = []
+        cursor = None
+        while True:
+            params = {'tags': ['food'], 'limit': 1, **({'cursor': cursor} if cursor else {})}
+            page = self.client.get(reverse('getFeedPosts'), params).json()
+            seen += [post['post_id'] for post in page['posts']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, [post_ids[1], post_ids[0]])
+
+
+    def test_bulk_posts(self):
+        response = self.client.post(reverse('bulkPosts'), json.dumps({"posts": [
+            {"user_id": "4", "username": "importer", "caption": "Imported", "content": "first", "tags": ["news"]},
+            {"user_id": "4", "caption": "no username"},
+            {"user_id": "4", "username": "importer", "caption": "x" * 1001, "content": "too long"},
+            {"user_id": "4", "username": "importer", "content": "second", "media": [12345]},
+            {"user_id": "4", "username": "importer", "content": "numbers", "tags": [1, 2]},
+        ]}), content_type="application/json")
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(results[1], {"error": "missing data!"})
+        self.assertTrue(results[2]['error'].startswith("caption:"))
+        self.assertEqual(results[4], {"error": "tags must be strings"})
+
+        posts = Post.objects.filter(user_id="4")
+        self.assertCountEqual([str(post.post_id) for post in posts], [results[0]['post_id'], results[3]['post_id']])
+        self.assertEqual(posts.get(post_id=results[0]['post_id']).tags, ["news"])
+        self.assertEqual(posts.get(post_id=results[3]['post_id']).media, [12345])
+
+        response = self.client.post(reverse('bulkPosts'), json.dumps([{"user_id": "4"}]), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+    @patch('posts.clients.media_service.get')
+    def test_batch_posts(self, mock_media_get):
+        mock_media_get.return_value = Mock(status_code=200, json=Mock(return_value=self.mock_media_data))
+        unknown = "00000000-0000-0000-0000-000000000000"
+
+        response = self.client.get(reverse('batchPosts'), {'ids': [self.post2.post_id, "abc", self.post.post_id, unknown]})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([post['post_id'] for post in data['posts']], [str(self.post2.post_id), str(self.post.post_id)])
+        self.assertEqual(data['posts'][0]['media'], self.mock_media_data)
+        self.assertEqual(data['errors'], [{"post_id": "abc", "error": "invalid post_id"},
+                                          {"post_id": unknown, "error": "Post not found"}])
+        self.assertEqual(mock_media_get.call_count, 1)
+
+        #the rows are cached now, so the posts are not read from the db again
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse('batchPosts'), json.dumps({"ids": [str(self.post.post_id)]}),
+                                        content_type="application/json")
+        self.assertEqual(response.json()['posts'][0]['caption'], self.post.caption)
+
+
+    @patch('posts.clients.media_service.get')
+    def test_get_post_not_modified(self, mock_media_get):
+        mock_media_get.return_value = Mock(status_code=200, json=Mock(return_value=self.mock_media_data))
+        url = reverse('getPost', args=[self.post2.post_id])
+
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(mock_media_get.call_count, 1)
+
+        #a 304 is returned before the media is requested
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(mock_media_get.call_count, 1)
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+        #after an update the post is sent again with a new etag
+        self.client.patch(reverse('updatePost', args=[self.post2.post_id]), json.dumps({"caption": "Changed"}),
+                          content_type="application/json")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+    @patch('posts.clients.media_service.get')
+    def test_get_post_media_fallback_not_cacheable(self, mock_media_get):
+        url = reverse('getPost', args=[self.post2.post_id])
+
+        #without its media the post is sent without validators, so the client does not keep the incomplete body
+        mock_media_get.return_value = Mock(status_code=500)
+        response = self.client.get(url)
+        self.assertEqual(response.json()['media'], [])
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(response['Cache-Control'], 'no-store')
+
+        #once the media service recovers the full post gets its validators again
+        mock_media_get.return_value = Mock(status_code=200, json=Mock(return_value=self.mock_media_data))
+        response = self.client.get(url)
+        self.assertEqual(response.json()['media'], self.mock_media_data)
+        self.assertNotIn('Cache-Control', response)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+    @patch('posts.clients.media_service.get')
+    def test_partial_media_response(self, mock_media_get):
+        post3 = Post.objects.create(caption="Third Caption", content="third post", user_id="3", username="thirduser",
+                                    media=[12345, 999])
+        known = [media for media in self.mock_media_data if media['MediaId'] == "12345"]
+        mock_media_get.return_value = Mock(status_code=200, json=Mock(return_value=known))
+
+        #a single post gets the media data like the media service returned it
+        response = self.client.get(reverse('getPost', args=[self.post2.post_id]))
+        self.assertEqual(response.json()['media'], known)
+
+        #in a page each post keeps the media the service returned for its ids, unknown ids are skipped
+        cache.clear()
+        posts = {post['post_id']: post for post in self.client.get(reverse('getFeedPosts')).json()['posts']}
+        self.assertEqual(posts[str(self.post2.post_id)]['media'], known)
+        self.assertEqual(posts[str(post3.post_id)]['media'], known)
+        self.assertEqual(posts[str(self.post.post_id)]['media'], [])
+
+
+    @patch('posts.clients.media_service.get')
+    def test_get_post_media_deleted(self, mock_media_get):
+        url = reverse('getPost', args=[self.post2.post_id])
+        cache.set(stale_media_key(self.post2.post_id), self.mock_media_data)
+
+        #the media service does not know the media anymore: that is not a failure, the stale media is not used
+        mock_media_get.return_value = Mock(status_code=200, json=Mock(return_value=[]))
+        response = self.client.get(url)
+        self.assertEqual(response.json()['media'], [])
+        self.assertIn('ETag', response)
+        self.assertNotIn('Cache-Control', response)
+
+        #and the empty media is cached like other media
+        self.client.get(url)
+        self.assertEqual(mock_media_get.call_count, 1)
+
+
+    @patch('posts.clients.media_service.get')
+    def test_feed_posts_not_modified(self, mock_media_get):
+        mock_media_get.return_value = Mock(status_code=200, json=Mock(return_value=self.mock_media_data))
+        response = self.client.get(reverse('getFeedPosts'), {'limit': 1})
+        etag = response['ETag']
+
+        response = self.client.get(reverse('getFeedPosts'), {'limit': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        #the next page and a page with a new post have other etags
+        next_page = self.client.get(reverse('getFeedPosts'), {'limit': 1, 'cursor': self.client.get(
+            reverse('getFeedPosts'), {'limit': 1}).json()['next_cursor']})
+        self.assertNotEqual(next_page['ETag'], etag)
+
+        Post.objects.create(caption="New Caption", content="new post", user_id="3", username="newuser", media=[])
+        response = self.client.get(reverse('getFeedPosts'), {'limit': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 201)
+
+
+    @patch('posts.clients.media_service.get')
+    def test_search_posts(self, mock_media_get):
+        caption_match = Post.objects.create(caption="Sunset hiking trip", content="a long day", user_id="6",
+                                            username="hiker", media=[])
+        content_match = Post.objects.create(caption="Weekend", content="we went hiking in the alps", user_id="6",
+                                            username="hiker", media=[])
+        tag_match = Post.objects.create(caption="Alps", content="view from the top", user_id="6",
+                                        username="hiker", media=[], tags=["hiking"])
+
+        response = self.client.get(reverse('searchPosts'), {'q': 'hike'})
+
+        self.assertEqual(response.status_code, 200)
+        posts = response.json()['posts']
+        self.assertEqual([post['post_id'] for post in posts],
+                         [str(caption_match.post_id), str(tag_match.post_id), str(content_match.post_id)])
+        self.assertTrue(posts[0]['rank'] > posts[1]['rank'] > posts[2]['rank'])
+
+        #the pages follow each other without gaps or duplicates
+        page = self.client.get(reverse('searchPosts'), {'q': 'hiking', 'limit': 2}).json()
+        next_page = self.client.get(reverse('searchPosts'), {'q': 'hiking', 'limit': 2, 'cursor': page['next_cursor']}).json()
+        self.assertEqual([post['post_id'] for post in page['posts'] + next_page['posts']],
+                         [post['post_id'] for post in posts])
+        self.assertIsNone(next_page['next_cursor'])
+
+        #the search vector is updated with the post
+        self.client.patch(reverse('updatePost', args=[content_match.post_id]), json.dumps({"content": "a lazy day"}),
+                          content_type="application/json")
+        response = self.client.get(reverse('searchPosts'), {'q': 'hiking -sunset'})
+        self.assertEqual([post['post_id'] for post in response.json()['posts']], [str(tag_match.post_id)])
+
+        self.assertEqual(self.client.get(reverse('searchPosts')).status_code, 400)
+
+
+    @patch('posts.clients.media_service.get')
+    def test_search_posts_tied_ranks(self, mock_media_get):
+        #posts with the same text have the same rank, the pages of one post follow each other by created_at and post_id
+        expected = [str(Post.objects.create(caption=caption, content="on the lake", user_id="6", username="paddler",
+                                            media=[]).post_id)
+                    for caption in ("Kayak trip", "Kayak trip", "Kayak trip", "Kayak day")]
+
+        seen, cursor = [], None
+        for _ in range(len(expected) + 1):
+            params = {'q': 'kayak', 'limit': 1, **({'cursor': cursor} if cursor else {})}
+            page = self.client.get(reverse('searchPosts'), params).json()
+            seen += [post['post_id'] for post in page['posts']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+
+        self.assertIsNone(cursor)
+        self.assertEqual(sorted(seen), sorted(expected))
+        self.assertEqual(len(seen), len(set(seen)))
+
+
+    def test_db_pool_stats(self):
+        response = self.client.get(reverse('poolStats'))
+
+        self.assertEqual(response.status_code, 200)
+        db = response.json()['db']['default']
+        if db['pool']:
+            self.assertEqual(db['pool_max'], settings.DATABASES['default']['OPTIONS']['pool']['max_size'])
+            self.assertIn('posts_db_pool_size{database="default"}', self.client.get(reverse('metrics')).content.decode())
+        else:
+            self.assertEqual(db['conn_max_age'], settings.DATABASES['default']['CONN_MAX_AGE'])
+
+        #a database whose pool was not used yet is not reported, and the stats do not create its pool
+        connections.settings['unused'] = {**connections.settings['default'],
+                                          'OPTIONS': {'pool': {'min_size': 1, 'max_size': 2}}, 'CONN_MAX_AGE': 0}
+        try:
+            self.assertNotIn('unused', self.client.get(reverse('poolStats')).json()['db'])
+            self.assertNotIn('unused', getattr(connections['unused'], '_connection_pools', {}))
+        finally:
+            del connections.settings['unused']
+            del connections['unused']
+
+
+    @patch('posts.clients.media_service.get')
+    def test_feed_posts_ranked(self, mock_media_get):
+        now = timezone.now()
+        old_match = Post.objects.create(caption="Old", content="both tags", user_id="8", username="ranker",
+                                        media=[], tags=["food", "travel"])
+        new_match = Post.objects.create(caption="New", content="one tag", user_id="8", username="ranker",
+                                        media=[], tags=["food"])
+        Post.objects.filter(post_id=old_match.post_id).update(created_at=now - timedelta(hours=24))
+
+        #a new post with one tag beats an old post with both tags on recency alone
+        response = self.client.get(reverse('getFeedPosts'), {'tags': ['food', 'travel'], 'ranked': 'true'})
+        posts = response.json()['posts']
+        self.assertEqual([post['post_id'] for post in posts], [str(new_match.post_id), str(old_match.post_id)])
+        self.assertIsNone(response.json()['next_cursor'])
+        self.assertGreater(posts[0]['score'], posts[1]['score'])
+
+        with override_settings(FEED_SCORERS=[('posts.ranking.TagOverlapScorer', 1.0)]):
+            response = self.client.get(reverse('getFeedPosts'), {'tags': ['food', 'travel'], 'ranked': 'true'})
+        self.assertEqual([post['post_id'] for post in response.json()['posts']],
+                         [str(old_match.post_id), str(new_match.post_id)])
+
+        #only the best "limit" candidates are returned
+        response = self.client.get(reverse('getFeedPosts'), {'ranked': 'true', 'limit': 1})
+        self.assertEqual(len(response.json()['posts']), 1)
+
+
+    @override_settings(FEED_SCORERS=[('posts.ranking.InteractionScorer', 1.0)])
+    @patch('posts.clients.interactions_service.get')
+    @patch('posts.clients.media_service.get')
+    def test_feed_posts_ranked_by_interactions(self, mock_media_get, mock_interactions_get):
+        threads = []
+
+        def interactions(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return Mock(status_code=200, json=Mock(return_value={
+                str(self.post.post_id): {"likes": 40, "comments": 2}, str(self.post2.post_id): {"likes": 1, "comments": 0},
+            }))
+
+        mock_interactions_get.side_effect = interactions
+        response = self.client.get(reverse('getFeedPosts'), {'ranked': 'true'})
+
+        #the request does not block the thread of the ORM (the main thread under the test client)
+        self.assertIsNot(threads[0], threading.main_thread())
+
+        self.assertEqual([post['post_id'] for post in response.json()['posts']],
+                         [str(self.post.post_id), str(self.post2.post_id)])
+        self.assertEqual(mock_interactions_get.call_count, 1)
+        self.assertEqual(json.loads(mock_interactions_get.call_args.kwargs['data']),
+                         [str(self.post2.post_id), str(self.post.post_id)])
+
+        #the feed is still returned if the interactions microservice fails
+        mock_interactions_get.side_effect = requests.ConnectionError
+        self.assertEqual(len(self.client.get(reverse('getFeedPosts'), {'ranked': 'true'}).json()['posts']), 2)
+
+
+    @patch('posts.clients.media_service.get')
+    @patch('posts.clients.media_service.post')
+    def test_new_post_media_snapshot(self, mock_media_post, mock_media_get):
+        mock_media_post.return_value = Mock(status_code=200, content=json.dumps({"IDs": [12345, 5678]}).encode())
+        mock_media_get.return_value = Mock(status_code=200, json=Mock(return_value=self.mock_media_data))
+        photo = SimpleUploadedFile("photo.jpg", b"x" * 100, content_type="image/jpeg")
+
+        response = self.client.post(reverse('newPost'), {
+            "user_id": "2", "username": "testuser", "caption": "Media Caption", "content": "with media", "file": photo
+        })
+        post = Post.objects.get(post_id=response.json()['post_id'])
+        self.assertEqual(post.media_snapshot, self.mock_media_data)
+        self.assertEqual(mock_media_get.call_count, 1)
+
+        #the media is read from the snapshot, without media requests
+        mock_media_get.reset_mock()
+        response = self.client.get(reverse('getPost', args=[post.post_id]))
+        self.assertEqual(response.json()['media'], self.mock_media_data)
+        self.assertNotIn('media_snapshot', response.json())
+        mock_media_get.assert_not_called()
+
+
+    @patch('posts.clients.media_service.get')
+    def test_backfill_media_snapshots(self, mock_media_get):
+        mock_media_get.return_value = Mock(status_code=200, json=Mock(return_value=self.mock_media_data))
+        updated_at = self.post2.updated_at
+
+        call_command('backfill_media_snapshots', stdout=StringIO())
+        self.post.refresh_from_db()
+        self.post2.refresh_from_db()
+        self.assertEqual(self.post.media_snapshot, [])
+        self.assertEqual(self.post2.media_snapshot, self.mock_media_data)
+        self.assertEqual(self.post2.updated_at, updated_at)
+        self.assertEqual(mock_media_get.call_count, 1)
+
+        mock_media_get.reset_mock()
+        response = self.client.get(self.user_url)
+        self.assertEqual(response.json()['posts'][0]['media'], self.mock_media_data)
+        mock_media_get.assert_not_called()
+
+        #snapshots of an older version are not used until they are refreshed
+        with override_settings(MEDIA_SNAPSHOT_VERSION=2):
+            cache.clear()
+            self.client.get(self.user_url)
+            self.assertEqual(mock_media_get.call_count, 1)
+
+            call_command('backfill_media_snapshots', stdout=StringIO())
+            self.post2.refresh_from_db()
+            self.assertEqual(self.post2.media_snapshot_version, 2)
+
+
+    @patch('posts.clients.media_service.get')
+    def test_refresh_snapshots_keeps_updated_at(self, mock_media_get):
+        mock_media_get.return_value = Mock(status_code=200, json=Mock(return_value=self.mock_media_data))
+        call_command('backfill_media_snapshots', stdout=StringIO())
+        posts = list(Post.objects.filter(post_id=self.post2.post_id))
+
+        #the post is updated after it was loaded, the unchanged snapshot does not write the old updated_at back
+        updated_at = timezone.now() + timedelta(seconds=5)
+        Post.objects.filter(post_id=self.post2.post_id).update(updated_at=updated_at)
+        self.assertEqual(refresh_snapshots(posts), 0)
+
+        self.post2.refresh_from_db()
+        self.assertEqual(self.post2.updated_at, updated_at)
+
+
+    @patch('posts.clients.media_service.get')
+    def test_media_changed(self, mock_media_get):
+        mock_media_get.return_value = Mock(status_code=200, json=Mock(return_value=self.mock_media_data))
+        call_command('backfill_media_snapshots', stdout=StringIO())
+        url = reverse('getPost', args=[self.post2.post_id])
+        etag = self.client.get(url)['ETag']
+
+        changed = [self.mock_media_data[0], {**self.mock_media_data[1], "FileUrl": "https://cdn.example.com/5678"}]
+        mock_media_get.return_value = Mock(status_code=200, json=Mock(return_value=changed))
+
+        response = self.client.post(reverse('mediaChanged'), json.dumps({"media_ids": [5678]}),
+                                    content_type="application/json")
+        self.assertEqual(response.json(), {"refreshed": 1, "failed": 0})
+
+        #the post has a new version, so the cached post and the old ETag are not used anymore
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['media'], changed)
+
+        #a media id sent as a string finds the posts that store it as a number
+        response = self.client.post(reverse('mediaChanged'), json.dumps({"media_ids": ["5678"]}),
+                                    content_type="application/json")
+        self.assertEqual(response.json(), {"refreshed": 1, "failed": 0})
+
+        #if the media can not be fetched the post keeps its snapshot
+        mock_media_get.return_value = Mock(status_code=500)
+        response = self.client.post(reverse('mediaChanged'), json.dumps({"media_ids": [5678]}),
+                                    content_type="application/json")
+        self.assertEqual(response.json(), {"refreshed": 1, "failed": 1})
+        self.post2.refresh_from_db()
+        self.assertEqual(self.post2.media_snapshot, changed)
+        self.assertEqual(self.post2.media_snapshot_version, settings.MEDIA_SNAPSHOT_VERSION)
+
+        response = self.client.post(reverse('mediaChanged'), json.dumps({"ids": [5678]}), content_type="application/json")
+        self.assertEqual(response.status_code, 400)
+
+
+    @override_settings(POSTS_STREAM_CHUNK_SIZE=2)
+    @patch('posts.clients.media_service.get')
+    async def test_user_posts_stream(self, mock_media_get):
+        mock_media_get.return_value = Mock(status_code=200, json=Mock(return_value=self.mock_media_data))
+        for number in range(3):
+            await Post.objects.acreate(caption=f"Caption {number}", content="streamed", user_id="2", username="testuser",
+                                       media=[])
+        page = (await self.async_client.get(self.user_url, {'limit': 50})).json()['posts']
+
+        #the streamed posts are the same as the posts of a page, in chunks of POSTS_STREAM_CHUNK_SIZE
+        response = await self.async_client.get(self.user_url, {'stream': 'json'})
+        self.assertEqual(response.status_code, 200)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual(json.loads(b''.join(chunks)), {"posts": page})
+
+        response = await self.async_client.get(self.user_url, {'stream': 'ndjson', 'limit': 3},
+                                               headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = gzip.decompress(b''.join([chunk async for chunk in response.streaming_content]))
+        self.assertEqual([json.loads(line) for line in body.splitlines()], page[:3])
+
+        response = await self.async_client.get(reverse('getUserPosts', args=["nobody"]), {'stream': 'json'})
+        self.assertEqual(b''.join([chunk async for chunk in response.streaming_content]), b'{"posts":[]}')
+
+        response = await self.async_client.get(self.user_url, {'stream': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+    @patch('posts.clients.media_service.get')
+    async def test_get_post_coalesced(self, mock_media_get):
+        def slow_media(*args, **kwargs):
+            time.sleep(0.2)
+            return Mock(status_code=200, json=Mock(return_value=self.mock_media_data))
+        mock_media_get.side_effect = slow_media
+        get_url = reverse('getPost', args=[self.post2.post_id])
+        coalesced = SINGLEFLIGHT_CALLS.values.get(('media', 'coalesced'), 0)
+
+        #concurrent requests for the same post wait for the first one and share its media
+        responses = await asyncio.gather(*[self.async_client.get(get_url) for _ in range(5)])
+
+        self.assertEqual([response.status_code for response in responses], [200] * 5)
+        self.assertTrue(all(response.json()['media'] == self.mock_media_data for response in responses))
+        self.assertEqual(mock_media_get.call_count, 1)
+        self.assertEqual(SINGLEFLIGHT_CALLS.values[('media', 'coalesced')] - coalesced, 4)
+
+        with override_settings(SINGLEFLIGHT=False):
+            await cache.aclear()
+            await asyncio.gather(*[self.async_client.get(get_url) for _ in range(3)])
+        self.assertEqual(mock_media_get.call_count, 4)
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'[]')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestServiceClient(TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = ServiceClient('test', f'http://127.0.0.1:{self.server.server_port}', 2)
+
+    def tearDown(self):
+        self.client.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def test_connection_reused(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get('/media').json(), [])
+
+        stats = self.client.pool_stats()
+
+        self.assertEqual(len(stats), 1)
+        self.assertTrue(stats[0]['retry'])
+        self.assertEqual(stats[0]['maxsize'], 2)
+        self.assertEqual(stats[0]['connections_opened'], 1)
+        self.assertEqual(stats[0]['requests'], 3)
+        self.assertEqual(stats[0]['idle'], 1)
+
+
+class TestMediaBreaker(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_breaker.reset()
+        self.server = make_server()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.post = Post.objects.create(caption="Media Caption", content="with media", user_id="5",
+                                        username="mediauser", media=["111", "222"])
+        self.url = reverse('getPost', args=[self.post.post_id])
+
+    def tearDown(self):
+        media_breaker.reset()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_media(self):
+        #the fresh media expired, so the media is requested again
+        cache.delete(media_key(self.post.post_id))
+        return self.client.get(self.url).json()['media']
+
+
+    @patch.multiple(media_breaker, failures=2, reset_timeout=0.2)
+    def test_trip_and_recovery(self):
+        with patch.object(media_service, 'base_url', f'http://127.0.0.1:{self.server.server_port}'):
+            media = self.get_media()
+            self.assertEqual([item['MediaId'] for item in media], ["111", "222"])
+
+            #the media service fails: the stale media is returned and the breaker opens after 2 failures
+            self.server.config.error_rate = 1.0
+            self.assertEqual(self.get_media(), media)
+            self.assertEqual(self.get_media(), media)
+            self.assertEqual(media_breaker.state, 'open')
+            self.assertEqual(self.server.stats['get_media'], 3)
+
+            #while the breaker is open the media service is not called at all
+            self.assertEqual(self.get_media(), media)
+            self.assertEqual(self.server.stats['get_media'], 3)
+
+            #after the reset timeout one probe request is sent, it succeeds and closes the breaker
+            self.server.config.error_rate = 0.0
+            time.sleep(0.25)
+            self.assertEqual(self.get_media(), media)
+            self.assertEqual(media_breaker.state, 'closed')
+            self.assertEqual(self.server.stats['get_media'], 4)
+
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('posts_circuit_breaker_state{breaker="media"} 0', metrics)
+        self.assertIn('posts_circuit_breaker_transitions_total{breaker="media",state="open"}', metrics)
+        self.assertIn('posts_circuit_breaker_transitions_total{breaker="media",state="half_open"}', metrics)
+        self.assertIn('posts_circuit_breaker_rejected_total{breaker="media"}', metrics)
+
+
+    @override_settings(MEDIA_REQUEST_TIMEOUT=0.2, MEDIA_DEADLINE=0.3)
+    def test_media_request_not_retried(self):
+        #the read timeout of a media request is not retried, so the hydration stays within MEDIA_DEADLINE
+        self.server.config.latency = 400
+        with patch.object(media_service, 'base_url', f'http://127.0.0.1:{self.server.server_port}'):
+            started = time.monotonic()
+            self.assertEqual(self.get_media(), [])
+
+        self.assertLess(time.monotonic() - started, 0.35)
+        self.assertEqual(self.server.stats['get_media'], 1)
+
+
+    @patch.multiple(media_breaker, failures=1, reset_timeout=0.2)
+    def test_failed_probe_reopens(self):
+        with patch.object(media_service, 'base_url', f'http://127.0.0.1:{self.server.server_port}'):
+            self.server.config.error_rate = 1.0
+            self.assertEqual(self.get_media(), [])
+            self.assertEqual(media_breaker.state, 'open')
+
+            time.sleep(0.25)
+            self.assertEqual(self.get_media(), [])
+            self.assertEqual(media_breaker.state, 'open')
+            self.assertEqual(self.server.stats['get_media'], 2)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_STICKY_SECONDS=5, REPLICA_CHECK_INTERVAL=60)
+@patch('posts.routers.connections')
+class TestReplicaRouting(TestCase):
+    def setUp(self):
+        cache.clear()
+        replica_health.clear()
+        self.factory = RequestFactory()
+        self.middleware = ReplicaMiddleware(self.get_response)
+
+    def tearDown(self):
+        replica_health.clear()
+
+    def get_response(self, request):
+        #the db that the reads of the request go to
+        self.read_db = ReplicaRouter().db_for_read(Post)
+        return HttpResponse(status=200)
+
+    def check_replicas(self):
+        #the first request starts the check of the replica in the background
+        self.middleware(self.factory.get('/posts/feed/'))
+        for thread in threading.enumerate():
+            if thread.name == 'replica-check':
+                thread.join()
+
+
+    @patch('posts.routers.check_replica', return_value=True)
+    def test_reads_go_to_replica(self, mock_check_replica, mock_connections):
+        self.check_replicas()
+
+        self.middleware(self.factory.get('/posts/feed/'))
+        self.assertEqual(self.read_db, 'replica1')
+
+        #writes and the reads of write requests go to the primary
+        self.middleware(self.factory.post('/posts/'))
+        self.assertIsNone(self.read_db)
+
+        #the replica was checked only once in REPLICA_CHECK_INTERVAL
+        self.middleware(self.factory.get('/posts/feed/'))
+        self.assertEqual(mock_check_replica.call_count, 1)
+        self.assertFalse(ReplicaRouter().allow_migrate('replica1', 'posts'))
+
+
+    @patch('posts.routers.check_replica', return_value=True)
+    def test_read_your_writes(self, mock_check_replica, mock_connections):
+        self.check_replicas()
+        response = self.middleware(self.factory.delete('/posts/delete/1/', HTTP_AUTHORIZATION="Bearer user1"))
+
+        #the same client reads from the primary, by its token or by the cookie
+        self.middleware(self.factory.get('/posts/feed/', HTTP_AUTHORIZATION="Bearer user1"))
+        self.assertIsNone(self.read_db)
+
+        request = self.factory.get('/posts/feed/')
+        request.COOKIES = {key: morsel.value for key, morsel in response.cookies.items()}
+        self.middleware(request)
+        self.assertIsNone(self.read_db)
+
+        #other clients still read from the replica
+        self.middleware(self.factory.get('/posts/feed/', HTTP_AUTHORIZATION="Bearer user2"))
+        self.assertEqual(self.read_db, 'replica1')
+
+
+    @patch('posts.routers.check_replica', return_value=False)
+    def test_unhealthy_replica_falls_back_to_primary(self, mock_check_replica, mock_connections):
+        self.check_replicas()
+
+        self.middleware(self.factory.get('/posts/feed/'))
+        self.assertIsNone(self.read_db)
+        self.assertIn('posts_db_replica_healthy{database="replica1"} 0', self.client.get(reverse('metrics')).content.decode())
+
+
+class TestPartitions(TestCase):
+    def setUp(self):
+        self.next_month = add_months(month_start(timezone.now()), 1)
+        self.post = Post.objects.create(caption="Old", content="before the partitions", user_id="5", username="old",
+                                        media=[], tags=["news"])
+        #a post of next month, updating created_at moves it to the partition of that month
+        self.future_post = Post.objects.create(caption="New", content="next month", user_id="5", username="new",
+                                               media=[], tags=["news"])
+        Post.objects.filter(post_id=self.future_post.post_id).update(created_at=self.next_month + timedelta(days=1))
+        TagTimelineEntry.objects.create(tag="news", post=self.post, created_at=self.post.created_at)
+
+    def table_of(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT tableoid::regclass::text FROM posts_post WHERE post_id = %s", [post.post_id])
+            return cursor.fetchone()[0]
+
+    def test_posts_are_partitioned_by_month(self):
+        names = [name for name, _, _ in partitions()]
+        self.assertEqual(names[0], 'posts_post_legacy')
+        self.assertIn(partition_name(self.next_month), names)
+
+        self.assertEqual(self.table_of(self.post), 'posts_post_legacy')
+        self.assertEqual(self.table_of(self.future_post), partition_name(self.next_month))
+
+        #queries on created_at only read the partitions of that time
+        plan = Post.objects.filter(created_at__lte=timezone.now()).explain()
+        self.assertIn('posts_post_legacy', plan)
+        self.assertNotIn(partition_name(self.next_month), plan)
+
+    def test_manage_partitions(self):
+        out = StringIO()
+        call_command('manage_partitions', '--months-ahead', '6', stdout=out)
+        self.assertIn(partition_name(add_months(self.next_month, 5)), out.getvalue())
+        self.assertEqual(partitions()[-1][1], add_months(self.next_month, 5))
+
+        out = StringIO()
+        call_command('manage_partitions', '--months-ahead', '6', stdout=out)
+        self.assertIn("created partitions: -", out.getvalue())
+
+    def test_default_partition(self):
+        #a post of a month without a partition is written to the default partition
+        later = add_months(self.next_month, 7)
+        Post.objects.filter(post_id=self.future_post.post_id).update(created_at=later + timedelta(days=2))
+        self.assertEqual(self.table_of(self.future_post), 'posts_post_default')
+        self.assertNotIn('posts_post_default', [name for name, _, _ in partitions()])
+
+        #the partition of its month takes it over
+        call_command('manage_partitions', '--months-ahead', '8', stdout=StringIO())
+        self.assertEqual(self.table_of(self.future_post), partition_name(later))
+        self.future_post.refresh_from_db()
+        self.assertEqual(self.future_post.caption, "New")
+        self.assertEqual(Post.objects.filter(post_id=self.future_post.post_id).count(), 1)
+
+    def test_detach_partitions(self):
+        detached = detach_partitions(self.next_month, archive_schema='posts_archive')
+
+        self.assertEqual(detached, ['posts_post_legacy'])
+        self.assertEqual(list(Post.objects.values_list('post_id', flat=True)), [self.future_post.post_id])
+        self.assertFalse(TagTimelineEntry.objects.exists())
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT post_id FROM posts_archive.posts_post_legacy")
+            self.assertEqual(cursor.fetchall(), [(self.post.post_id,)])
+
+
+#manage_partitions detaches the partitions outside of a transaction, like it runs in production
+class TestPartitionsCommand(TransactionTestCase):
+    def setUp(self):
+        self.post = Post.objects.create(caption="Old", content="archived", user_id="5", username="old", media=[])
+        self.legacy_end = partitions()[0][2]
+
+    def tearDown(self):
+        #the archived partition is attached again for the other tests
+        with connection.cursor() as cursor:
+            cursor.execute("ALTER TABLE posts_archive.posts_post_legacy SET SCHEMA public")
+            cursor.execute("ALTER TABLE posts_post ATTACH PARTITION posts_post_legacy FOR VALUES FROM (MINVALUE) TO (%s)",
+                           [self.legacy_end])
+
+    def test_manage_partitions_retention(self):
+        #a month after the end of the first partition, with a retention of one month it is archived
+        now = add_months(self.legacy_end, 1) + timedelta(days=3)
+        out = StringIO()
+        with patch('posts.management.commands.manage_partitions.timezone.now', return_value=now):
+            call_command('manage_partitions', '--months-ahead', '0', '--retention-months', '1', stdout=out)
+
+        self.assertIn("archived partitions: posts_post_legacy", out.getvalue())
+        self.assertFalse(Post.objects.filter(post_id=self.post.post_id).exists())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT post_id FROM posts_archive.posts_post_legacy")
+            self.assertEqual(cursor.fetchall(), [(self.post.post_id,)])
+
+
+class TestSingleFlight(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.flight = SingleFlight('test')
+
+    async def test_error_shared_and_forgotten(self):
+        calls = []
+
+        async def fail():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            raise ValueError("failed")
+
+        results = await asyncio.gather(*[self.flight.do('key', fail) for _ in range(3)], return_exceptions=True)
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+        #the key is forgotten once the call is done, the next read computes again
+        self.assertEqual(self.flight.calls, {})
+        self.assertIsInstance((await asyncio.gather(self.flight.do('key', fail), return_exceptions=True))[0], ValueError)
+        self.assertEqual(len(calls), 2)
+
+    @override_settings(SINGLEFLIGHT_SHARED=True, SINGLEFLIGHT_POLL_INTERVAL=0.01)
+    async def test_shared_result(self):
+        compute = Mock(return_value='computed')
+
+        async def function():
+            return compute()
+
+        #another process holds the lock and stores its result while this one waits
+        await cache.aadd('singleflight-lock:test:key', True, 5)
+
+        async def other_process():
+            await asyncio.sleep(0.05)
+            await cache.aset(result_cache_key('test', 'key'), 'shared', 1)
+
+        result, _ = await asyncio.gather(self.flight.do('key', function), other_process())
+
+        self.assertEqual(result, 'shared')
+        compute.assert_not_called()
+
+        #without a lock this process leads and stores its result for the others
+        await cache.aclear()
+        self.assertEqual(await self.flight.do('key', function), 'computed')
+        self.assertEqual(await cache.aget(result_cache_key('test', 'key')), 'computed')
+        self.assertIsNone(await cache.aget('singleflight-lock:test:key'))
+
+
+    @override_settings(SINGLEFLIGHT_SHARED=True, SINGLEFLIGHT_POLL_INTERVAL=0.01, SINGLEFLIGHT_LOCK_TIMEOUT=0.05)
+    async def test_lock_timeout(self):
+        async def function():
+            return 'computed'
+
+        #another process holds the lock and does not store a result in time, this one computes on its own
+        await cache.aadd('singleflight-lock:test:key', 'other', 5)
+
+        self.assertEqual(await self.flight.do('key', function), 'computed')
+        #the lock of the other process is kept
+        self.assertEqual(await cache.aget('singleflight-lock:test:key'), 'other')
+
+
+#the change log only returns the changes of committed transactions, so these tests commit their writes
+class TestChanges(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        heads.clear()
+        self.changes_url = reverse('postChanges')
+
+    def create_post(self, user_id="7", caption="Caption"):
+        response = self.client.post(reverse('newPost'), {"user_id": user_id, "username": "changes", "caption": caption,
+                                                         "content": "content"})
+        return response.json()['post_id']
+
+    def test_changes(self):
+        post_id = self.create_post()
+        other_post_id = self.create_post(user_id="8")
+        self.client.patch(reverse('updatePost', args=[post_id]), data=json.dumps({"caption": "Updated"}),
+                          content_type="application/json")
+        self.client.delete(reverse('deletePost', args=[other_post_id]))
+
+        response = self.client.get(self.changes_url).json()
+        self.assertEqual([(change['type'], change['post_id']) for change in response['changes']],
+                         [('created', post_id), ('created', other_post_id), ('updated', post_id),
+                          ('deleted', other_post_id)])
+        self.assertEqual(response['changes'][2]['fields'], ['caption'])
+
+        #only the changes after the cursor are returned
+        page = self.client.get(self.changes_url, {'limit': 3}).json()
+        self.assertEqual(len(page['changes']), 3)
+        rest = self.client.get(self.changes_url, {'since': page['next_cursor']}).json()
+        self.assertEqual(rest['changes'], response['changes'][3:])
+        self.assertEqual(self.client.get(self.changes_url, {'since': rest['next_cursor']}).json()['changes'], [])
+
+        changes = self.client.get(self.changes_url, {'user_id': '8'}).json()['changes']
+        self.assertEqual([change['type'] for change in changes], ['created', 'deleted'])
+        self.assertEqual(self.client.get(self.changes_url, {'since': 'now'}).json()['changes'], [])
+
+        self.assertEqual(self.client.get(self.changes_url, {'since': 'invalid'}).status_code, 400)
+        self.assertEqual(self.client.get(self.changes_url, {'wait': 1000}).status_code, 400)
+        with override_settings(POSTS_CHANGES_RETENTION_DAYS=0):
+            self.assertEqual(self.client.get(self.changes_url, {'since': rest['next_cursor']}).status_code, 410)
+
+    def test_expired_changes(self):
+        self.create_post()
+        behind = self.client.get(self.changes_url, {'limit': 1}).json()['next_cursor']
+        self.create_post()
+        self.create_post()
+
+        #the cursor was just issued but points before changes that expire, they are not skipped silently
+        self.assertEqual(expire_changes(timezone.now(), batch_size=2), 3)
+        self.assertEqual(self.client.get(self.changes_url, {'since': behind}).status_code, 410)
+        self.assertEqual(self.client.get(self.changes_url, {'since': behind, 'stream': 'sse'}).status_code, 410)
+
+        #without a cursor the log is read after the expired changes
+        post_id = self.create_post()
+        response = self.client.get(self.changes_url).json()
+        self.assertEqual([change['post_id'] for change in response['changes']], [post_id])
+        self.assertEqual(self.client.get(self.changes_url, {'since': response['next_cursor']}).status_code, 200)
+
+    def test_running_transactions_are_not_read(self):
+        position = latest_position('default')
+
+        #the change is read once its transaction has committed, not when its id was taken
+        with transaction.atomic():
+            record_changes(PostChange.CREATED, [Post(user_id="7")])
+            self.assertEqual(read_changes('default', position, 10), ([], position))
+
+        changes, next_position = read_changes('default', position, 10)
+        self.assertEqual([change['type'] for _, change in changes], ['created'])
+        self.assertGreater(next_position, position)
+
+    @override_settings(POSTS_CHANGES_POLL_INTERVAL=0.05)
+    async def test_long_poll(self):
+        cursor = (await self.async_client.get(self.changes_url, {'since': 'now'})).json()['next_cursor']
+
+        async def create_later():
+            await asyncio.sleep(0.3)
+            return await sync_to_async(self.create_post)()
+
+        started = time.monotonic()
+        response, post_id = await asyncio.gather(self.async_client.get(self.changes_url, {'since': cursor, 'wait': 10}),
+                                                 create_later())
+
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertEqual([change['post_id'] for change in response.json()['changes']], [post_id])
+
+    @override_settings(POSTS_CHANGES_POLL_INTERVAL=0.05, POSTS_CHANGES_HEARTBEAT=1, POSTS_CHANGES_STREAM_SECONDS=2)
+    async def test_server_sent_events(self):
+        post_id = await sync_to_async(self.create_post)()
+
+        response = await self.async_client.get(self.changes_url, {'stream': 'sse'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+        event = body.split('\n\n')[1].splitlines()
+        self.assertEqual(event[1], 'event: created')
+        self.assertEqual(json.loads(event[2][len('data: '):])['post_id'], post_id)
+        self.assertIn(': keep-alive', body)
+
+        #a reconnecting client continues after its last event
+        cursor = event[0][len('id: '):]
+        response = await self.async_client.get(self.changes_url, headers={'Last-Event-ID': cursor})
+        self.assertEqual(response.json()['changes'], [])
+
+    def test_compact_changes(self):
+        post_id = self.create_post()
+        for caption in ("First", "Second"):
+            self.client.patch(reverse('updatePost', args=[post_id]), data=json.dumps({"caption": caption}),
+                              content_type="application/json")
+        deleted_post_id = self.create_post()
+        self.client.delete(reverse('deletePost', args=[deleted_post_id]))
+        PostChange.objects.update(created_at=timezone.now() - timedelta(hours=2))
+        self.create_post()
+
+        call_command('compact_changes', stdout=StringIO())
+
+        #only the newest change of every post remains, an update that absorbed older changes has no fields
+        changes = self.client.get(self.changes_url).json()['changes']
+        self.assertEqual([(change['type'], change['fields']) for change in changes],
+                         [('updated', None), ('deleted', None), ('created', None)])
+        self.assertEqual(changes[0]['post_id'], post_id)
+
+        PostChange.objects.update(created_at=timezone.now() - timedelta(days=30))
+        call_command('compact_changes', stdout=StringIO())
+        self.assertFalse(PostChange.objects.exists())
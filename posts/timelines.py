@@ -0,0 +1,147 @@
+import heapq
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from posts.models import Post, TagTimelineEntry, TagTimelineTrim
+from posts.pagination import finish_page, page_queryset, parse_limit
+from posts.serialization import ROW_FIELDS
+
+
+"""
+This function adds a post to the timelines of the given tags and trims these timelines to TAG_TIMELINE_LENGTH entries.
+"""
+
+def add_to_timelines(post, tags):
+    add_many_to_timelines([(post, tags)])
+
+
+"""
+This function adds many posts to the timelines of their tags at once, a list of (post, tags) is given.
+Every timeline that got new posts is trimmed once.
+"""
+
+def add_many_to_timelines(tagged_posts):
+    if not settings.FEED_TIMELINES:
+        return
+
+    entries = [TagTimelineEntry(tag=tag, post_id=post.post_id, created_at=post.created_at)
+               for post, tags in tagged_posts for tag in set(tags)]
+    if not entries:
+        return
+
+    TagTimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+    for tag in {entry.tag for entry in entries}:
+        trim_timeline(tag)
+
+
+"""
+This function removes a post from the timelines of the given tags (after the tags were removed from the post).
+"""
+
+def remove_from_timelines(post, tags):
+    if not settings.FEED_TIMELINES or not tags:
+        return
+
+    TagTimelineEntry.objects.filter(post_id=post.post_id, tag__in=set(tags)).delete()
+
+
+"""
+This function removes the entries of a tag's timeline that are older than its newest TAG_TIMELINE_LENGTH entries.
+Only the index of the timeline is read, so the cost depends on the cap and not on the number of posts.
+The newest removed position is kept as the trim watermark of the tag (see TagTimelineTrim).
+"""
+
+def trim_timeline(tag):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            WITH trimmed AS (
+                DELETE FROM posts_tagtimelineentry
+                WHERE tag = %s AND (created_at, post_id) < (
+                    SELECT created_at, post_id FROM posts_tagtimelineentry
+                    WHERE tag = %s ORDER BY created_at DESC, post_id DESC OFFSET %s LIMIT 1
+                )
+                RETURNING created_at, post_id
+            )
+            INSERT INTO posts_tagtimelinetrim (tag, created_at, post_id)
+            SELECT %s, created_at, post_id FROM trimmed ORDER BY created_at DESC, post_id DESC LIMIT 1
+            ON CONFLICT (tag) DO UPDATE SET created_at = EXCLUDED.created_at, post_id = EXCLUDED.post_id
+            WHERE (EXCLUDED.created_at, EXCLUDED.post_id) > (posts_tagtimelinetrim.created_at, posts_tagtimelinetrim.post_id)
+            """,
+            [tag, tag, settings.TAG_TIMELINE_LENGTH - 1, tag]
+        )
+
+
+"""
+This function gets one page of the tag feed from the timelines of the tags: the pages of the single timelines
+(each already sorted by created_at and post_id) are merged, and posts with several of the tags are only taken once.
+The page and its cursor are the same as with apaginate on the posts table.
+None is returned if the page reaches the trim watermark of a timeline (or the timeline ran out and it was trimmed),
+then there can be older posts with the tag that the timeline does not have and the feed is read from the posts table.
+"""
+
+async def timeline_page(tags, cursor=None, limit=None):
+    limit = parse_limit(limit)
+    timelines = []
+
+    for tag in set(tags):
+        entries = TagTimelineEntry.objects.filter(tag=tag).values('created_at', 'post_id')
+        entries = [entry async for entry in page_queryset(entries, cursor, limit)]
+
+        #deletes and retags shorten a trimmed timeline too, so the watermark and not the length tells if it is complete
+        trim = await TagTimelineTrim.objects.filter(tag=tag).afirst()
+        if trim is not None and (len(entries) <= limit or
+                                 (entries[-1]['created_at'], entries[-1]['post_id']) <= (trim.created_at, trim.post_id)):
+            return None
+
+        timelines.append(entries)
+
+    merged = []
+    for entry in heapq.merge(*timelines, key=lambda entry: (entry['created_at'], entry['post_id']), reverse=True):
+        if merged and merged[-1]['post_id'] == entry['post_id']:
+            continue
+
+        merged.append(entry)
+        if len(merged) > limit:
+            break
+
+    entries, next_cursor = finish_page(merged, limit)
+
+    #get the posts of the page and put them in the order of the timelines,
+    #the created_at range of the page limits the query to the partitions of these posts
+    post_ids = [entry['post_id'] for entry in entries]
+    posts = Post.objects.filter(post_id__in=post_ids)
+    if entries:
+        posts = posts.filter(created_at__range=(entries[-1]['created_at'], entries[0]['created_at']))
+    rows = {post['post_id']: post async for post in posts.values(*ROW_FIELDS)}
+
+    return [rows[post_id] for post_id in post_ids if post_id in rows], next_cursor
+
+
+"""
+This function rebuilds all timelines from the posts table: every tag gets its newest TAG_TIMELINE_LENGTH posts,
+and the tags with more posts get the position of their next post as trim watermark.
+"""
+
+def rebuild_timelines():
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("DELETE FROM posts_tagtimelineentry")
+        cursor.execute("DELETE FROM posts_tagtimelinetrim")
+        cursor.execute(
+            """
+            WITH ranked AS MATERIALIZED (
+                SELECT tag, post_id, created_at,
+                       row_number() OVER (PARTITION BY tag ORDER BY created_at DESC, post_id DESC) AS position
+                FROM (SELECT DISTINCT tag, post_id, created_at FROM posts_post, unnest(tags) AS tag) tagged
+            ), trims AS (
+                INSERT INTO posts_tagtimelinetrim (tag, created_at, post_id)
+                SELECT tag, created_at, post_id FROM ranked WHERE position = %s + 1
+            )
+            INSERT INTO posts_tagtimelineentry (tag, post_id, created_at)
+            SELECT tag, post_id, created_at FROM ranked WHERE position <= %s
+            """,
+            [settings.TAG_TIMELINE_LENGTH, settings.TAG_TIMELINE_LENGTH]
+        )
+        return cursor.rowcount
@@ -0,0 +1,133 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from posts.metrics import Counter, Histogram
+
+REQUEST_DURATION = Histogram('posts_request_duration_seconds', "Duration of the requests.", ('view', 'method'))
+REQUESTS = Counter('posts_requests_total', "Number of requests.", ('view', 'method', 'status'))
+SPAN_SECONDS = Counter('posts_span_seconds_total',
+                       "Time spent in db queries, outbound calls per service and serialization.", ('view', 'span'))
+SPAN_CALLS = Counter('posts_span_calls_total',
+                     "Number of db queries, outbound calls per service and serializations.", ('view', 'span'))
+
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+"""
+This class collects the time and number of calls of each span (db, media, interactions, serialize) of one request.
+Spans can be recorded from several threads at the same time (concurrent media requests).
+"""
+
+class RequestTimings:
+    def __init__(self):
+        self.spans = {}
+        self.lock = threading.Lock()
+
+    def record(self, span, seconds):
+        with self.lock:
+            total, calls = self.spans.get(span, (0.0, 0))
+            self.spans[span] = (total + seconds, calls + 1)
+
+    def server_timing(self, total):
+        entries = [f'{span};dur={seconds * 1000:.2f};desc="{calls} calls"'
+                   for span, (seconds, calls) in self.spans.items()]
+        entries.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(entries)
+
+
+"""
+This function records the duration of a span for the current request, if there is one.
+"""
+
+def record(span, seconds):
+    timings = current_timings.get()
+    if timings is not None:
+        timings.record(span, seconds)
+
+
+@contextmanager
+def timed(span):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(span, time.perf_counter() - started)
+
+
+"""
+This function is installed as execute wrapper on every db connection (see PostsConfig.ready),
+it records the duration of each query in the "db" span.
+"""
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        record('db', time.perf_counter() - started)
+
+
+def install_db_wrapper(sender, connection, **kwargs):
+    if db_execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(db_execute_wrapper)
+
+
+"""
+This middleware measures every request: the total duration, and the db, outbound and serialization spans.
+The spans are returned in the Server-Timing header and added to the metrics on /metrics.
+It supports sync and async views, so it does not force the async views to run in a thread.
+"""
+
+class TimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    def finish(self, request, response, timings, total):
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'unmatched'
+
+        REQUEST_DURATION.observe(total, view=view, method=request.method)
+        REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        for span, (seconds, calls) in timings.spans.items():
+            SPAN_SECONDS.inc(seconds, view=view, span=span)
+            SPAN_CALLS.inc(calls, view=view, span=span)
+
+        response['Server-Timing'] = timings.server_timing(total)
+        return response
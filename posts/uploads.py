@@ -0,0 +1,125 @@
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler
+
+from posts.clients import media_service
+from posts.metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+#totals of all media uploads of this process, to see the throughput that is achieved
+upload_stats = {"uploads": 0, "bytes": 0, "seconds": 0.0}
+upload_stats_lock = threading.Lock()
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+"""
+This upload handler stops the upload of a request as soon as its files are bigger than MEDIA_UPLOAD_MAX_SIZE.
+It is the first handler in FILE_UPLOAD_HANDLERS and passes all data on to the next handlers unchanged.
+"""
+
+class SizeLimitUploadHandler(FileUploadHandler):
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.total_size = 0
+
+        #reject the request before reading it if the client already says that it is too large
+        if content_length and content_length > settings.MEDIA_UPLOAD_MAX_SIZE:
+            raise UploadTooLarge()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.total_size += len(raw_data)
+
+        if self.total_size > settings.MEDIA_UPLOAD_MAX_SIZE:
+            raise UploadTooLarge()
+
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+"""
+This class is a multipart/form-data body made from uploaded files, which is sent to the media microservice.
+The files are read chunk by chunk while the body is sent, so only one chunk per request is held in memory.
+The length of the body is known in advance, so it is sent with a Content-Length instead of chunked encoding.
+"""
+
+class MultipartStream:
+    def __init__(self, files):
+        self.boundary = uuid.uuid4().hex
+        self.parts = []
+
+        for field, uploaded_files in files.lists():
+            for uploaded in uploaded_files:
+                filename = uploaded.name.replace('"', '%22')
+                header = (
+                    f'--{self.boundary}\r\n'
+                    f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                    f'Content-Type: {uploaded.content_type or "application/octet-stream"}\r\n\r\n'
+                ).encode()
+                self.parts.append((header, uploaded))
+
+        self.footer = f'--{self.boundary}--\r\n'.encode()
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+
+    def __len__(self):
+        return sum(len(header) + uploaded.size + 2 for header, uploaded in self.parts) + len(self.footer)
+
+    def __iter__(self):
+        for header, uploaded in self.parts:
+            yield header
+
+            uploaded.seek(0)
+            for chunk in uploaded.chunks(settings.MEDIA_UPLOAD_CHUNK_SIZE):
+                yield chunk
+
+            yield b'\r\n'
+
+        yield self.footer
+
+
+"""
+This function streams the uploaded files to the media microservice and records the throughput of the upload.
+The response of the media microservice is returned.
+"""
+
+def upload_media(files):
+    body = MultipartStream(files)
+    size = len(body)
+
+    started = time.monotonic()
+    response = media_service.post("/media", data=body, headers={'Content-Type': body.content_type})
+    seconds = time.monotonic() - started
+
+    with upload_stats_lock:
+        upload_stats["uploads"] += 1
+        upload_stats["bytes"] += size
+        upload_stats["seconds"] += seconds
+
+    logger.info("uploaded %d bytes of media in %.3fs (%.2f MB/s)", size, seconds, size / max(seconds, 1e-6) / 1e6)
+
+    return response
+
+
+def collect_upload_metrics():
+    with upload_stats_lock:
+        stats = dict(upload_stats)
+
+    return [
+        ('posts_media_uploads_total', 'counter', "Media uploads to the media microservice.", [({}, stats["uploads"])]),
+        ('posts_media_upload_bytes_total', 'counter', "Bytes uploaded to the media microservice.", [({}, stats["bytes"])]),
+        ('posts_media_upload_seconds_total', 'counter', "Time spent uploading media.", [({}, stats["seconds"])]),
+    ]
+
+
+register_collector(collect_upload_metrics)
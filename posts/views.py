@@ -1,29 +1,78 @@
-import os
-
 from django.shortcuts import get_object_or_404
-import json, requests
-from django.http import HttpResponse, JsonResponse, Http404
+import json, requests, uuid
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import router, transaction
+from django.http import HttpResponse, JsonResponse, Http404, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods
 from rest_framework.decorators import api_view
 
-from posts.models import Post
-
-MEDIA_SERVICE_URL = os.getenv("MEDIA_SERVICE_URL")
-INTERACTIONS_SERVICE_URL = os.getenv("INTERACTIONS_SERVICE_URL")
+from posts.bulk import create_posts
+from posts.caching import aget_media_map, aget_post, aget_posts, invalidate_post
+from posts.changes import (CursorExpired, change_events, decode_change_cursor, encode_change_cursor, expired_position,
+                           latest_position, next_changes, record_changes)
+from posts.clients import interactions_service, media_service
+from posts.conditional import not_modified, set_validators, validators
+from posts.database import db_pool_stats
+from posts.metrics import render as render_metrics
+from posts.models import Post, PostChange
+from posts.outbox import enqueue_post_delete
+from posts.pagination import apaginate, parse_limit
+from posts.ranking import aranked_feed
+from posts.routers import current_replica
+from posts.search import asearch
+from posts.serialization import ROW_FIELDS, FastJsonResponse, post_data
+from posts.singleflight import feed_flight, media_flight, post_flight
+from posts.snapshots import backfill_snapshots, take_snapshots
+from posts.streaming import stream_posts
+from posts.timelines import add_to_timelines, remove_from_timelines, timeline_page
+from posts.timing import timed
+from posts.uploads import UploadTooLarge, upload_media
 
 @api_view(['GET'])
 def health_check(request):
     return JsonResponse({"message": "Post Service running!"}, status=200)
 
 
+"""
+This function returns the metrics of this worker process in the Prometheus text format.
+"""
+
+@require_GET
+def metrics(request):
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8', status=200)
+
+
+"""
+This function returns the state of the connection pools to the other microservices and to the database,
+which is used to size the pools (MEDIA_POOL_SIZE, INTERACTIONS_POOL_SIZE, POSTGRES_POOL_MAX_SIZE) against the
+number of workers.
+"""
+
+@api_view(['GET'])
+def poolStats(request):
+    return JsonResponse({
+        **{client.name: client.pool_stats() for client in (media_service, interactions_service)},
+        "db": db_pool_stats(),
+    }, status=200)
+
+
 """
 This function creates a new post with the given data from the request.
-If there is media data, it is sent to the media microservice, which returns a json that contains the media_id's.
+If there is media data, it is streamed to the media microservice, which returns a json that contains the media_id's.
 A new post is then created and the posts id is returned. 
 """
 
 
 @api_view(['POST'])
 def newPost(request):
+    #parse the request, the upload is stopped if the media files are larger than MEDIA_UPLOAD_MAX_SIZE
+    try:
+        request.POST
+    except UploadTooLarge:
+        return HttpResponse("error: media files are too large", status=413)
+
     if request.POST.get('user_id') is None or request.POST.get('username') is None:
         return HttpResponse("missing data!", status=400)
 
@@ -32,6 +81,7 @@ def newPost(request):
     caption = request.POST.get('caption')
     user_id = request.POST.get('user_id')
     username = request.POST.get('username')
+    tags = request.POST.getlist('tags')
 
     #get the media files
     media_files = request.FILES
@@ -42,24 +92,79 @@ def newPost(request):
     #send the media files to the media microservice and recieve ids to store
     if media_files and media_files != {}:
         try:
-            response = requests.post(f"{MEDIA_SERVICE_URL}/media", files=media_files)
+            response = upload_media(media_files)
             response.raise_for_status()
             media = json.loads(response.content)
             media = media['IDs']
         except requests.HTTPError as e:
             return HttpResponse(f"Media service error: {e}", status=response.status_code)
 
-    #create the post with all the given data + the media ids and store it in the db
-    post = Post.objects.create(caption=caption, content=content, username=username,
-                        user_id=user_id, media=media)
+    #create the post with all the given data + the media ids and store it in the db and the timelines of its tags
+    post = Post(caption=caption, content=content, username=username, user_id=user_id, media=media, tags=tags)
+
+    #store the media data with the post, so reading the post needs no media requests
+    take_snapshots([post])
+
+    with transaction.atomic():
+        post.save(force_insert=True)
+        add_to_timelines(post, tags)
+        record_changes(PostChange.CREATED, [post])
 
     return JsonResponse({'post_id': post.post_id}, status=200)
 
 
+"""
+This function creates many posts in one request, the body is a JSON {"posts": [...]} with the same fields as newPost
+(media is a list of media_ids that were already uploaded to the media microservice).
+All valid posts are inserted at once in one transaction, invalid posts are reported without failing the others.
+A list with the post_id or the error of every post is returned, in the order of the request.
+"""
+
+@api_view(['POST'])
+def bulkPosts(request):
+    try:
+        items = json.loads(request.body)['posts']
+    except (ValueError, KeyError, TypeError):
+        return HttpResponse("error: the body must be a JSON object with a list \"posts\"", status=400)
+
+    if not isinstance(items, list):
+        return HttpResponse("error: the body must be a JSON object with a list \"posts\"", status=400)
+
+    if len(items) > settings.POSTS_MAX_BATCH_SIZE:
+        return HttpResponse(f"error: at most {settings.POSTS_MAX_BATCH_SIZE} posts per request", status=400)
+
+    return JsonResponse({"results": create_posts(items)}, status=200)
+
+
+"""
+This function is the webhook of the media microservice for changed media, the body is a JSON {"media_ids": [...]}.
+The media snapshots of all posts with one of these media are fetched again (see backfill_snapshots),
+posts whose media could not be fetched are read with live media requests until they are backfilled.
+The number of refreshed posts is returned.
+"""
+
+@api_view(['POST'])
+def mediaChanged(request):
+    try:
+        media_ids = json.loads(request.body)['media_ids']
+    except (ValueError, KeyError, TypeError):
+        return HttpResponse("error: the body must be a JSON object with a list \"media_ids\"", status=400)
+
+    if not isinstance(media_ids, list) or not media_ids:
+        return HttpResponse("error: the body must be a JSON object with a list \"media_ids\"", status=400)
+
+    if len(media_ids) > settings.POSTS_MAX_BATCH_SIZE:
+        return HttpResponse(f"error: at most {settings.POSTS_MAX_BATCH_SIZE} media ids per request", status=400)
+
+    refreshed, failed = backfill_snapshots(media_ids)
+    return JsonResponse({"refreshed": refreshed, "failed": failed}, status=200)
+
+
 """
 This function deletes a post with a certain post_id.
-The function sends the saved media id's to the media microservice, which then also deletes the media.
-A delete request is also made to the interactions microservice, which handles the comments, likes etc.
+The delete requests for the saved media id's (media microservice) and for the comments, likes etc.
+(interactions microservice) are written to the outbox in the same transaction and sent later by drain_outbox,
+so the post is deleted right away and nothing is left behind if another microservice is down.
 """
 
 @api_view(['DELETE'])
@@ -67,24 +172,16 @@ def deletePost(request, post_id):
     try:
         token = request.headers.get("Authorization")
 
-        # get post from db with post_id
-        post = get_object_or_404(Post, post_id=post_id)
-
-        for media in post.media:
-            #send a delete request for each media id
-            media_response = requests.delete(f'{MEDIA_SERVICE_URL}/media/{media}')
-
-            if media_response.status_code == 500:
-                return HttpResponse("error: internal server error", status=500)
+        with transaction.atomic():
+            # get post from db with post_id
+            post = get_object_or_404(Post, post_id=post_id)
 
-        #delete the interactions
-        interactions_response = requests.delete(f'{INTERACTIONS_SERVICE_URL}/internal/post/{post.post_id}', headers={'Authorization': token})
+            #delete the post and queue the deletes of its media and interactions
+            enqueue_post_delete(post, token)
+            record_changes(PostChange.DELETED, [post])
+            post.delete()
 
-        if interactions_response.status_code != 200:
-            return HttpResponse("error with deleting the comments", status=interactions_response.status_code)
-
-        #delete the post
-        post.delete()
+        invalidate_post(post_id)
         return HttpResponse('post deleted', status=200)
 
     except Http404:
@@ -102,10 +199,12 @@ def updatePost(request, post_id):
     post = get_object_or_404(Post, post_id=post_id) #get post from db with post_id
     body = json.loads(request.body)
     updated_fields = {}
+    old_tags = set(post.tags)
 
     #update each key that was requested
     for key, value in body.items():
-        if key == "media":
+        #the media snapshot belongs to the media, it is only changed by the media refresh
+        if key in ("media", "media_snapshot", "media_snapshot_version"):
             continue
 
         #check if the post has the key field that is requested to be updated
@@ -118,128 +217,306 @@ def updatePost(request, post_id):
 
     #update the post
     if updated_fields:
-        post.save(update_fields=updated_fields.keys())
+        with transaction.atomic():
+            post.save(update_fields=[*updated_fields.keys(), 'updated_at'])
+            record_changes(PostChange.UPDATED, [post], list(updated_fields))
 
-    return JsonResponse(updated_fields, status=200)
+            #move the post to the timelines of its new tags
+            if "tags" in updated_fields:
+                add_to_timelines(post, set(post.tags) - old_tags)
+                remove_from_timelines(post, old_tags - set(post.tags))
 
+        invalidate_post(post_id)
 
-"""
-This function gets the media data for a post by sending a get request to the media microservice.
-It then builds the post data to be returned as a get response for this microservice.  
-"""
-
-def getData(post):
-    media_response = None
-    media_json = None
-
-    #check if the post has media_ids to send to the media microservice
-    if post.media != []:
-        response = requests.get(
-            f'{MEDIA_SERVICE_URL}/media',
-            data=json.dumps(post.media),
-            headers={'Content-Type': 'application/json'}
-        )
-
-        #parse the response body
-        media_json = response.json()
-        media_response = response.status_code
-
-    if media_response == 200:
-        post_data = {
-            "post_id": post.post_id,
-            "caption": post.caption,
-            "content": post.content,
-            "username": post.username,
-            "user_id": post.user_id,
-            "created_at": post.created_at,
-            "updated_at": post.updated_at,
-            "media": media_json,
-        }
-    else:
-        #if the media microservice returned an error or None, leave the media field as an empty list
-        post_data = {
-            "post_id": post.post_id,
-            "caption": post.caption,
-            "content": post.content,
-            "username": post.username,
-            "user_id": post.user_id,
-            "created_at": post.created_at,
-            "updated_at": post.updated_at,
-            "media": [],
-        }
-
-    return post_data
+    return JsonResponse(updated_fields, status=200)
 
 
 """
 This function gets the post data for a given post_id.
 If no media is found or if there was a problem with the media microservice,
 the posts data is returned with no media data and with status code 204.
+Like the other read endpoints this is an async view, so under ASGI a worker serves other requests while it waits.
+The response has an ETag and Last-Modified (from updated_at), requests with a matching If-None-Match or
+If-Modified-Since get a 304 without a body.
 """
 
-@api_view(['GET'])
-def getPosts(request, post_id):
+@csrf_exempt
+@require_GET
+async def getPosts(request, post_id):
     try:
-        #get post from db with post_id
-        post = get_object_or_404(Post, post_id=post_id)
-        post_data = getData(post)
+        #get post from the cache or db with post_id, concurrent requests for the same post share one read
+        post = await post_flight.do(str(post_id), lambda: aget_post(post_id))
+
+        #the client already has this version of the post
+        etag, last_modified = validators([post])
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
 
-        return JsonResponse(post_data, status=200, safe=False)
+        media_map = await media_flight.do(etag, lambda: aget_media_map([post]))
+
+        with timed('serialize'):
+            response = FastJsonResponse(post_data(post, media_map), status=200)
+            return set_validators(response, etag, last_modified, media_map)
 
     except Http404:
         return HttpResponse({"error": "Post not found"}, status=404)
 
 
 """
-This function gets all posts from a certain user_id.
+This function gets one page of posts from a certain user_id, newest posts first.
+The page size is set with the query parameter "limit", the next page is requested with "cursor"=next_cursor.
 If there was a problem with the media microservice, the media for that post is left empty.
-A JSON containing all posts from the user is returned.
+A JSON containing the posts of the page and the next_cursor (None on the last page) is returned.
+Like getPosts the page has an ETag and Last-Modified and is not sent again (304) if it did not change.
+With "stream"=json or ndjson all posts (after "cursor", at most "limit") are streamed instead, see streaming.py.
 """
 
-@api_view(['GET'])
-def userPosts(request, user_id):
+@csrf_exempt
+@require_GET
+async def userPosts(request, user_id):
+    cursor = request.GET.get('cursor')
+
+    if request.GET.get('stream'):
+        try:
+            return stream_posts(request, Post.objects.filter(user_id=user_id))
+        except ValueError as e:
+            return HttpResponse(f"error: {e}", status=400)
 
-    # get all posts from db with user_id
-    posts = Post.objects.filter(user_id=user_id)
-    post_list = []
+    # get one page of posts from db with user_id
+    try:
+        posts, next_cursor = await apaginate(Post.objects.filter(user_id=user_id).values(*ROW_FIELDS), cursor,
+                                             request.GET.get('limit'))
+    except ValueError as e:
+        return HttpResponse(f"error: {e}", status=400)
 
     #check if the user has any posts
-    if not posts.exists():
+    if not posts and not cursor:
         return JsonResponse({"message": "No posts found for this user"}, status=404)
 
-    #iterate through the posts and get the media data
-    for post in posts:
-        post_data = getData(post)
-        post_list.append(post_data)
+    #the client already has this version of the page
+    etag, last_modified = validators(posts, next_cursor)
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
 
-    return JsonResponse(post_list, status=200, safe=False)
+    #get the media data of all posts at once and build the post data
+    media_map = await aget_media_map(posts)
 
+    with timed('serialize'):
+        post_list = [post_data(post, media_map) for post in posts]
+        response = FastJsonResponse({"posts": post_list, "next_cursor": next_cursor}, status=200)
+        return set_validators(response, etag, last_modified, media_map)
 
-@api_view(['GET'])
-def getFeedPosts(request):
+
+"""
+This function gets one page of the feed, newest posts first.
+If the query list "tags" is given, only posts that contain at least one of the tags are returned.
+With FEED_TIMELINES these posts are merged from the timelines of the tags, see timelines.py.
+With "ranked"=true the best posts of the newest candidates are returned instead, with their score and no next_cursor
+(see ranking.py).
+Pagination, conditional requests and streaming work like in userPosts, with the query parameters "limit", "cursor"
+and "stream" (a stream is read from the posts table, a ranked feed can not be streamed).
+"""
+
+@csrf_exempt
+@require_GET
+async def getFeedPosts(request):
     #extract tags from the request from the request query
-    tags = request.query_params.getlist('tags', [])
-    post_list = []
+    tags = request.GET.getlist('tags', [])
+    cursor = request.GET.get('cursor')
 
-    if not tags:
-        posts = Post.objects.all()[:200]
+    if request.GET.get('stream'):
+        if request.GET.get('ranked', '').lower() in ('1', 'true'):
+            return HttpResponse("error: a ranked feed can not be streamed", status=400)
 
-        for post in posts:
-            post_data = getData(post)
-            post_list.append(post_data)
+        posts = Post.objects.filter(tags__overlap=tags) if tags else Post.objects.all()
+        try:
+            return stream_posts(request, posts, status=201 if not tags else 200)
+        except ValueError as e:
+            return HttpResponse(f"error: {e}", status=400)
+
+    ranked = request.GET.get('ranked', '').lower() in ('1', 'true')
+    limit = request.GET.get('limit')
 
-        #return the first 200 posts
-        return JsonResponse(post_list, status=201, safe=False)
+    #identical concurrent feed requests (that read from the same db) share one page
+    key = json.dumps([sorted(set(tags)), cursor, limit, ranked, current_replica.get()])
+    try:
+        page = await feed_flight.do(key, lambda: feed_page(tags, cursor, limit, ranked))
+    except ValueError as e:
+        return HttpResponse(f"error: {e}", status=400)
 
-    #gets all the posts that contain tags from the request query list "tags"
-    posts = Post.objects.filter(tags__overlap=tags)
+    posts, next_cursor = page
 
-    if not posts.exists():
+    if tags and not posts and not cursor:
         return JsonResponse({"message": "No posts found for the given tags"}, status=405)
 
-    #iterate through all the posts that contain the tags and append them to a list
-    for post in posts:
-        post_data = getData(post)
-        post_list.append(post_data)
+    #the client already has this version of the page
+    etag, last_modified = validators(posts, next_cursor)
+    response = not_modified(request, etag, last_modified)
+    if response is not None:
+        return response
+
+    #get the media data of all posts at once and append the posts to a list
+    media_map = await media_flight.do(etag, lambda: aget_media_map(posts))
+
+    with timed('serialize'):
+        post_list = [post_data(post, media_map) for post in posts]
+        response = FastJsonResponse({"posts": post_list, "next_cursor": next_cursor}, status=201 if not tags else 200)
+        return set_validators(response, etag, last_modified, media_map)
+
+
+"""
+This function loads one page of the feed (posts and next_cursor) for getFeedPosts: the ranked feed, the page merged
+from the tag timelines, or the page of the posts table. A ValueError is raised if the cursor or limit is not valid.
+"""
+
+async def feed_page(tags, cursor, limit, ranked):
+    if ranked:
+        return await aranked_feed(tags, parse_limit(limit)), None
+
+    page = None
+    if tags and settings.FEED_TIMELINES:
+        page = await timeline_page(tags, cursor, limit)
+
+    #gets the posts that contain tags from the request query list "tags", or all posts if there are no tags
+    if page is None:
+        posts = Post.objects.filter(tags__overlap=tags) if tags else Post.objects.all()
+        page = await apaginate(posts.values(*ROW_FIELDS), cursor, limit)
+
+    return page
+
+
+"""
+This function searches the caption, content and tags of all posts for the query parameter "q".
+The posts are ranked by how well they match (best first, with their "rank"), see search.py.
+Pagination works like in userPosts with the query parameters "limit" and "cursor".
+"""
+
+@csrf_exempt
+@require_GET
+async def searchPosts(request):
+    q = request.GET.get('q', '').strip()
+    if not q:
+        return HttpResponse("error: missing search query q", status=400)
+
+    try:
+        posts, next_cursor = await asearch(q, request.GET.get('cursor'), request.GET.get('limit'))
+    except ValueError as e:
+        return HttpResponse(f"error: {e}", status=400)
+
+    #get the media data of all posts at once and build the post data
+    media_map = await aget_media_map(posts)
 
-    return JsonResponse(post_list, status=200, safe=False)
\ No newline at end of file
+    with timed('serialize'):
+        post_list = [post_data(post, media_map) for post in posts]
+        return FastJsonResponse({"posts": post_list, "next_cursor": next_cursor}, status=200)
+
+
+"""
+This function gets many posts by their post_ids in one request, with one db query and one batched media request.
+The post_ids are given as the query list "ids" (GET) or as a JSON {"ids": [...]} (POST, for long lists).
+The posts are returned in the order of the ids, ids that are invalid or not found are reported in "errors".
+"""
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+async def batchPosts(request):
+    if request.method == "POST":
+        try:
+            ids = json.loads(request.body)['ids']
+        except (ValueError, KeyError, TypeError):
+            return HttpResponse("error: the body must be a JSON object with a list \"ids\"", status=400)
+    else:
+        ids = request.GET.getlist('ids')
+
+    if not isinstance(ids, list):
+        return HttpResponse("error: the body must be a JSON object with a list \"ids\"", status=400)
+
+    if len(ids) > settings.POSTS_MAX_BATCH_SIZE:
+        return HttpResponse(f"error: at most {settings.POSTS_MAX_BATCH_SIZE} posts per request", status=400)
+
+    #parse the post_ids, duplicates are only returned once
+    post_ids = []
+    errors = []
+    for post_id in ids:
+        try:
+            post_id = uuid.UUID(str(post_id))
+        except ValueError:
+            errors.append({"post_id": post_id, "error": "invalid post_id"})
+            continue
+
+        if post_id not in post_ids:
+            post_ids.append(post_id)
+
+    #get the posts from the cache or db and their media data at once
+    rows = await aget_posts(post_ids)
+    posts = [rows[post_id] for post_id in post_ids if post_id in rows]
+    errors += [{"post_id": str(post_id), "error": "Post not found"} for post_id in post_ids if post_id not in rows]
+
+    media_map = await aget_media_map(posts)
+
+    with timed('serialize'):
+        post_list = [post_data(post, media_map) for post in posts]
+        return FastJsonResponse({"posts": post_list, "errors": errors}, status=200)
+
+
+"""
+This function returns the changes of the posts (created, updated and deleted, oldest first) after the cursor "since",
+so consumers read only what changed instead of reading the feed again. "since" is the next_cursor of the previous
+response; without it the whole (not expired) change log is returned, since=now starts at the newest change. The query parameter
+user_id returns only the changes of the posts of one user and limit the number of changes per response.
+With wait=<seconds> (at most POSTS_CHANGES_MAX_WAIT) the request waits for new changes if there are none (long-poll),
+with stream=sse the changes are streamed as server-sent events (the Last-Event-ID header continues a stream).
+A changed post can be read with /posts/batch/. A cursor older than POSTS_CHANGES_RETENTION_DAYS or before changes
+that were expired gets status 410, the consumer has to read the posts again and start with since=now.
+"""
+
+@csrf_exempt
+@require_GET
+async def postChanges(request):
+    db = router.db_for_read(PostChange)
+    since = request.GET.get('since') or request.headers.get('Last-Event-ID')
+
+    try:
+        limit = parse_limit(request.GET.get('limit'))
+        wait = float(request.GET.get('wait', 0))
+        if not 0 <= wait <= settings.POSTS_CHANGES_MAX_WAIT:
+            raise ValueError(f"wait must be between 0 and {settings.POSTS_CHANGES_MAX_WAIT} seconds")
+
+        if since == 'now':
+            position = await sync_to_async(latest_position)(db)
+        else:
+            position = decode_change_cursor(since) if since else None
+
+        #without a cursor the log is read from the oldest change that was not expired
+        expired = await sync_to_async(expired_position)(db)
+        if position is None:
+            position = expired
+        elif position < expired:
+            raise CursorExpired("the changes after the cursor have expired")
+    except CursorExpired as e:
+        return HttpResponse(f"error: {e}", status=410)
+    except ValueError as e:
+        return HttpResponse(f"error: {e}", status=400)
+
+    user_id = request.GET.get('user_id')
+
+    if request.GET.get('stream') == 'sse':
+        response = StreamingHttpResponse(change_events(db, position, limit, user_id), content_type='text/event-stream')
+        #proxies must not buffer the events
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    if request.GET.get('stream'):
+        return HttpResponse("error: stream must be sse", status=400)
+
+    try:
+        changes, position = await next_changes(db, position, limit, user_id, wait)
+    except CursorExpired as e:
+        return HttpResponse(f"error: {e}", status=410)
+    return FastJsonResponse({
+        "changes": [change for _, change in changes],
+        "next_cursor": encode_change_cursor(position),
+    }, status=200)
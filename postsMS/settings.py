@@ -38,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'posts.apps.PostsConfig',
     'corsheaders',
@@ -52,6 +53,8 @@ REST_FRAMEWORK = {
 """
 
 MIDDLEWARE = [
+    'posts.timing.TimingMiddleware',
+    'posts.routers.ReplicaMiddleware',
     'corsheaders.middleware.CorsMiddleware',  
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -95,9 +98,60 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'postgres'),
         'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
         'PORT': os.getenv('POSTGRES_PORT', '5432'),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Database connections
+# every worker process keeps a pool of open connections (psycopg pool) if POSTGRES_POOL is set (the default),
+# so requests do not connect to postgres again. Connections are checked (CONN_HEALTH_CHECKS) before they are used, closed after
+# POSTGRES_POOL_MAX_IDLE seconds unused and replaced after POSTGRES_POOL_MAX_LIFETIME seconds.
+# Without the pool, connections are kept open for POSTGRES_CONN_MAX_AGE seconds (0 closes them after every request).
+
+if os.getenv('POSTGRES_POOL', 'true').lower() in ('1', 'true', 'yes'):
+    DATABASES['default']['OPTIONS'] = {
+        'pool': {
+            'min_size': int(os.getenv('POSTGRES_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.getenv('POSTGRES_POOL_MAX_SIZE', '10')),
+            'timeout': float(os.getenv('POSTGRES_POOL_TIMEOUT', '10')),
+            'max_idle': float(os.getenv('POSTGRES_POOL_MAX_IDLE', '600')),
+            'max_lifetime': float(os.getenv('POSTGRES_POOL_MAX_LIFETIME', '3600')),
+        },
+    }
+else:
+    DATABASES['default']['CONN_MAX_AGE'] = int(os.getenv('POSTGRES_CONN_MAX_AGE', '0'))
+
+# Read replicas
+# POSTGRES_REPLICAS is a comma separated list of replica hosts (host or host:port, with the database POSTGRES_REPLICA_NAME
+# and the user and password of the primary). GET requests read from a healthy replica (see routers.py), except for
+# REPLICA_STICKY_SECONDS after a write of the same client (read-your-writes). A replica that can not be reached or lags
+# more than REPLICA_MAX_LAG seconds behind is not used until the next check, every REPLICA_CHECK_INTERVAL seconds.
+
+DATABASE_REPLICAS = []
+REPLICA_CONNECT_TIMEOUT = int(os.getenv('REPLICA_CONNECT_TIMEOUT', '2'))
+
+for index, replica in enumerate(filter(None, os.getenv('POSTGRES_REPLICAS', '').split(',')), start=1):
+    host, _, port = replica.strip().partition(':')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'NAME': os.getenv('POSTGRES_REPLICA_NAME', DATABASES['default']['NAME']),
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'OPTIONS': {**DATABASES['default'].get('OPTIONS', {}), 'connect_timeout': REPLICA_CONNECT_TIMEOUT},
+        'TEST': {'MIRROR': 'default'},
+    }
+    if 'pool' in DATABASES['default'].get('OPTIONS', {}):
+        DATABASES[f'replica{index}']['OPTIONS']['pool'] = {
+            **DATABASES['default']['OPTIONS']['pool'], 'timeout': REPLICA_CONNECT_TIMEOUT,
+        }
+    DATABASE_REPLICAS.append(f'replica{index}')
+
+DATABASE_ROUTERS = ['posts.routers.ReplicaRouter']
+
+REPLICA_STICKY_SECONDS = float(os.getenv('REPLICA_STICKY_SECONDS', '5'))
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', '5'))
+REPLICA_CHECK_INTERVAL = float(os.getenv('REPLICA_CHECK_INTERVAL', '10'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -140,4 +194,183 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-CORS_ALLOW_ALL_ORIGINS = True
\ No newline at end of file
+CORS_ALLOW_ALL_ORIGINS = True
+
+# Media microservice
+# media_ids are requested in chunks of this size when a list of posts is hydrated
+
+MEDIA_BATCH_SIZE = int(os.getenv('MEDIA_BATCH_SIZE', '100'))
+
+# at most MEDIA_MAX_CONCURRENCY chunks are requested at the same time,
+# every request times out after MEDIA_REQUEST_TIMEOUT seconds and the whole hydration after MEDIA_DEADLINE seconds
+
+MEDIA_MAX_CONCURRENCY = int(os.getenv('MEDIA_MAX_CONCURRENCY', '8'))
+MEDIA_REQUEST_TIMEOUT = float(os.getenv('MEDIA_REQUEST_TIMEOUT', '2'))
+MEDIA_DEADLINE = float(os.getenv('MEDIA_DEADLINE', '3'))
+
+# the media circuit breaker opens after MEDIA_BREAKER_FAILURES failed (or slower than MEDIA_BREAKER_SLOW_CALL seconds)
+# requests in a row, then media is not requested for MEDIA_BREAKER_RESET_TIMEOUT seconds until a probe request succeeds
+
+MEDIA_BREAKER_FAILURES = int(os.getenv('MEDIA_BREAKER_FAILURES', '5'))
+MEDIA_BREAKER_SLOW_CALL = float(os.getenv('MEDIA_BREAKER_SLOW_CALL', '1.5'))
+MEDIA_BREAKER_RESET_TIMEOUT = float(os.getenv('MEDIA_BREAKER_RESET_TIMEOUT', '10'))
+
+# the media data of a post is stored with the post when it is created (media snapshot), so reads need no media requests.
+# Snapshots of an older MEDIA_SNAPSHOT_VERSION are not used: raise it when the media data of the media microservice
+# changed for all media (like a new FileUrl format), reads then request the media again until
+# "manage.py backfill_media_snapshots" has refreshed the snapshots.
+
+MEDIA_SNAPSHOT_VERSION = int(os.getenv('MEDIA_SNAPSHOT_VERSION', '1'))
+
+
+# Pagination
+# number of posts per page of the feed and user posts, if the request has no "limit"
+
+POSTS_PAGE_SIZE = int(os.getenv('POSTS_PAGE_SIZE', '50'))
+POSTS_MAX_PAGE_SIZE = int(os.getenv('POSTS_MAX_PAGE_SIZE', '200'))
+
+# streamed lists (?stream=json or ndjson) are read from the db and hydrated in chunks of POSTS_STREAM_CHUNK_SIZE posts
+
+POSTS_STREAM_CHUNK_SIZE = int(os.getenv('POSTS_STREAM_CHUNK_SIZE', '500'))
+
+
+# Bulk requests
+# at most POSTS_MAX_BATCH_SIZE posts can be created with /posts/bulk/ or fetched with /posts/batch/ in one request
+
+POSTS_MAX_BATCH_SIZE = int(os.getenv('POSTS_MAX_BATCH_SIZE', '500'))
+
+
+# Cache
+# posts and their media are cached in redis (or any redis compatible store) if REDIS_URL is set,
+# otherwise in local memory. Both evict the least recently used entries when they are full.
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '10000')),
+            },
+        }
+    }
+
+POST_CACHE_TTL = int(os.getenv('POST_CACHE_TTL', '300'))
+MEDIA_CACHE_TTL = int(os.getenv('MEDIA_CACHE_TTL', '3600'))
+
+#a stale copy of the media is kept for MEDIA_STALE_TTL seconds, it is returned when the media microservice fails
+MEDIA_STALE_TTL = int(os.getenv('MEDIA_STALE_TTL', '86400'))
+
+
+# Request coalescing
+# concurrent identical reads of a post or feed page (and of their media) in one worker process wait for the first one
+# and share its result (see singleflight.py). With SINGLEFLIGHT_SHARED (needs REDIS_URL) the worker processes also
+# coordinate with a lock in the cache: results are shared for SINGLEFLIGHT_RESULT_TTL seconds, the others poll every
+# SINGLEFLIGHT_POLL_INTERVAL seconds and compute the result themselves after SINGLEFLIGHT_LOCK_TIMEOUT seconds.
+
+SINGLEFLIGHT = os.getenv('SINGLEFLIGHT', 'true').lower() in ('1', 'true', 'yes')
+SINGLEFLIGHT_SHARED = os.getenv('SINGLEFLIGHT_SHARED', 'false').lower() in ('1', 'true', 'yes')
+SINGLEFLIGHT_RESULT_TTL = int(os.getenv('SINGLEFLIGHT_RESULT_TTL', '1'))
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv('SINGLEFLIGHT_POLL_INTERVAL', '0.01'))
+SINGLEFLIGHT_LOCK_TIMEOUT = int(os.getenv('SINGLEFLIGHT_LOCK_TIMEOUT', '5'))
+
+
+# Outbound HTTP
+# every microservice client keeps a pool of keep-alive connections, the media pool should be at least MEDIA_MAX_CONCURRENCY.
+# Idempotent requests are retried HTTP_RETRIES times with exponential backoff (HTTP_RETRY_BACKOFF * 2^retry seconds),
+# except the media requests of a hydration, which are bounded by MEDIA_DEADLINE.
+
+MEDIA_POOL_SIZE = int(os.getenv('MEDIA_POOL_SIZE', '16'))
+INTERACTIONS_POOL_SIZE = int(os.getenv('INTERACTIONS_POOL_SIZE', '4'))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '2'))
+HTTP_RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', '0.1'))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '1'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '10'))
+
+
+# Outbox
+# delete requests for other microservices are sent by "manage.py drain_outbox" in batches of OUTBOX_BATCH_SIZE,
+# failed requests are retried with exponential backoff, at most OUTBOX_MAX_ATTEMPTS times. A batch is leased to its
+# worker for OUTBOX_LEASE_SECONDS, this should be longer than sending a batch takes (the deletes are idempotent,
+# an entry whose lease ran out may be sent twice)
+
+OUTBOX_BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '100'))
+OUTBOX_CONCURRENCY = int(os.getenv('OUTBOX_CONCURRENCY', '8'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '10'))
+OUTBOX_RETRY_BACKOFF = float(os.getenv('OUTBOX_RETRY_BACKOFF', '1'))
+OUTBOX_MAX_BACKOFF = float(os.getenv('OUTBOX_MAX_BACKOFF', '300'))
+OUTBOX_LEASE_SECONDS = int(os.getenv('OUTBOX_LEASE_SECONDS', '600'))
+
+
+# Media uploads
+# uploaded files larger than FILE_UPLOAD_MAX_MEMORY_SIZE are spooled to disk and streamed to the media microservice
+# in chunks of MEDIA_UPLOAD_CHUNK_SIZE bytes, requests with more than MEDIA_UPLOAD_MAX_SIZE bytes of files are rejected
+
+FILE_UPLOAD_HANDLERS = [
+    'posts.uploads.SizeLimitUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+MEDIA_UPLOAD_MAX_SIZE = int(os.getenv('MEDIA_UPLOAD_MAX_SIZE', str(100 * 1024 * 1024)))
+MEDIA_UPLOAD_CHUNK_SIZE = int(os.getenv('MEDIA_UPLOAD_CHUNK_SIZE', str(256 * 1024)))
+
+
+# Ranked feed
+# the ranked feed (/posts/feed/?ranked=true) scores the newest FEED_CANDIDATES posts (with one of the tags) and returns
+# the best ones. The score is the weighted sum of the scorers in FEED_SCORERS, scorers with weight 0 are not used.
+# The interaction counts are requested from the interactions microservice, which is off by default.
+
+FEED_CANDIDATES = int(os.getenv('FEED_CANDIDATES', '1000'))
+FEED_RECENCY_HALF_LIFE = float(os.getenv('FEED_RECENCY_HALF_LIFE', '24'))
+FEED_INTERACTIONS_TIMEOUT = float(os.getenv('FEED_INTERACTIONS_TIMEOUT', '0.5'))
+
+FEED_SCORERS = [
+    ('posts.ranking.RecencyScorer', float(os.getenv('FEED_RECENCY_WEIGHT', '1'))),
+    ('posts.ranking.TagOverlapScorer', float(os.getenv('FEED_TAG_WEIGHT', '0.5'))),
+    ('posts.ranking.InteractionScorer', float(os.getenv('FEED_INTERACTION_WEIGHT', '0'))),
+]
+
+
+# Partitions
+# posts_post has one partition per month (see partitions.py). "manage.py manage_partitions" (run it daily) creates the
+# partitions for the next POSTS_PARTITION_MONTHS_AHEAD months, posts of a month without partition go to the default
+# partition until it is created.
+# Partitions with posts older than POSTS_PARTITION_RETENTION_MONTHS months are detached and moved to the schema
+# POSTS_ARCHIVE_SCHEMA, 0 keeps all posts.
+
+POSTS_PARTITION_MONTHS_AHEAD = int(os.getenv('POSTS_PARTITION_MONTHS_AHEAD', '3'))
+POSTS_PARTITION_RETENTION_MONTHS = int(os.getenv('POSTS_PARTITION_RETENTION_MONTHS', '0'))
+POSTS_ARCHIVE_SCHEMA = os.getenv('POSTS_ARCHIVE_SCHEMA', 'posts_archive')
+
+
+# Change feed
+# every create, update and delete of a post is written to a change log that /posts/changes/ reads (see changes.py).
+# Waiting consumers (?wait= long-poll, at most POSTS_CHANGES_MAX_WAIT seconds, or ?stream=sse) are woken up when the log
+# changed, which every worker checks every POSTS_CHANGES_POLL_INTERVAL seconds. An event stream sends a comment every
+# POSTS_CHANGES_HEARTBEAT seconds and ends after POSTS_CHANGES_STREAM_SECONDS seconds (the client reconnects).
+# "manage.py compact_changes" (run it hourly) keeps only the newest change of every post for the changes older than
+# POSTS_CHANGES_COMPACT_AFTER_HOURS hours and deletes the changes older than POSTS_CHANGES_RETENTION_DAYS days,
+# cursors older than that are rejected.
+
+POSTS_CHANGES_MAX_WAIT = int(os.getenv('POSTS_CHANGES_MAX_WAIT', '30'))
+POSTS_CHANGES_POLL_INTERVAL = float(os.getenv('POSTS_CHANGES_POLL_INTERVAL', '0.5'))
+POSTS_CHANGES_HEARTBEAT = int(os.getenv('POSTS_CHANGES_HEARTBEAT', '15'))
+POSTS_CHANGES_STREAM_SECONDS = int(os.getenv('POSTS_CHANGES_STREAM_SECONDS', '300'))
+POSTS_CHANGES_COMPACT_AFTER_HOURS = int(os.getenv('POSTS_CHANGES_COMPACT_AFTER_HOURS', '1'))
+POSTS_CHANGES_RETENTION_DAYS = int(os.getenv('POSTS_CHANGES_RETENTION_DAYS', '7'))
+
+
+# Tag timelines
+# if FEED_TIMELINES is set, new and retagged posts are written to a timeline per tag (fan-out on write) and the tag feed
+# is merged from these timelines. Every timeline keeps the newest TAG_TIMELINE_LENGTH posts, deeper pages of the feed
+# are read from the posts table. Fill the timelines with "manage.py rebuild_timelines" before turning this on.
+
+FEED_TIMELINES = os.getenv('FEED_TIMELINES', 'false').lower() in ('1', 'true', 'yes')
+TAG_TIMELINE_LENGTH = int(os.getenv('TAG_TIMELINE_LENGTH', '1000'))
@@ -22,10 +22,17 @@ from posts import views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('posts/', views.newPost, name='newPost'),
+    path('posts/bulk/', views.bulkPosts, name='bulkPosts'),
+    path('posts/batch/', views.batchPosts, name='batchPosts'),
     path('posts/delete/<uuid:post_id>/', views.deletePost, name='deletePost'),
     path('posts/get/<uuid:post_id>/', views.getPosts, name='getPost'),
     path('posts/update/<uuid:post_id>/', views.updatePost, name='updatePost'),
     path('posts/users/<str:user_id>/', views.userPosts, name='getUserPosts'),
     path('posts/feed/', views.getFeedPosts, name='getFeedPosts'),
+    path('posts/search/', views.searchPosts, name='searchPosts'),
+    path('posts/changes/', views.postChanges, name='postChanges'),
+    path('posts/internal/media-changed/', views.mediaChanged, name='mediaChanged'),
+    path('posts/internal/pools/', views.poolStats, name='poolStats'),
+    path('metrics', views.metrics, name='metrics'),
     path('', views.health_check, name='healthCheck'),
 ]